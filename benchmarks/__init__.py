@@ -0,0 +1 @@
+# Benchmarks for occasionally. Run from the repository root, e.g. `python -m benchmarks.bench_priority_queue`
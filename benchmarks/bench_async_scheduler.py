@@ -0,0 +1,61 @@
+"""Measures throughput and firing latency of occasionally.async_scheduler.AsyncScheduler
+
+Schedules coroutines spread evenly over one interval, runs them for a fixed duration, and reports how many
+runs completed per second and how late they fired compared to their _next_invoke.
+
+Usage:
+    python -m benchmarks.bench_async_scheduler [--tasks 10000] [--interval 1.0] [--duration 5.0]
+"""
+import argparse
+import asyncio
+import time
+
+from occasionally.async_scheduler import AsyncScheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+async def probe(lateness, holder):
+    lateness.append(time.time() - holder[0]._next_invoke)
+    await asyncio.sleep(0)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(tasks, interval, duration):
+    scheduler = AsyncScheduler()
+    lateness = list()
+    start = time.time()
+    for index in range(tasks):
+        holder = list()
+        task = Task(probe, after_x_seconds(interval), call_args=(lateness, holder))
+        holder.append(task)
+        # spread the first runs over one interval instead of firing them all at once
+        task._next_invoke = start + interval * index / tasks
+        scheduler.enqueue(task)
+    asyncio.get_running_loop().call_later(duration, scheduler.stop)
+    await scheduler.run()
+    return lateness, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    lateness, elapsed = asyncio.run(run(args.tasks, args.interval, args.duration))
+    print("tasks:           %d" % args.tasks)
+    print("runs:            %d" % len(lateness))
+    print("runs/s:          %.0f (target %.0f)" % (len(lateness) / elapsed, args.tasks / args.interval))
+    print("latency p50 ms:  %.2f" % (percentile(lateness, 0.5) * 1000))
+    print("latency p99 ms:  %.2f" % (percentile(lateness, 0.99) * 1000))
+    print("latency max ms:  %.2f" % (max(lateness) * 1000))
+
+
+if __name__ == "__main__":
+    main()
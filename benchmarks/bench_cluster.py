@@ -0,0 +1,127 @@
+"""Runs a sharded occasionally.scheduler.Scheduler in several local processes
+
+Every process is a node with the same --tasks tasks and an occasionally.cluster.Cluster on a shared
+SQLiteLeaseBackend. Tasks are always due (interval 0) and each run waits --work seconds (or spins, with --cpu), so
+every node is saturated and throughput is limited by how many nodes share the work. After a --warmup for the
+nodes to settle their shards, runs are counted for --duration seconds. The benchmark reports runs per second for
+each node count, and checks that no task ran on two nodes.
+
+With --failover, two nodes run and one is killed (without leaving the cluster) halfway through; the benchmark
+reports how long its tasks went unrun before the other node took over its shards.
+
+Usage:
+    python -m benchmarks.bench_cluster [--nodes 1 2 4] [--tasks 1000] [--work 0.002] [--cpu] [--ttl 1.0]
+    python -m benchmarks.bench_cluster --failover
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from occasionally.cluster import Cluster, SQLiteLeaseBackend
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def run_node(node_id, path, args, start, results):
+    """Runs one node until start + warmup + duration, then puts (node_id, [(task_id, time), ...]) on results"""
+    runs = list()
+    window_start = start + args.warmup
+    window_end = window_start + args.duration
+
+    def work(task_id):
+        if args.cpu:
+            deadline = time.perf_counter() + args.work
+            while time.perf_counter() < deadline:
+                pass
+        else:
+            time.sleep(args.work)
+        now = time.time()
+        if window_start <= now < window_end:
+            runs.append((task_id, now))
+
+    cluster = Cluster(SQLiteLeaseBackend(path), node_id=node_id, ttl=args.ttl)
+    scheduler = Scheduler(cluster=cluster)
+    scheduler.add_tasks([Task(work, after_x_seconds(0), call_args=(i,), task_id=i) for i in range(args.tasks)])
+    timer = threading.Timer(window_end - time.time(), scheduler.stop)
+    timer.start()
+    scheduler.foreground(run_forever=True)
+    results.put((node_id, runs))
+
+
+def start_nodes(count, args, path, results):
+    start = time.time()
+    processes = [multiprocessing.Process(target=run_node, args=("node-%d" % i, path, args, start, results))
+                 for i in range(count)]
+    for process in processes:
+        process.start()
+    return start, processes
+
+
+def throughput(count, args, directory):
+    results = multiprocessing.Queue()
+    _, processes = start_nodes(count, args, os.path.join(directory, "leases-%d.db" % count), results)
+    node_runs = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    owners = dict()
+    for node_id, runs in node_runs:
+        for task_id, _ in runs:
+            owners.setdefault(task_id, set()).add(node_id)
+    total = sum(len(runs) for _, runs in node_runs)
+    shared = sum(1 for nodes in owners.values() if len(nodes) > 1)
+    print("%d nodes %10.0f runs/s  per node: %s  tasks run on several nodes: %d" % (
+        count, total / args.duration, " ".join("%.0f" % (len(runs) / args.duration) for _, runs in sorted(node_runs)),
+        shared))
+
+
+def failover(args, directory):
+    results = multiprocessing.Queue()
+    start, processes = start_nodes(2, args, os.path.join(directory, "leases-failover.db"), results)
+    time.sleep(args.warmup + args.duration / 2.0 - (time.time() - start))
+    killed = time.time()
+    # SIGTERM, the node never leaves the cluster, so its leases have to expire
+    processes[1].terminate()
+    node_id, runs = results.get()
+    processes[0].join()
+    before = set(task_id for task_id, ran in runs if ran < killed)
+    first_runs = dict()
+    for task_id, ran in runs:
+        if task_id not in before:
+            first_runs.setdefault(task_id, ran)
+    if not first_runs:
+        print("%s ran every task before the other node was killed, try more --tasks" % node_id)
+        return
+    print("killed a node, %s picked up its %d tasks after %.2fs (ttl %.2fs)" % (
+        node_id, len(first_runs), min(first_runs.values()) - killed, args.ttl))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--work", type=float, default=0.002, help="seconds per run")
+    parser.add_argument("--cpu", action="store_true", help="spin instead of sleeping for --work seconds")
+    parser.add_argument("--ttl", type=float, default=1.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--failover", action="store_true")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        if args.failover:
+            failover(args, directory)
+            return
+        for count in args.nodes:
+            throughput(count, args, directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Measures occasionally.scheduler.Scheduler throughput for many tasks that share a schedule
+
+Loads --tasks per-tenant tasks with the same interval and runs each of them --runs times, with:
+    plain: one peek, dequeue, invoke and enqueue per task
+    coalesce: Scheduler(coalesce=True), which drains every due task in one pass and re-enqueues them in bulk
+    batch: coalesce with an occasionally.task.batch_capable call_function, so each pass is one call
+
+The interval is 0 so nothing sleeps, every task is due again as soon as it is rescheduled.
+
+Usage:
+    python -m benchmarks.bench_coalesce [--tasks 100000] [--runs 5]
+"""
+import argparse
+import time
+
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task, batch_capable
+from occasionally.time_helpers import after_x_seconds
+
+
+def clean_tenant(tenant):
+    pass
+
+
+def clean_tenants(args_list):
+    pass
+
+
+@batch_capable(clean_tenants)
+def clean_tenant_batched(tenant):
+    pass
+
+
+def run(call_function, coalesce, tasks, runs):
+    """Runs tasks tasks runs times each
+
+    Args:
+        call_function: the tasks' call_function
+
+        coalesce: bool, passed to Scheduler
+
+        tasks: int number of tasks
+
+        runs: int number of runs per task
+
+    Returns:
+        float task runs per second
+    """
+    scheduler = Scheduler(coalesce=coalesce)
+    scheduler.add_tasks([Task(call_function, after_x_seconds(0), call_args=(tenant,), just_x_times=runs,
+                              schedule_immediately=True) for tenant in range(tasks)])
+    start = time.perf_counter()
+    scheduler.foreground()
+    return tasks * runs / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for name, call_function, coalesce in (("plain", clean_tenant, False), ("coalesce", clean_tenant, True),
+                                          ("batch", clean_tenant_batched, True)):
+        print("%-9s %10.0f task runs/s" % (name, run(call_function, coalesce, args.tasks, args.runs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measures occasionally.cron.CronSchedule.next_fire
+
+Builds --schedules random cron expressions, then computes the next fire time of --computations (schedule, time)
+pairs and reports computations per second. For comparison a naive implementation that steps through every minute
+until one matches is timed on a small sample of the same pairs.
+
+Usage:
+    python -m benchmarks.bench_cron [--schedules 1000] [--computations 1000000] [--naive 100]
+"""
+import argparse
+import datetime
+import random
+import time
+
+from occasionally.cron import CronSchedule
+
+UTC = datetime.timezone.utc
+
+
+def random_expression(rng):
+    minute = rng.choice(["*", "*/5", "*/15", "0", "30", str(rng.randrange(60)), "0,20,40"])
+    hour = rng.choice(["*", "*/2", "9-17", str(rng.randrange(24)), "0,12"])
+    day = rng.choice(["*", "*", "*", "1", "15", "1,15", str(rng.randrange(1, 29))])
+    month = rng.choice(["*", "*", "*", "*/3", "jan-jun"])
+    weekday = rng.choice(["*", "*", "mon-fri", "sat,sun", "1"])
+    return " ".join((minute, hour, day, month, weekday))
+
+
+def naive_next_fire(schedule, after):
+    """Steps minute by minute from after until the wall clock time matches schedule"""
+    wall = datetime.datetime.fromtimestamp(after, UTC).replace(second=0, microsecond=0)
+    while True:
+        wall += datetime.timedelta(minutes=1)
+        if schedule._minutes >> wall.minute & 1 and schedule._hours >> wall.hour & 1 and \
+                schedule._months >> wall.month & 1 and schedule._day_mask(wall.year, wall.month) >> wall.day & 1:
+            return wall.timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schedules", type=int, default=1000)
+    parser.add_argument("--computations", type=int, default=1000000)
+    parser.add_argument("--naive", type=int, default=100, help="number of computations for the naive version")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    start = time.perf_counter()
+    schedules = [CronSchedule(random_expression(rng), tz=UTC) for _ in range(args.schedules)]
+    parse_time = time.perf_counter() - start
+    print("parsed %d schedules in %.3fs (%.1fus each)" % (len(schedules), parse_time,
+                                                          parse_time / len(schedules) * 1e6))
+
+    base = datetime.datetime(2024, 1, 1, tzinfo=UTC).timestamp()
+    pairs = [(rng.choice(schedules), base + rng.uniform(0, 365 * 86400)) for _ in range(args.computations)]
+
+    start = time.perf_counter()
+    for schedule, after in pairs:
+        schedule.next_fire(after)
+    elapsed = time.perf_counter() - start
+    print("bitset  %8d next fires in %7.3fs %10.0f/s" % (len(pairs), elapsed, len(pairs) / elapsed))
+
+    sample = pairs[:args.naive]
+    start = time.perf_counter()
+    for schedule, after in sample:
+        naive_next_fire(schedule, after)
+    naive_elapsed = time.perf_counter() - start
+    print("naive   %8d next fires in %7.3fs %10.0f/s" % (len(sample), naive_elapsed, len(sample) / naive_elapsed))
+
+
+if __name__ == "__main__":
+    main()
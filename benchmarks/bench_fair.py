@@ -0,0 +1,105 @@
+"""Measures fair scheduling (Scheduler(fair=True)) with a large number of due tasks
+
+Three measurements, each with --tasks always due tasks:
+
+- fairness: tasks have weight 1, 2 or 4 and every run spins for --work seconds. Every task starts at the same virtual
+  time, so the first round runs each task once; after that (the first --tasks runs) the benchmark reports each
+  weight's share of the run time against its fair share, and Jain's fairness index of the time each task got divided
+  by its weight (1.0 is perfectly fair)
+- priority: --critical tasks with a higher priority come due after the others. Reports how many runs of other tasks
+  happened before the last of them ran, with and without fair
+- overhead: runs of empty tasks per second and the time per scheduling decision, with and without fair
+
+Usage:
+    python -m benchmarks.bench_fair [--tasks 100000] [--runs 300000] [--work 0.000005] [--critical 10]
+"""
+import argparse
+import time
+
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+WEIGHTS = (1, 2, 4)
+
+
+class Counter(object):
+    """Stops scheduler after runs runs, and adds up the time each task spun for after the first warmup runs"""
+
+    def __init__(self, scheduler, runs, warmup=0):
+        self.scheduler = scheduler
+        self.remaining = runs
+        self.measured = runs - warmup
+        self.spent = dict()
+
+    def run(self, index, work):
+        if work:
+            deadline = time.perf_counter() + work
+            while time.perf_counter() < deadline:
+                pass
+            if self.remaining <= self.measured:
+                self.spent[index] = self.spent.get(index, 0.0) + work
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.scheduler.stop()
+
+
+def fairness(args):
+    scheduler = Scheduler(fair=True)
+    counter = Counter(scheduler, args.tasks + args.runs, warmup=args.tasks)
+    frequency = after_x_seconds(0)
+    scheduler.add_tasks([Task(counter.run, frequency, call_args=(i, args.work), weight=WEIGHTS[i % len(WEIGHTS)])
+                         for i in range(args.tasks)])
+    scheduler.foreground(run_forever=True)
+    total = sum(counter.spent.values())
+    weight_sum = sum(WEIGHTS[i % len(WEIGHTS)] for i in range(args.tasks))
+    for weight in WEIGHTS:
+        share = sum(spent for i, spent in counter.spent.items() if WEIGHTS[i % len(WEIGHTS)] == weight) / total
+        fair = sum(weight for i in range(args.tasks) if WEIGHTS[i % len(WEIGHTS)] == weight) / float(weight_sum)
+        print("fairness  weight %d  %.1f%% of the run time, fair share %.1f%%" % (weight, 100 * share, 100 * fair))
+    normalized = [counter.spent.get(i, 0.0) / WEIGHTS[i % len(WEIGHTS)] for i in range(args.tasks)]
+    jain = sum(normalized) ** 2 / (len(normalized) * sum(value ** 2 for value in normalized))
+    print("fairness  Jain's index over %d tasks: %.4f" % (args.tasks, jain))
+
+
+def priority(fair, args):
+    scheduler = Scheduler(fair=fair)
+    order = list()
+    frequency = after_x_seconds(0)
+    scheduler.add_tasks([Task(order.append, frequency, call_args=(False,), just_x_times=1) for _ in range(args.tasks)])
+    scheduler.add_tasks([Task(order.append, frequency, call_args=(True,), just_x_times=1, priority=1)
+                         for _ in range(args.critical)])
+    scheduler.foreground()
+    last = max(i for i, critical in enumerate(order) if critical)
+    print("priority  fair=%-5s %d other runs before the last critical task ran" % (fair, last + 1 - args.critical))
+
+
+def overhead(fair, args):
+    scheduler = Scheduler(fair=fair)
+    counter = Counter(scheduler, args.runs)
+    frequency = after_x_seconds(0)
+    scheduler.add_tasks([Task(counter.run, frequency, call_args=(i, 0)) for i in range(args.tasks)])
+    start = time.perf_counter()
+    scheduler.foreground(run_forever=True)
+    elapsed = time.perf_counter() - start
+    print("overhead  fair=%-5s %8.0f runs/s  %.2fus per decision" % (fair, args.runs / elapsed,
+                                                                      1e6 * elapsed / args.runs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=300000, help="runs measured for fairness and overhead")
+    parser.add_argument("--work", type=float, default=0.000005, help="seconds each run spins for")
+    parser.add_argument("--critical", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    fairness(args)
+    for fair in (False, True):
+        priority(fair, args)
+    for fair in (False, True):
+        overhead(fair, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measures how long importing the package takes in a fresh interpreter, with python -X importtime
+
+Each module in --modules is imported --repeat times in a new interpreter, after one warm up run that writes the
+bytecode cache to a temporary directory (so PYTHONDONTWRITEBYTECODE doesn't turn the measurement into a compile
+benchmark). Reports the median cumulative import time of each module, and the slowest imports it pulls in beyond
+the ones the interpreter imports at startup. Exits with status 1 if importing occasionally.scheduler, what a
+short-lived process running tasks needs, takes longer than --budget-ms.
+
+Usage:
+    python -m benchmarks.bench_import [--repeat 11] [--budget-ms 15] [--top 5]
+                                      [--modules occasionally occasionally.scheduler occasionally.__main__]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUDGETED = "occasionally.scheduler"
+
+
+def import_times(module, cache):
+    """Imports module in a new interpreter, returning {imported module: (self us, cumulative us)}"""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPATH"] = ROOT
+    command = [sys.executable, "-X", "importtime", "-X", "pycache_prefix=%s" % cache, "-c", "import %s" % module]
+    stderr = subprocess.run(command, env=env, cwd=ROOT, stderr=subprocess.PIPE, check=True,
+                            universal_newlines=True).stderr
+    times = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=11)
+    parser.add_argument("--budget-ms", type=float, default=15)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--modules", nargs="+",
+                        default=["occasionally", BUDGETED, "occasionally.__main__"])
+    args = parser.parse_args(argv)
+
+    cache = tempfile.mkdtemp()
+    medians = dict()
+    try:
+        startup = set(import_times("sys", cache))
+        for module in args.modules:
+            import_times(module, cache)
+            runs = [import_times(module, cache) for _ in range(args.repeat)]
+            runs.sort(key=lambda times: times[module][1])
+            median = runs[len(runs) // 2]
+            medians[module] = median[module][1] / 1000.0
+            print("%-28s %7.2f ms" % (module, medians[module]))
+            heaviest = sorted((times for times in median.items() if times[0] != module and times[0] not in startup),
+                              key=lambda times: -times[1][1])
+            for name, (_, cumulative) in heaviest[:args.top]:
+                print("    %-24s %7.2f ms" % (name, cumulative / 1000.0))
+    finally:
+        shutil.rmtree(cache)
+    if BUDGETED in medians:
+        within = medians[BUDGETED] <= args.budget_ms
+        print("%s: %.2f ms, budget %.2f ms, %s" % (BUDGETED, medians[BUDGETED], args.budget_ms,
+                                                  "ok" if within else "OVER BUDGET"))
+        if not within:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
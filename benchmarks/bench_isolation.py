@@ -0,0 +1,129 @@
+"""Compares running calls in an occasionally.worker_pool.IsolatedPool with a concurrent.futures ProcessPoolExecutor
+
+Three measurements:
+
+- round trip: submits an empty call and waits for its result, --calls times in a row, with each pool (and inline,
+  for reference). Reports the mean and p99 time per call
+- first run: how long after foreground is called a Scheduler's first run starts, with PROCESS_EXECUTION (which starts
+  its workers on the first submit) and with an isolated task in an IsolatedPool started ahead of time
+- leak: --leaks calls that each leak --leak-mb megabytes. Reports the largest worker RSS afterwards, and the time the
+  calls took, for a ProcessPoolExecutor and for an IsolatedPool recycling workers past --max-rss-mb
+
+Usage:
+    python -m benchmarks.bench_isolation [--calls 5000] [--workers 2] [--leaks 200] [--leak-mb 4] [--max-rss-mb 128]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from occasionally.scheduler import Scheduler, PROCESS_EXECUTION
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+from occasionally.worker_pool import IsolatedPool, _rss_bytes
+
+_leaked = list()
+
+
+def empty():
+    pass
+
+
+def leak(megabytes):
+    _leaked.append(bytearray(megabytes * 1024 * 1024))
+    return _rss_bytes()
+
+
+def started_at(path):
+    with open(path, "w") as f:
+        f.write(repr(time.time()))
+
+
+def round_trip(submit, calls):
+    durations = list()
+    for _ in range(calls):
+        start = time.perf_counter()
+        submit(empty).result()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return sum(durations) / calls, durations[int(calls * 0.99)]
+
+
+class _Done(object):
+    """The result of an inline call"""
+
+    def result(self):
+        return None
+
+
+def inline_submit(function):
+    function()
+    return _Done()
+
+
+def first_run(scheduler, task, path):
+    scheduler.add_task(task)
+    called = time.time()
+    scheduler.foreground()
+    with open(path) as f:
+        return float(f.read()) - called
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--leaks", type=int, default=200)
+    parser.add_argument("--leak-mb", type=int, default=4)
+    parser.add_argument("--max-rss-mb", type=int, default=128)
+    args = parser.parse_args(argv)
+
+    print("round trip of an empty call")
+    mean, p99 = round_trip(inline_submit, args.calls)
+    print("  inline: mean %.1fus, p99 %.1fus" % (mean * 1e6, p99 * 1e6))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        executor.submit(empty).result()
+        mean, p99 = round_trip(executor.submit, args.calls)
+    print("  ProcessPoolExecutor: mean %.1fus, p99 %.1fus" % (mean * 1e6, p99 * 1e6))
+    pool = IsolatedPool(workers=args.workers)
+    pool.start()
+    pool.submit(empty).result()
+    mean, p99 = round_trip(pool.submit, args.calls)
+    pool.shutdown()
+    print("  IsolatedPool: mean %.1fus, p99 %.1fus" % (mean * 1e6, p99 * 1e6))
+
+    print("first run after foreground is called")
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bench_isolation_started")
+    try:
+        scheduler = Scheduler(execution=PROCESS_EXECUTION, workers=args.workers)
+        task = Task(started_at, after_x_seconds(0), call_args=(path,), just_x_times=1)
+        print("  PROCESS_EXECUTION: %.1fms" % (first_run(scheduler, task, path) * 1e3))
+        pool = IsolatedPool(workers=args.workers)
+        pool.start()
+        # lets the workers finish starting up, as they would while the application sets up its tasks
+        time.sleep(1)
+        scheduler = Scheduler(isolation=pool)
+        task = Task(started_at, after_x_seconds(0), call_args=(path,), just_x_times=1, isolated=True)
+        print("  IsolatedPool started ahead: %.1fms" % (first_run(scheduler, task, path) * 1e3))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    print("%d calls leaking %dMB each" % (args.leaks, args.leak_mb))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        rss = max(executor.submit(leak, args.leak_mb).result() for _ in range(args.leaks))
+    print("  ProcessPoolExecutor: %.2fs, largest worker %.0fMB" % (time.perf_counter() - start, rss / 1048576.0))
+    pool = IsolatedPool(workers=args.workers, max_rss_mb=args.max_rss_mb)
+    pool.start()
+    start = time.perf_counter()
+    rss = max(pool.submit(leak, args.leak_mb).result() for _ in range(args.leaks))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    print("  IsolatedPool(max_rss_mb=%d): %.2fs, largest worker %.0fMB, %d workers recycled" % (
+        args.max_rss_mb, elapsed, rss / 1048576.0, pool.recycled))
+    print("  parent RSS %.0fMB" % (_rss_bytes() / 1048576.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Simulates aligned tasks with and without spread, jitter and a rate limit, on an occasionally.clock.VirtualClock
+
+--tasks tasks are created together with after_x_mintes(--minutes) and schedule_immediately, so without anything else
+they all run at startup and then every --minutes minutes in the same second. Each scenario simulates --hours hours and
+reports the peak number of runs started in one simulated second, the 99th percentile over the seconds with any runs,
+and the number of runs.
+
+- aligned: no spreading
+- spread: Scheduler(spread=...) of the whole interval, a hash based phase per task
+- jitter: Scheduler(jitter=...) of --jitter seconds of random delay on every run
+- rate limit: the tasks share a tag with a TokenBucket of --rate runs per second (default: just enough for every task
+  to run once per interval)
+
+Usage:
+    python -m benchmarks.bench_jitter [--tasks 100000] [--minutes 5] [--hours 1] [--jitter 30] [--rate 0]
+"""
+import argparse
+import time
+
+from occasionally.clock import VirtualClock
+from occasionally.rate_limit import TokenBucket
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_mintes, after_x_seconds
+
+
+def simulate(args, tag=None, **options):
+    clock = VirtualClock(now=0.0)
+    seconds = dict()
+
+    def run():
+        second = int(clock.now)
+        seconds[second] = seconds.get(second, 0) + 1
+
+    scheduler = Scheduler(clock=clock, **options)
+    frequency = after_x_mintes(args.minutes)
+    scheduler.add_tasks([Task(run, frequency, task_id=i, schedule_immediately=True, tag=tag)
+                         for i in range(args.tasks)])
+    scheduler.add_task(Task(scheduler.stop, after_x_seconds(args.hours * 3600), just_x_times=1))
+    started = time.perf_counter()
+    scheduler.foreground()
+    elapsed = time.perf_counter() - started
+    counts = sorted(seconds.values())
+    return counts[-1], counts[int(len(counts) * 0.99)], sum(counts), elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--hours", type=float, default=1)
+    parser.add_argument("--jitter", type=float, default=30)
+    parser.add_argument("--rate", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    interval = args.minutes * 60
+    rate = args.rate or args.tasks / interval
+    scenarios = (
+        ("aligned", dict()),
+        ("spread %gs" % interval, dict(spread=interval)),
+        ("jitter %gs" % args.jitter, dict(jitter=args.jitter)),
+        ("rate limit %.0f/s" % rate, dict(tag="db", rate_limits={"db": TokenBucket(rate)})),
+    )
+    for name, options in scenarios:
+        peak, p99, runs, elapsed = simulate(args, **options)
+        print("%-20s peak %7d runs/s, p99 %7d runs/s, %d runs, simulated in %.1fs" % (name, peak, p99, runs, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measures the overhead of occasionally.metrics.Metrics on Scheduler.foreground
+
+Runs tasks with empty call_functions that are always due, which is the worst case for instrumentation overhead,
+with and without metrics, and reports runs per second and the relative overhead. "default" is Metrics(), which
+groups by call_function name and times one in 16 runs, "sampled" times one in --sample-every runs instead, and the
+"every run" variants time every run, globally only, per call_function name or per task_id.
+
+Usage:
+    python -m benchmarks.bench_metrics_overhead [--tasks 1000] [--runs 100] [--repeat 5] [--sample-every 64]
+"""
+import argparse
+import time
+
+from occasionally.metrics import Metrics, PER_TASK_ID
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def empty():
+    pass
+
+
+def run(metrics, tasks, runs):
+    """Runs tasks tasks runs times each
+
+    Args:
+        metrics: occasionally.metrics.Metrics or None
+
+        tasks: int number of tasks
+
+        runs: int number of runs per task
+
+    Returns:
+        float seconds foreground took
+    """
+    scheduler = Scheduler(metrics=metrics)
+    scheduler.add_tasks([Task(empty, after_x_seconds(0), just_x_times=runs, task_id=index)
+                         for index in range(tasks)])
+    start = time.perf_counter()
+    scheduler.foreground()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sample-every", type=int, default=64, help="sample_every of the sampled variant")
+    args = parser.parse_args(argv)
+
+    total = args.tasks * args.runs
+    results = dict()
+    variants = (("none", lambda: None), ("default", Metrics),
+                ("sampled", lambda: Metrics(sample_every=args.sample_every)),
+                ("global, every run", lambda: Metrics(per_task=False, sample_every=1)),
+                ("per function, every run", lambda: Metrics(sample_every=1)),
+                ("per task_id, every run", lambda: Metrics(per_task=PER_TASK_ID, sample_every=1)))
+    for _ in range(args.repeat):
+        # interleaved, so drifting machine load affects every variant alike. Best of repeat
+        for name, make_metrics in variants:
+            elapsed = run(make_metrics(), args.tasks, args.runs)
+            results[name] = min(results.get(name, elapsed), elapsed)
+    for name, _ in variants:
+        print("%-24s %10.0f runs/s" % (name, total / results[name]))
+    for name, _ in variants[1:]:
+        print("overhead %-24s %5.1f%%" % (name, (results[name] / results["none"] - 1) * 100))
+
+
+if __name__ == "__main__":
+    main()
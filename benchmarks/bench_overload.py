@@ -0,0 +1,105 @@
+"""Load test for occasionally.overload policies: runs an oversubscribed Scheduler with each policy
+
+--tasks tasks run every --frequency seconds and each run waits --work seconds, on a thread pool of --workers
+threads with RESCHEDULE_ON_DISPATCH, so work comes due faster than the pool can do it (twice as fast with the
+defaults). Task i has priority i % 4. Every run measures how late it started, relative to when it was due. For each
+policy the benchmark reports runs per second and the lag in the first and last third of --duration seconds: without
+a policy the lag keeps growing, with one it stays bounded.
+
+Usage:
+    python -m benchmarks.bench_overload [--tasks 200] [--frequency 0.5] [--work 0.02] [--workers 4]
+        [--duration 9] [--max-lag 0.5] [--policies none skip coalesce shed stretch]
+"""
+import argparse
+import threading
+import time
+
+from occasionally.overload import CoalesceMissedRuns, ShedLowestPriority, SkipMissedRuns, StretchFrequencies
+from occasionally.scheduler import Scheduler, THREAD_EXECUTION, RESCHEDULE_ON_DISPATCH
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+POLICIES = {
+    "none": None,
+    "skip": SkipMissedRuns,
+    "coalesce": CoalesceMissedRuns,
+    "shed": ShedLowestPriority,
+    "stretch": StretchFrequencies,
+}
+
+
+class LagScheduler(Scheduler):
+    """Hands every run the time it was due at, so the run can measure how late it started"""
+
+    def _dispatch(self, task, reschedule=True, latency=None):
+        task._call_args = (task._next_invoke,)
+        super(LagScheduler, self)._dispatch(task, reschedule=reschedule, latency=latency)
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(name, args):
+    """Runs the load test with one policy
+
+    Args:
+        name: key of POLICIES
+
+        args: parsed arguments
+
+    Returns:
+        (policy, list of (started, lag) tuples) tuple
+    """
+    policy = POLICIES[name](max_lag=args.max_lag) if POLICIES[name] is not None else None
+    scheduler = LagScheduler(execution=THREAD_EXECUTION, workers=args.workers, reschedule_on=RESCHEDULE_ON_DISPATCH,
+                             overload=policy)
+    runs = list()
+    end = time.time() + args.duration
+
+    def work(due):
+        started = time.time()
+        # runs still queued at the end return straight away, so the pool shuts down quickly
+        if started < end:
+            runs.append((started, started - due))
+            time.sleep(args.work)
+
+    frequency = after_x_seconds(args.frequency)
+    scheduler.add_tasks([Task(work, frequency, call_args=(None,), priority=i % 4) for i in range(args.tasks)])
+    timer = threading.Timer(args.duration, scheduler.stop)
+    timer.start()
+    scheduler.foreground(run_forever=True)
+    return policy, runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--frequency", type=float, default=0.5, help="seconds between runs of each task")
+    parser.add_argument("--work", type=float, default=0.02, help="seconds per run")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=9.0)
+    parser.add_argument("--max-lag", type=float, default=0.5)
+    parser.add_argument("--policies", nargs="+", default=["none", "skip", "coalesce", "shed", "stretch"],
+                        choices=sorted(POLICIES))
+    args = parser.parse_args(argv)
+
+    load = args.tasks * args.work / args.frequency / args.workers
+    print("%d tasks every %.3fs, %.3fs per run on %d workers: %.1fx oversubscribed" % (
+        args.tasks, args.frequency, args.work, args.workers, load))
+    for name in args.policies:
+        policy, runs = run(name, args)
+        start = min(started for started, _ in runs)
+        third = args.duration / 3.0
+        first = [lag for started, lag in runs if started < start + third]
+        last = [lag for started, lag in runs if started >= start + 2 * third]
+        print("%-8s %6.0f runs/s  lag first third p50 %6.3fs max %6.3fs  last third p50 %6.3fs p99 %6.3fs "
+              "max %6.3fs  skipped %d" % (
+                  name, len(runs) / args.duration, percentile(first, 0.5), max(first), percentile(last, 0.5),
+                  percentile(last, 0.99), max(last), policy.skipped if policy is not None else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compares the comparator and key engines of occasionally.priority_queue.PriorityQueue
+
+Usage:
+    python -m benchmarks.bench_priority_queue [--sizes 1000 100000 1000000] [--engines comparator key]
+"""
+import argparse
+import random
+import time
+
+from occasionally.priority_queue import PriorityQueue
+
+
+def min_comparator(x, y):
+    return y if x > y else x
+
+
+def identity(x):
+    return x
+
+
+ENGINES = {
+    "comparator": lambda: PriorityQueue(min_comparator),
+    "key": lambda: PriorityQueue(key=identity),
+}
+
+
+def run(engine, size, seed=0):
+    """Enqueues then dequeues size random floats
+
+    Args:
+        engine: str name of the engine in ENGINES
+
+        size: int number of elements
+
+        seed: int seed for the random values
+
+    Returns:
+        tuple of (enqueue seconds, dequeue seconds)
+    """
+    rng = random.Random(seed)
+    values = [rng.random() for _ in range(size)]
+    q = ENGINES[engine]()
+    start = time.perf_counter()
+    for val in values:
+        q.enqueue(val)
+    enqueued = time.perf_counter()
+    for _ in range(size):
+        q.dequeue()
+    dequeued = time.perf_counter()
+    return enqueued - start, dequeued - enqueued
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=["comparator", "key"])
+    args = parser.parse_args(argv)
+
+    print("%-10s %10s %12s %12s %14s" % ("engine", "size", "enqueue s", "dequeue s", "ops/s"))
+    for size in args.sizes:
+        for engine in args.engines:
+            enqueue_s, dequeue_s = run(engine, size)
+            print("%-10s %10d %12.3f %12.3f %14.0f" % (engine, size, enqueue_s, dequeue_s,
+                                                       2 * size / (enqueue_s + dequeue_s)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Measures how fast many threads can add tasks to a running occasionally.scheduler.Scheduler
+
+--producers threads each add --tasks tasks one add_task at a time, while foreground keeps busy running
+--busy always-due tasks. Reports tasks added per second across all producers, and how long after the last
+add_task returned every task was in the queue, for LOCKED_PRODUCERS and INBOX_PRODUCERS.
+
+Usage:
+    python -m benchmarks.bench_producers [--producers 16] [--tasks 20000] [--busy 100]
+"""
+import argparse
+import threading
+import time
+
+from occasionally.scheduler import Scheduler, LOCKED_PRODUCERS, INBOX_PRODUCERS
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def empty():
+    pass
+
+
+def run(producers, args):
+    """Adds tasks from args.producers threads while foreground runs
+
+    Args:
+        producers: LOCKED_PRODUCERS or INBOX_PRODUCERS
+
+        args: parsed arguments
+
+    Returns:
+        (tasks added per second, seconds until every task was queued) tuple
+    """
+    scheduler = Scheduler(producers=producers)
+    scheduler.add_tasks([Task(empty, after_x_seconds(0)) for _ in range(args.busy)])
+    foreground = threading.Thread(target=scheduler.foreground, kwargs={"run_forever": True})
+    foreground.start()
+    start = threading.Barrier(args.producers + 1)
+    frequency = after_x_seconds(3600)
+
+    def produce():
+        start.wait()
+        for _ in range(args.tasks):
+            scheduler.add_task(Task(empty, frequency))
+
+    threads = [threading.Thread(target=produce) for _ in range(args.producers)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    added = time.perf_counter()
+    expected = args.busy + args.producers * args.tasks
+    while len(scheduler) < expected:
+        time.sleep(0.001)
+    queued = time.perf_counter()
+    scheduler.stop()
+    foreground.join()
+    return args.producers * args.tasks / (added - began), queued - added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--producers", type=int, default=16)
+    parser.add_argument("--tasks", type=int, default=20000, help="tasks added by each producer")
+    parser.add_argument("--busy", type=int, default=100, help="always due tasks foreground runs meanwhile")
+    args = parser.parse_args(argv)
+
+    for producers in (LOCKED_PRODUCERS, INBOX_PRODUCERS):
+        rate, lag = run(producers, args)
+        print("%-6s %10.0f add_task/s  all queued %.3fs after the last add_task" % (producers, rate, lag))
+
+
+if __name__ == "__main__":
+    main()
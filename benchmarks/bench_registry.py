@@ -0,0 +1,76 @@
+"""Measures mutating queued tasks by task_id (Scheduler.reschedule, run_now, pause/resume, update_frequency, remove)
+
+--tasks tasks with task_ids are added to a Scheduler with each backend, then tasks picked at random are mutated.
+INDEXED_BACKEND does each mutation in O(log n); the heap and wheel backends find the task with a pass over the queue,
+so they are only given --slow-ops mutations. Also reports what the indexed queue costs on the firing path: dequeuing
+the head task and enqueuing it again, per task.
+
+Usage:
+    python -m benchmarks.bench_registry [--tasks 1000000] [--ops 100000] [--slow-ops 5]
+"""
+import argparse
+import random
+import time
+
+from occasionally.scheduler import Scheduler, HEAP_BACKEND, WHEEL_BACKEND, INDEXED_BACKEND
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def empty():
+    pass
+
+
+def mutations(scheduler, rng, tasks, now):
+    """Returns (name, function of a task_id) of each mutation"""
+    frequencies = [after_x_seconds(seconds) for seconds in (60, 300, 3600)]
+
+    def pause_resume(task_id):
+        scheduler.pause(task_id)
+        scheduler.resume(task_id)
+
+    return (
+        ("reschedule", lambda task_id: scheduler.reschedule(task_id, now + rng.random() * 86400)),
+        ("run_now", scheduler.run_now),
+        ("pause+resume", pause_resume),
+        ("update_frequency", lambda task_id: scheduler.update_frequency(task_id, rng.choice(frequencies))),
+        ("remove", scheduler.remove),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000000)
+    parser.add_argument("--ops", type=int, default=100000)
+    parser.add_argument("--slow-ops", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for backend in (HEAP_BACKEND, WHEEL_BACKEND, INDEXED_BACKEND):
+        rng = random.Random(0)
+        scheduler = Scheduler(backend=backend)
+        frequency = after_x_seconds(3600)
+        now = scheduler.clock.time()
+        started = time.perf_counter()
+        scheduler.add_tasks(Task(empty, frequency, task_id=i) for i in range(args.tasks))
+        print("%s: %d tasks added in %.2fs" % (backend, args.tasks, time.perf_counter() - started))
+        ops = args.ops if backend == INDEXED_BACKEND else args.slow_ops
+        for name, mutate in mutations(scheduler, rng, args.tasks, now):
+            task_ids = [rng.randrange(args.tasks) for _ in range(ops)]
+            started = time.perf_counter()
+            for task_id in task_ids:
+                mutate(task_id)
+            elapsed = time.perf_counter() - started
+            print("  %-16s %10.0f ops/s  %9.2fus/op" % (name, ops / elapsed, elapsed / ops * 1e6))
+        cycles = min(args.ops, len(scheduler))
+        started = time.perf_counter()
+        with scheduler._condition:
+            for _ in range(cycles):
+                task = scheduler.dequeue()
+                task._next_invoke += 3600
+                scheduler.enqueue(task)
+        elapsed = time.perf_counter() - started
+        print("  %-16s %10.0f ops/s  %9.2fus/op" % ("dequeue+enqueue", cycles / elapsed, elapsed / cycles * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Simulates a failing dependency with and without retry policies and a circuit breaker, on an
+occasionally.clock.VirtualClock
+
+- recovery: a task that runs every --hours hours fails because its dependency is down for --outage seconds. Reports
+  how long after the dependency is back the task first succeeds, and how many runs it took. Without a retry policy it
+  waits for its next run, with RetryPolicy(--attempts, --base-delay) it retries with exponential backoff
+- breaker: --tasks tasks tagged "db" run every --interval seconds and the database is down for --down seconds.
+  Reports how many calls were made to the database while it was down, how long after it came back every task had
+  run again, and how long the simulation took. With a CircuitBreaker(--threshold, --reset) the tasks are held back
+  while it is open, and one trial run goes through every --reset seconds
+
+Usage:
+    python -m benchmarks.bench_retry [--hours 24] [--outage 120] [--attempts 8] [--base-delay 5]
+                                     [--tasks 10000] [--interval 60] [--down 600] [--threshold 5] [--reset 30]
+"""
+import argparse
+import logging
+import time
+
+from occasionally.clock import VirtualClock
+from occasionally.log import log
+from occasionally.retry import RetryPolicy, CircuitBreaker
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_hours, after_x_seconds
+
+
+def recovery(args, retry):
+    clock = VirtualClock(now=0.0)
+    outage_end = args.outage
+    runs = list()
+
+    def sync():
+        runs.append(clock.now)
+        if clock.now < outage_end:
+            raise RuntimeError("dependency is down")
+        scheduler.stop()
+
+    scheduler = Scheduler(clock=clock)
+    scheduler.add_task(Task(sync, after_x_hours(args.hours), schedule_immediately=True, retry=retry))
+    scheduler.foreground()
+    return runs[-1] - outage_end, len(runs)
+
+
+def breaker(args, circuit_breakers):
+    clock = VirtualClock(now=0.0)
+    down_until = args.down
+    stats = dict(failed=0, recovered=set())
+
+    def query(i):
+        if clock.now < down_until:
+            stats["failed"] += 1
+            raise RuntimeError("database is down")
+        stats["recovered"].add(i)
+        if len(stats["recovered"]) == args.tasks:
+            stats["recovered_at"] = clock.now
+            scheduler.stop()
+
+    scheduler = Scheduler(clock=clock, circuit_breakers=circuit_breakers)
+    frequency = after_x_seconds(args.interval)
+    scheduler.add_tasks([Task(query, frequency, call_args=(i,), task_id=i, tag="db", schedule_immediately=True)
+                         for i in range(args.tasks)])
+    started = time.perf_counter()
+    scheduler.foreground()
+    elapsed = time.perf_counter() - started
+    return stats["failed"], stats["recovered_at"] - down_until, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--outage", type=float, default=120)
+    parser.add_argument("--attempts", type=int, default=8)
+    parser.add_argument("--base-delay", type=float, default=5)
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--interval", type=float, default=60)
+    parser.add_argument("--down", type=float, default=600)
+    parser.add_argument("--threshold", type=int, default=5)
+    parser.add_argument("--reset", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    # the failures are expected, don't print a traceback for each
+    log.setLevel(logging.CRITICAL)
+
+    for name, retry in (("no retry", None), ("retry", RetryPolicy(args.attempts, args.base_delay))):
+        delay, runs = recovery(args, retry)
+        print("recovery %-10s succeeded %9.1fs after the outage, %d runs" % (name, delay, runs))
+    for name, breakers in (("no breaker", None),
+                           ("breaker", {"db": CircuitBreaker(args.threshold, args.reset)})):
+        failed, delay, elapsed = breaker(args, breakers)
+        print("breaker  %-10s %8d failed calls, all tasks ran %5.1fs after recovery, simulated in %.2fs"
+              % (name, failed, delay, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measures how many tasks per second each occasionally.scheduler.Scheduler backend can reschedule
+
+Every task gets a random short interval, and the benchmark repeatedly takes the soonest task off the scheduler
+and puts it back one interval later, which is what Scheduler.foreground does for every invocation. Time is
+simulated, so nothing sleeps.
+
+Usage:
+    python -m benchmarks.bench_scheduler_backends [--sizes 10000 100000 1000000] [--backends heap wheel]
+"""
+import argparse
+import random
+import time
+
+from occasionally.scheduler import Scheduler, HEAP_BACKEND, WHEEL_BACKEND
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def empty():
+    pass
+
+
+def build(backend, size, seed=0):
+    rng = random.Random(seed)
+    scheduler = Scheduler(backend=backend)
+    for _ in range(size):
+        task = Task(empty, after_x_seconds(rng.randint(1, 300)))
+        task._next_invoke = rng.random() * 300
+        scheduler.enqueue(task)
+    return scheduler
+
+
+def run(backend, size, reschedules):
+    """Reschedules the soonest task reschedules times
+
+    Args:
+        backend: HEAP_BACKEND or WHEEL_BACKEND
+
+        size: int number of tasks in the scheduler
+
+        reschedules: int number of dequeue + enqueue pairs to time
+
+    Returns:
+        float tasks rescheduled per second
+    """
+    scheduler = build(backend, size)
+    start = time.perf_counter()
+    for _ in range(reschedules):
+        task = scheduler.dequeue()
+        task._next_invoke += task._frequency_function()
+        scheduler.enqueue(task)
+    return reschedules / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--backends", nargs="+", choices=[HEAP_BACKEND, WHEEL_BACKEND],
+                        default=[HEAP_BACKEND, WHEEL_BACKEND])
+    parser.add_argument("--reschedules", type=int, default=500000)
+    args = parser.parse_args(argv)
+
+    print("%-8s %10s %16s" % ("backend", "tasks", "reschedules/s"))
+    for size in args.sizes:
+        for backend in args.backends:
+            print("%-8s %10d %16.0f" % (backend, size, run(backend, size, args.reschedules)))
+
+
+if __name__ == "__main__":
+    main()
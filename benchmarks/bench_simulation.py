@@ -0,0 +1,67 @@
+"""Capacity planning simulation: runs a week of schedules for a million tasks on an occasionally.clock.VirtualClock
+
+Every task runs on a fixed grid (occasionally.time_helpers.every_x_seconds): daily, every other day or weekly, at a
+random minute of its period. The Scheduler coalesces tasks that are due at the same time and hands each group to one
+batch call, which only counts runs per simulated hour. The benchmark reports how long the simulated week took, the
+total number of runs, and the busiest hour, i.e. the capacity the tasks need at peak.
+
+Usage:
+    python -m benchmarks.bench_simulation [--tasks 1000000] [--days 7] [--backend heap]
+"""
+import argparse
+import random
+import time
+
+from occasionally.clock import VirtualClock
+from occasionally.scheduler import Scheduler, HEAP_BACKEND, WHEEL_BACKEND
+from occasionally.task import Task, batch_capable
+from occasionally.time_helpers import every_x_seconds
+
+DAY = 24 * 3600
+PERIODS = (DAY, 2 * DAY, 7 * DAY)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--backend", choices=[HEAP_BACKEND, WHEEL_BACKEND], default=HEAP_BACKEND)
+    args = parser.parse_args(argv)
+
+    # midnight UTC, so the grids line up with days
+    start = 1700006400.0
+    clock = VirtualClock(now=start)
+    hours = dict()
+
+    def count_batch(args_list):
+        hour = int((clock.now - start) // 3600)
+        hours[hour] = hours.get(hour, 0) + len(args_list)
+
+    @batch_capable(count_batch)
+    def count():
+        count_batch([()])
+
+    rng = random.Random(0)
+    built = time.perf_counter()
+    schedules = list()
+    for _ in range(args.tasks):
+        period = rng.choice(PERIODS)
+        schedules.append(every_x_seconds(period, anchor=rng.randrange(period // 60) * 60))
+    scheduler = Scheduler(clock=clock, coalesce=True, backend=args.backend, tick=60)
+    scheduler.add_tasks([Task(count, schedule) for schedule in schedules])
+    end = Task(scheduler.stop, every_x_seconds(args.days * DAY, anchor=start), just_x_times=1)
+    scheduler.add_task(end)
+    began = time.perf_counter()
+    scheduler.foreground()
+    finished = time.perf_counter()
+
+    total = sum(hours.values())
+    peak_hour, peak = max(hours.items(), key=lambda item: item[1])
+    print("%d tasks added in %.1fs, %.1f simulated days took %.1fs" % (
+        args.tasks, began - built, args.days, finished - began))
+    print("%d runs (%.0f per second of real time), busiest hour %d with %d runs (%.1f/s), average hour %.0f runs" % (
+        total, total / (finished - began), peak_hour, peak, peak / 3600.0, total / (args.days * 24)))
+
+
+if __name__ == "__main__":
+    main()
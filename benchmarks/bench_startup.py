@@ -0,0 +1,51 @@
+"""Measures how long it takes to load a large catalog of tasks into occasionally.scheduler.Scheduler, comparing
+one add_task call per task with a single add_tasks call
+
+Usage:
+    python -m benchmarks.bench_startup [--tasks 1000000]
+"""
+import argparse
+import random
+import time
+
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def empty():
+    pass
+
+
+def catalog(size, seed=0):
+    rng = random.Random(seed)
+    return [Task(empty, after_x_seconds(rng.randint(60, 86400))) for _ in range(size)]
+
+
+def one_by_one(tasks):
+    scheduler = Scheduler()
+    for task in tasks:
+        scheduler.add_task(task)
+    return scheduler
+
+
+def bulk(tasks):
+    scheduler = Scheduler()
+    scheduler.add_tasks(tasks)
+    return scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    tasks = catalog(args.tasks)
+    for name, load in (("add_task", one_by_one), ("add_tasks", bulk)):
+        start = time.perf_counter()
+        load(tasks)
+        print("%-10s %10d tasks %8.3f s" % (name, args.tasks, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measures occasionally.state_store.StateStore: the cost of record on the scheduler's hot path, and how long a
+warm restart takes to load the saved state of many tasks
+
+Usage:
+    python -m benchmarks.bench_state_store [--tasks 1000000] [--dir /tmp]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from occasionally.state_store import StateStore
+from occasionally.task import Task
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000000)
+    parser.add_argument("--dir", default=None, help="directory for the state files, defaults to a temporary one")
+    args = parser.parse_args(argv)
+
+    directory = args.dir or tempfile.mkdtemp()
+    path = os.path.join(directory, "bench_state")
+    try:
+        tasks = list()
+        for index in range(args.tasks):
+            task = Task(None, None, task_id="task-%d" % index)
+            task._next_invoke = 1.7e9 + index
+            task._successful_calls = index % 100
+            tasks.append(task)
+
+        store = StateStore(path, flush_interval=0.5)
+        start = time.perf_counter()
+        for task in tasks:
+            store.record(task)
+        recorded = time.perf_counter() - start
+        print("record:          %.0f ns per task" % (recorded / args.tasks * 1e9))
+
+        start = time.perf_counter()
+        store.flush()
+        print("journal flush:   %.3f s" % (time.perf_counter() - start))
+        start = time.perf_counter()
+        store.compact()
+        print("compact:         %.3f s" % (time.perf_counter() - start))
+        store.close()
+
+        start = time.perf_counter()
+        restored = StateStore(path)
+        print("load snapshot:   %.3f s for %d tasks" % (time.perf_counter() - start, len(restored)))
+        restored.close()
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
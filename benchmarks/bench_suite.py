@@ -0,0 +1,254 @@
+"""Benchmark suite for the scheduler's hot paths, with JSON results for comparing runs
+
+Benchmarks:
+
+- queue: enqueue, peek and dequeue throughput of occasionally.priority_queue.PriorityQueue (key engine, task keys)
+- reschedule: runs Scheduler.foreground through a simulated day of --tasks tasks with intervals between 30 seconds
+  and an hour, on an occasionally.clock.VirtualClock that jumps straight to the next due task instead of waiting. Reports runs per
+  (real) second
+- latency: how late tasks fire on the real clock, for --latency-tasks short interval tasks run for a second
+- memory: bytes allocated per scheduled task, measured with tracemalloc
+
+--json writes the results to a file, and --compare reads a file written by an earlier run and flags every metric
+that got more than --threshold worse, exiting with status 1 if any did, so the suite can catch regressions in CI.
+--profile runs each benchmark under cProfile (printing the functions with the most time spent in them) or
+tracemalloc (printing the lines that allocated the most). Profiling slows the benchmarks down, so don't compare
+profiled results.
+
+Usage:
+    python -m benchmarks.bench_suite [--only queue reschedule latency memory] [--quick]
+        [--json results.json] [--compare baseline.json] [--threshold 0.1] [--profile cprofile|tracemalloc]
+"""
+import argparse
+import cProfile
+import gc
+import json
+import platform
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from occasionally.clock import VirtualClock
+from occasionally.priority_queue import PriorityQueue
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task, soonest_task_key
+from occasionally.time_helpers import after_x_seconds
+
+FORMAT_VERSION = 1
+
+DAY = 24 * 3600.0
+
+# metric name suffix -> True if higher is better, for --compare
+HIGHER_IS_BETTER = {"_per_s": True, "_us": False, "_bytes": False}
+
+
+def empty():
+    pass
+
+
+def bench_queue(args):
+    size = 20000 if args.quick else 200000
+    rng = random.Random(0)
+    tasks = list()
+    for _ in range(size):
+        task = Task(empty, after_x_seconds(60))
+        task._next_invoke = rng.random() * DAY
+        tasks.append(task)
+    queue = PriorityQueue(key=soonest_task_key)
+    start = time.perf_counter()
+    for task in tasks:
+        queue.enqueue(task)
+    enqueued = time.perf_counter()
+    for _ in range(size):
+        queue.peek()
+    peeked = time.perf_counter()
+    for _ in range(size):
+        queue.dequeue()
+    dequeued = time.perf_counter()
+    return {
+        "size": size,
+        "enqueue_per_s": size / (enqueued - start),
+        "peek_per_s": size / (peeked - enqueued),
+        "dequeue_per_s": size / (dequeued - peeked),
+    }
+
+
+def bench_reschedule(args):
+    size = args.tasks // 10 if args.quick else args.tasks
+    duration = DAY / 10 if args.quick else DAY
+    rng = random.Random(0)
+    scheduler = Scheduler(clock=VirtualClock(1e9))
+    runs = [0]
+
+    def count():
+        runs[0] += 1
+
+    scheduler.add_tasks([Task(count, after_x_seconds(rng.randint(30, 3600))) for _ in range(size)])
+    scheduler.add_task(Task(scheduler.stop, after_x_seconds(duration), just_x_times=1))
+    start = time.perf_counter()
+    scheduler.foreground()
+    elapsed = time.perf_counter() - start
+    return {
+        "tasks": size,
+        "simulated_s": duration,
+        "runs": runs[0],
+        "wall_s": elapsed,
+        "runs_per_s": runs[0] / elapsed,
+    }
+
+
+def bench_latency(args):
+    size = args.latency_tasks
+    duration = 0.5 if args.quick else 1.0
+    scheduler = Scheduler()
+    latencies = list()
+    rng = random.Random(0)
+    tasks = list()
+
+    def fire(index):
+        latencies.append(time.time() - tasks[index]._next_invoke)
+
+    for index in range(size):
+        tasks.append(Task(fire, after_x_seconds(rng.uniform(0.01, 0.05)), call_args=(index,)))
+    scheduler.add_tasks(tasks)
+    timer = threading.Timer(duration, scheduler.stop)
+    timer.start()
+    scheduler.foreground()
+    latencies.sort()
+    return {
+        "runs": len(latencies),
+        "p50_us": 1e6 * latencies[len(latencies) // 2],
+        "p99_us": 1e6 * latencies[int(len(latencies) * 0.99)],
+        "max_us": 1e6 * latencies[-1],
+    }
+
+
+def bench_memory(args):
+    size = args.tasks // 10 if args.quick else args.tasks * 10
+    frequency = after_x_seconds(300)
+    gc.collect()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    scheduler = Scheduler()
+    scheduler.add_tasks([Task(empty, frequency, call_args=(index % 1000,)) for index in range(size)])
+    after = tracemalloc.get_traced_memory()[0]
+    if not tracing:
+        tracemalloc.stop()
+    return {"tasks": size, "per_task_bytes": (after - before) / float(size)}
+
+
+BENCHMARKS = {
+    "queue": bench_queue,
+    "reschedule": bench_reschedule,
+    "latency": bench_latency,
+    "memory": bench_memory,
+}
+
+
+def profiled(name, function, args):
+    """Runs function(args) under args.profile, printing what the profiler found
+
+    Args:
+        name: str benchmark name
+
+        function: benchmark function
+
+        args: parsed arguments
+
+    Returns:
+        the benchmark's results
+    """
+    if args.profile == "cprofile":
+        profile = cProfile.Profile()
+        results = profile.runcall(function, args)
+        print("--- cProfile of %s" % name)
+        pstats.Stats(profile, stream=sys.stdout).sort_stats("tottime").print_stats(15)
+        return results
+    if args.profile == "tracemalloc":
+        tracemalloc.start()
+        try:
+            results = function(args)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        print("--- tracemalloc of %s" % name)
+        for stat in snapshot.statistics("lineno")[:15]:
+            print(stat)
+        return results
+    return function(args)
+
+
+def compare(results, baseline, threshold):
+    """Compares results with a baseline written by an earlier run
+
+    Args:
+        results: dict of benchmark name -> dict of metric -> value
+
+        baseline: dict loaded from a --json file
+
+        threshold: float fraction a metric may get worse by
+
+    Returns:
+        list of str descriptions of the regressions
+    """
+    regressions = list()
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            old = baseline.get("results", dict()).get(name, dict()).get(metric)
+            higher = [better for suffix, better in HIGHER_IS_BETTER.items() if metric.endswith(suffix)]
+            if old is None or not higher or not old:
+                continue
+            change = (value - old) / float(old)
+            worse = -change if higher[0] else change
+            flag = "REGRESSION" if worse > threshold else ""
+            print("%-12s %-16s %14.1f -> %14.1f  %+6.1f%%  %s" % (name, metric, old, value, 100 * change, flag))
+            if flag:
+                regressions.append("%s %s got %.1f%% worse" % (name, metric, 100 * worse))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a smoke test")
+    parser.add_argument("--tasks", type=int, default=10000, help="tasks in the simulated day")
+    parser.add_argument("--latency-tasks", type=int, default=200)
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"])
+    args = parser.parse_args(argv)
+
+    results = dict()
+    for name in args.only:
+        results[name] = profiled(name, BENCHMARKS[name], args)
+        print("%-12s %s" % (name, "  ".join("%s %.6g" % item for item in sorted(results[name].items()))))
+    document = {
+        "format": FORMAT_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick or args.profile:
+            print("warning: comparing runs with different --quick or with --profile, expect differences")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("%d regressions: %s" % (len(regressions), "; ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Measures memory per scheduled occasionally.task.Task with tracemalloc
+
+Compares the legacy form of a task (LegacyTask, the attributes Task had before it used __slots__ in a per-instance
+__dict__, with a new frequency closure per task and list args) against the compact form (slotted Task, interned
+frequency functions from occasionally.time_helpers and tuple args). Both are queued the same way, in a key engine
+PriorityQueue like the one a Scheduler keeps its tasks in, so only the tasks themselves differ.
+
+Usage:
+    python -m benchmarks.bench_task_memory [--tasks 100000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from occasionally.priority_queue import PriorityQueue
+from occasionally.task import Task, soonest_task_key
+from occasionally.time_helpers import after_x_seconds
+
+
+class LegacyTask(object):
+    """What a Task held before it used __slots__. Its own class rather than a subclass of Task, which would carry
+    every slot of the current Task as well as the __dict__"""
+
+    # with the old mutable defaults, one call_kwargs dict is shared by every task
+    def __init__(self, call_function, frequency_function, call_args=list(), call_kwargs=dict(), next_task=None,
+                 exception_handler=None, call_next_task_on_exception=False, schedule_immediately=False,
+                 just_x_times=-1, max_concurrency=0, task_id=None):
+        self._call_function = call_function
+        self._frequency_function = frequency_function
+        self._call_args = call_args
+        self._call_kwargs = call_kwargs
+        self._next_task = next_task
+        self._exception_handler = exception_handler
+        self._call_next_task_on_exception = call_next_task_on_exception
+        self._schedule_immediately = schedule_immediately
+        self._max_calls = just_x_times
+        self._successful_calls = 0
+        self._unsuccessful_calls = 0
+        self._next_invoke = None
+        self._max_concurrency = max_concurrency
+        self._running = 0
+        self._cancelled = False
+        self._task_id = task_id
+
+
+def empty(tenant):
+    pass
+
+
+def legacy(index):
+    return LegacyTask(empty, lambda: 300, call_args=[index % 1000])
+
+
+def compact(index):
+    return Task(empty, after_x_seconds(300), call_args=(index % 1000,))
+
+
+def measure(make_task, size):
+    """Creates size tasks and queues them
+
+    Args:
+        make_task: function that takes an index and returns a Task
+
+        size: int number of tasks
+
+    Returns:
+        float bytes allocated per scheduled task
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = PriorityQueue(key=soonest_task_key)
+    tasks = [make_task(index) for index in range(size)]
+    for index, task in enumerate(tasks):
+        task._next_invoke = 300.0 + index
+    queue.enqueue_many(tasks)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / float(size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    for name, make_task in (("legacy", legacy), ("compact", compact)):
+        print("%-8s %8.0f bytes per scheduled task" % (name, measure(make_task, args.tasks)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Measures occasionally.workflow.Workflow on a large DAG
+
+Builds a layered DAG of --nodes steps (--width steps per layer, each depending on 1 to 3 steps of the layer
+before it), then reports how long computing the topological order takes, and how long running the workflow takes
+inline and on thread pools of each --workers size. Each step sleeps for --work seconds, standing in for I/O.
+
+Usage:
+    python -m benchmarks.bench_workflow [--nodes 10000] [--width 100] [--work 0.0005] [--workers 1 8 32]
+"""
+import argparse
+import random
+import time
+
+from occasionally.workflow import Workflow
+
+
+def build(nodes, width, work, seed=0):
+    rng = random.Random(seed)
+
+    def step(*upstream_results):
+        if work:
+            time.sleep(work)
+        return len(upstream_results)
+
+    workflow = Workflow()
+    for index in range(nodes):
+        layer_start = index - index % width
+        if layer_start == 0:
+            depends_on = ()
+        else:
+            previous = range(layer_start - width, layer_start)
+            depends_on = rng.sample(previous, rng.randint(1, 3))
+        workflow.add_step(index, step, depends_on=depends_on)
+    return workflow
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--width", type=int, default=100)
+    parser.add_argument("--work", type=float, default=0.0005, help="seconds each step sleeps")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args(argv)
+
+    workflow = build(args.nodes, args.width, args.work)
+    start = time.perf_counter()
+    workflow._compile()
+    print("topological order of %d steps in %.3fs" % (len(workflow), time.perf_counter() - start))
+
+    for workers in [None] + args.workers:
+        start = time.perf_counter()
+        workflow.run(workers=workers)
+        elapsed = time.perf_counter() - start
+        print("%-10s %7.3fs %10.0f steps/s" % ("inline" if workers is None else "%d workers" % workers, elapsed,
+                                               len(workflow) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""A task scheduler and executioner using only the stdlib
+
+The main classes can be used from the package itself, e.g. occasionally.Scheduler and occasionally.Task. Each is
+imported from its module the first time it is used, so importing occasionally costs next to nothing, and a process
+only imports the modules it uses.
+"""
+import importlib
+import sys
+
+# public name -> module it is imported from
+_EXPORTS = {
+    "Scheduler": ".scheduler",
+    "Task": ".task",
+    "batch_capable": ".task",
+    "MaxCallException": ".task",
+    "PriorityQueue": ".priority_queue",
+    "QueueEmptyException": ".priority_queue",
+    "QueueFullException": ".priority_queue",
+    "after_x_seconds": ".time_helpers",
+    "after_x_mintes": ".time_helpers",
+    "after_x_hours": ".time_helpers",
+    "every_x_seconds": ".time_helpers",
+    "on_cron": ".time_helpers",
+    "daily_at": ".time_helpers",
+    "SystemClock": ".clock",
+    "VirtualClock": ".clock",
+    "RetryPolicy": ".retry",
+    "CircuitBreaker": ".retry",
+    "TokenBucket": ".rate_limit",
+    "StateStore": ".state_store",
+    "Metrics": ".metrics",
+    "Workflow": ".workflow",
+    "Cluster": ".cluster",
+    "SQLiteLeaseBackend": ".cluster",
+    "IsolatedPool": ".worker_pool",
+    "AsyncScheduler": ".async_scheduler",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    """Imports a public name from its module on first access (PEP 562, python 3.7+)
+
+    Args:
+        name: str attribute name
+
+    Raises:
+        AttributeError if name is not one of the package's public names
+
+    Returns:
+        The class or function
+    """
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    # later lookups find it in the module's namespace without calling __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+if sys.version_info < (3, 7):
+    # no module __getattr__, so everything that can be imported on this python is imported up front
+    for _name in __all__:
+        try:
+            __getattr__(_name)
+        except (ImportError, SyntaxError):
+            pass
@@ -0,0 +1,59 @@
+"""Runs the tasks of a JSON task spec (see occasionally.spec) until they are done, or forever with --run-forever
+
+Usage:
+    python -m occasionally schedule.json [--run-forever] [--check] [--log-level INFO]
+
+On SIGTERM or SIGINT the scheduler returns once the task it is running finishes, and the state of a state_store is
+saved before exiting.
+"""
+from __future__ import print_function
+import argparse
+import signal
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m occasionally", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("spec", help="path of the JSON task spec")
+    parser.add_argument("--run-forever", action="store_true",
+                        help="keep running when every task has hit its just_x_times limit, until stopped")
+    parser.add_argument("--check", action="store_true",
+                        help="load the spec and print the tasks in the order they would run, without running them")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+    from .spec import load
+    try:
+        scheduler = load(args.spec)
+    except (IOError, ValueError, ImportError, AttributeError, TypeError) as e:
+        # ValueError covers bad JSON, TypeError bad arguments to a Task or Scheduler
+        print("Could not load %s: %s" % (args.spec, e), file=sys.stderr)
+        return 2
+    store = scheduler._state_store
+    if args.check:
+        for task in scheduler.sorted_view():
+            print("%-40s next run in %10.1fs" % (task.task_id if task.task_id is not None else task,
+                                                 max(0.0, task._next_invoke - scheduler.clock.time())))
+        if store is not None:
+            store.close()
+        return 0
+
+    def stop(signum, frame):
+        scheduler.stop()
+
+    handlers = dict((signum, signal.signal(signum, stop)) for signum in (signal.SIGTERM, signal.SIGINT))
+    try:
+        scheduler.foreground(run_forever=args.run_forever)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        if store is not None:
+            store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""An asyncio native scheduler. Requires python 3.7+, unlike the rest of the package"""
+import asyncio
+import functools
+import inspect
+import time
+from .priority_queue import PriorityQueue
+from .scheduler import RESCHEDULE_ON_COMPLETE, RESCHEDULE_ON_DISPATCH
+from .task import Task, MaxCallException, soonest_task_key
+from .log import log
+
+
+class AsyncScheduler(PriorityQueue):
+    """Runs occasionally.task.Task objects on an asyncio event loop, ordered the same way as
+    occasionally.scheduler.Scheduler. Coroutine call_functions are awaited on the loop, regular call_functions
+    are run in an executor. Every run is its own asyncio task, so thousands of runs can be in flight at once,
+    and the scheduler waits for the next task with a loop.call_at timer instead of sleeping.
+
+    add_task and stop must be called from the event loop's thread (use loop.call_soon_threadsafe from others).
+    """
+
+    def __init__(self, max_size=0, executor=None, reschedule_on=RESCHEDULE_ON_COMPLETE):
+        """Initializes the AsyncScheduler
+
+        Args:
+            max_size: int max size for ocassionally.priority_queue.PriorityQueue
+
+            executor: concurrent.futures.Executor to run regular (not coroutine) call_functions in. None uses the
+            event loop's default executor
+
+            reschedule_on: occasionally.scheduler.RESCHEDULE_ON_COMPLETE or RESCHEDULE_ON_DISPATCH. See
+            occasionally.scheduler.Scheduler
+
+        Raises:
+            ValueError if reschedule_on is not one of the constants above
+
+        Returns:
+            AsyncScheduler object
+        """
+        super(AsyncScheduler, self).__init__(key=soonest_task_key, max_size=max_size)
+        if reschedule_on not in (RESCHEDULE_ON_DISPATCH, RESCHEDULE_ON_COMPLETE):
+            raise ValueError("Unknown AsyncScheduler reschedule_on %r" % reschedule_on)
+        self._executor = executor
+        self._reschedule_on = reschedule_on
+        self._stopped = False
+        # set to wake run up, created by run so it belongs to the running loop
+        self._wakeup = None
+        self._in_flight = set()
+
+    def add_task(self, task):
+        # type: (Task) -> None
+        """Takes in occasionally.task.Task, computes its next invoke time, then enqueues it. Wakes run up if
+        the task is now the soonest one.
+
+        Args:
+            task: ocassionally.task.Task to be enqueued
+
+        Returns:
+        """
+        task.set_next_invoke()
+        self.enqueue(task)
+        if self.peek() is task:
+            self._wake()
+
+    def stop(self):
+        """Makes a running run call return once its in flight runs have finished. If run is not running, the next
+        call to run returns immediately.
+
+        Args:
+
+        Returns:
+        """
+        self._stopped = True
+        self._wake()
+
+    async def run(self, run_forever=False):
+        """Runs all of the tasks in the queue, rescheduling them after each run, until the queue is empty or
+        stop is called. Waits for in flight runs before returning.
+
+        Args:
+            run_forever: bool, if True keep waiting for new tasks when the queue is empty instead of returning.
+            Use stop to return
+
+        Returns:
+        """
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while not self._stopped:
+                if len(self) == 0:
+                    if not run_forever and not self._in_flight:
+                        log.info("The scheduler ran out of tasks and is returning from run")
+                        break
+                    # runs that complete get re-enqueued and wake us up
+                    await self._wait(loop, None)
+                    continue
+                task = self.peek()  # type: Task
+                wait = task._next_invoke - time.time()
+                # it is not time to call the task yet
+                if wait > 0:
+                    await self._wait(loop, loop.time() + wait)
+                    continue
+                self._dispatch(loop, self.dequeue())
+            if self._in_flight:
+                await asyncio.wait(list(self._in_flight))
+        finally:
+            self._stopped = False
+            self._wakeup = None
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _wait(self, loop, when):
+        """Waits until the loop time when (forever if None), or until _wake is called
+
+        Args:
+            loop: the running event loop
+
+            when: float loop time to wake up at, or None
+
+        Returns:
+        """
+        self._wakeup.clear()
+        handle = loop.call_at(when, self._wakeup.set) if when is not None else None
+        try:
+            await self._wakeup.wait()
+        finally:
+            if handle is not None:
+                handle.cancel()
+
+    def _dispatch(self, loop, task):
+        """Starts a run of task as an asyncio task
+
+        Args:
+            loop: the running event loop
+
+            task: occasionally.task.Task that is due
+
+        Returns:
+        """
+        if task._max_concurrency > 0 and task._running >= task._max_concurrency:
+            log.warning("Skipping run of task %s, %d runs are already in progress", task, task._running)
+            self._reschedule(task)
+            return
+        task._running += 1
+        reschedule = self._reschedule_on == RESCHEDULE_ON_COMPLETE
+        run = loop.create_task(self._invoke(task, reschedule))
+        self._in_flight.add(run)
+        run.add_done_callback(self._on_done)
+        if not reschedule:
+            self._reschedule(task)
+
+    def _on_done(self, run):
+        self._in_flight.discard(run)
+        # run may be waiting for the last in flight run to finish
+        self._wake()
+
+    async def _invoke(self, task, reschedule):
+        """Runs task's call_function, then its exception_handler and next_task, then reschedules it
+
+        Args:
+            task: occasionally.task.Task to run
+
+            reschedule: bool, whether task should be rescheduled once it completes
+
+        Returns:
+        """
+        try:
+            succeeded = await self._call(task)
+        finally:
+            task._running -= 1
+        for chained in task._complete_call(not succeeded):
+            await self._invoke_chained(chained)
+        if reschedule:
+            self._reschedule(task)
+
+    async def _invoke_chained(self, task):
+        if task._max_calls_hit():
+            log.info("Not invoking chained task %s due to max invokes of %d being reached", task, task._max_calls)
+            return
+        succeeded = await self._call(task)
+        for chained in task._complete_call(not succeeded):
+            await self._invoke_chained(chained)
+
+    async def _call(self, task):
+        """Awaits task's call_function if it is a coroutine function, otherwise runs it in the executor
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+            bool, whether call_function completed without raising
+        """
+        function = task._call_function
+        try:
+            if inspect.iscoroutinefunction(function):
+                await function(*task._call_args, **task._call_kwargs)
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor, functools.partial(function, *task._call_args, **task._call_kwargs))
+        except Exception:
+            log.exception("Task %s hit exception:", task)
+            return False
+        log.debug("Successfully completed task %s", task)
+        return True
+
+    def _reschedule(self, task):
+        try:
+            # task should be called again
+            task.set_next_invoke()
+            self.enqueue(task)
+        except MaxCallException:
+            # task has hit its call limit and will not be invoked
+            log.info("Removing task %s due to max invokes of %d being reached", task, task._max_calls)
+            return
+        if self.peek() is task:
+            self._wake()
@@ -0,0 +1,97 @@
+"""Clocks a Scheduler reads the time from and waits on
+
+A Scheduler keeps every task's next invoke time on its clock's timeline. SystemClock, the default, is steady: it
+counts from the wall clock time it was created at with the monotonic clock, so stepping the system clock (e.g. an
+NTP correction) neither fires interval tasks early nor stalls them. Calendar schedules (see occasionally.cron) are
+still worked out on the wall clock, and converted. VirtualClock never waits: the scheduler jumps it straight to the
+next due task, so schedules can be simulated much faster than real time.
+
+    clock = VirtualClock()
+    scheduler = Scheduler(clock=clock)
+    scheduler.add_tasks(tasks)
+    scheduler.add_task(Task(scheduler.stop, after_x_seconds(7 * 24 * 3600), just_x_times=1))
+    scheduler.foreground()  # a week of runs, as fast as the tasks can run
+"""
+import time
+
+# python 2.7 has no monotonic clock, the wall clock will have to do
+_monotonic = getattr(time, "monotonic", time.time)
+
+
+class Clock(object):
+    """The interface of a Scheduler's clock"""
+
+    def time(self):
+        """Returns float seconds on the clock's timeline, which next invoke times are kept on"""
+        raise NotImplementedError()
+
+    def wall(self):
+        """Returns float time.time() seconds since the epoch, for calendar schedules"""
+        raise NotImplementedError()
+
+    def wait(self, condition, timeout):
+        """Waits on condition, which the caller holds, until it is notified or timeout seconds pass on this clock
+
+        Args:
+            condition: threading.Condition
+
+            timeout: float seconds, None to wait until notified
+
+        Returns:
+        """
+        raise NotImplementedError()
+
+
+class SystemClock(Clock):
+    """Reads the monotonic clock, offset so its time starts out equal to time.time(). Waits for real"""
+
+    def __init__(self):
+        self._offset = time.time() - _monotonic()
+
+    def __repr__(self):
+        return "SystemClock()"
+
+    def time(self):
+        return _monotonic() + self._offset
+
+    def wall(self):
+        return time.time()
+
+    def wait(self, condition, timeout):
+        condition.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """Simulated time, which only moves when the scheduler waits (or advance is called). A wait with a timeout
+    returns straight away with the clock timeout seconds later; a wait without one (foreground with run_forever and
+    nothing queued) blocks for real until another thread notifies the scheduler. Tasks run for as long as they
+    really take, but no simulated time passes while they do. Meant for INLINE_EXECUTION"""
+
+    def __init__(self, now=None):
+        """Creates a new VirtualClock
+
+        Args:
+            now: float seconds since the epoch to start at, None starts at time.time()
+
+        Returns:
+            A new VirtualClock
+        """
+        self.now = time.time() if now is None else now
+
+    def __repr__(self):
+        return "VirtualClock(now=%r)" % self.now
+
+    def time(self):
+        return self.now
+
+    def wall(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def wait(self, condition, timeout):
+        if timeout is None:
+            condition.wait()
+        else:
+            self.now += timeout
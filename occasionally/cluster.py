@@ -0,0 +1,364 @@
+"""Sharded scheduling across several processes or hosts
+
+Every node adds the same tasks, but each task only runs on one node. Task ids are hashed into a fixed number of
+shards, shards are spread over the live nodes with a consistent hash ring, and a node only runs the tasks of the
+shards it holds a lease on. Leases and node membership live in a LeaseBackend shared by every node. When a node
+stops renewing (it crashed, or lost its connection to the backend), its leases expire and the ring hands its
+shards to the remaining nodes. When a node joins, only the shards the ring moves to it change hands.
+"""
+import bisect
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from .log import log
+
+DEFAULT_SHARDS = 256
+
+
+def _hash(value):
+    """A stable 64 bit hash of a str, the same in every process (unlike hash())"""
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """A consistent hash ring. Each node is placed on the ring replicas times, and a key belongs to the first node
+    at or after the key's hash, so adding or removing a node only moves the keys next to its points.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        """Creates a new HashRing
+
+        Args:
+            nodes: iterable of str node ids
+
+            replicas: int number of points per node. More points spread keys more evenly
+
+        Returns:
+            A new HashRing
+        """
+        points = sorted((_hash("%s#%d" % (node, replica)), node) for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def __len__(self):
+        return len(set(self._nodes))
+
+    def owner(self, key):
+        """Returns the node that key belongs to, or None if the ring is empty
+
+        Args:
+            key: str
+
+        Returns:
+            str node id or None
+        """
+        if not self._nodes:
+            return None
+        index = bisect.bisect_left(self._hashes, _hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+class LeaseBackend(object):
+    """Where nodes keep their membership and shard leases. Implementations must make acquire atomic across every
+    node. Times are time.time() seconds, so nodes need roughly synchronized clocks, and ttl should be much larger
+    than the clock skew between them.
+    """
+
+    def heartbeat(self, node_id, ttl):
+        """Renews node_id's membership for ttl seconds
+
+        Args:
+            node_id: str
+
+            ttl: float seconds
+
+        Returns:
+            A sorted list of the node ids whose membership has not expired, including node_id
+        """
+        raise NotImplementedError
+
+    def acquire(self, node_id, names, ttl):
+        """Takes or renews, for ttl seconds, every lease in names that is free, expired or already held by node_id
+
+        Args:
+            node_id: str
+
+            names: iterable of str lease names
+
+            ttl: float seconds
+
+        Returns:
+            A set of the names node_id now holds
+        """
+        raise NotImplementedError
+
+    def release(self, node_id, names):
+        """Gives up the leases in names that node_id holds
+
+        Args:
+            node_id: str
+
+            names: iterable of str lease names
+
+        Returns:
+        """
+        raise NotImplementedError
+
+    def leave(self, node_id):
+        """Ends node_id's membership and releases all of its leases
+
+        Args:
+            node_id: str
+
+        Returns:
+        """
+        raise NotImplementedError
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """A LeaseBackend in a SQLite database file, for nodes on one host (or a network filesystem with working
+    locks). SQLite's file lock makes every acquire atomic across processes.
+    """
+
+    def __init__(self, path, timeout=None):
+        """Creates a new SQLiteLeaseBackend, creating the database if needed
+
+        Args:
+            path: str path of the database file
+
+            timeout: float seconds to wait for another process's lock on the database. None waits a quarter of the
+            ttl passed to heartbeat and acquire (and of the last one passed for release and leave), so a node whose
+            refresh is stuck behind the lock gives up and stops running its shards before its leases can expire
+
+        Returns:
+            A new SQLiteLeaseBackend
+        """
+        self._path = path
+        self._timeout = timeout
+        # the lock timeout of release and leave, and of creating the database
+        self._last_timeout = timeout if timeout is not None else 5.0
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+        with self._transaction() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS members (node TEXT PRIMARY KEY, expires REAL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, node TEXT, expires REAL)")
+
+    def __repr__(self):
+        return "SQLiteLeaseBackend(%r)" % self._path
+
+    def _transaction(self, ttl=None):
+        if self._timeout is None and ttl is not None:
+            self._last_timeout = ttl / 4.0
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # some minimal python builds leave sqlite3 out, only require it when it is used
+            import sqlite3
+            # autocommit mode, transactions are started explicitly
+            connection = self._local.connection = sqlite3.connect(self._path, timeout=self._last_timeout,
+                                                                  isolation_level=None)
+        return _Transaction(connection, self._last_timeout)
+
+    def heartbeat(self, node_id, ttl):
+        now = time.time()
+        with self._transaction(ttl) as cursor:
+            cursor.execute("INSERT OR REPLACE INTO members (node, expires) VALUES (?, ?)", (node_id, now + ttl))
+            cursor.execute("DELETE FROM members WHERE expires < ?", (now,))
+            cursor.execute("SELECT node FROM members ORDER BY node")
+            return [row[0] for row in cursor.fetchall()]
+
+    def acquire(self, node_id, names, ttl):
+        now = time.time()
+        with self._transaction(ttl) as cursor:
+            for name in names:
+                cursor.execute("UPDATE leases SET node = ?, expires = ? WHERE name = ? AND (node = ? OR expires < ?)",
+                               (node_id, now + ttl, name, node_id, now))
+                if cursor.rowcount == 0:
+                    cursor.execute("INSERT OR IGNORE INTO leases (name, node, expires) VALUES (?, ?, ?)",
+                                   (name, node_id, now + ttl))
+            cursor.execute("SELECT name FROM leases WHERE node = ? AND expires >= ?", (node_id, now))
+            return set(row[0] for row in cursor.fetchall())
+
+    def release(self, node_id, names):
+        with self._transaction() as cursor:
+            cursor.executemany("DELETE FROM leases WHERE name = ? AND node = ?", [(name, node_id) for name in names])
+
+    def leave(self, node_id):
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM leases WHERE node = ?", (node_id,))
+            cursor.execute("DELETE FROM members WHERE node = ?", (node_id,))
+
+
+class _Transaction(object):
+    """Runs a block in an IMMEDIATE transaction, which takes the database's write lock up front"""
+
+    def __init__(self, connection, timeout):
+        self._connection = connection
+        self._timeout = timeout
+
+    def __enter__(self):
+        self._cursor = self._connection.cursor()
+        self._cursor.execute("PRAGMA busy_timeout = %d" % int(self._timeout * 1000))
+        self._cursor.execute("BEGIN IMMEDIATE")
+        return self._cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        self._cursor.close()
+
+
+class Cluster(object):
+    """One node's view of a sharded cluster. Pass it to occasionally.scheduler.Scheduler(cluster=...), which only
+    runs the tasks whose shard this node holds. Tasks need a task_id to be sharded.
+
+    While the scheduler's foreground runs, a background thread renews this node's membership and leases every
+    ttl / 3 seconds and rebalances shards when nodes join or leave. A shard is only handed over after the old
+    owner has stopped running it (or its lease has expired), so a task never runs on two nodes at once, except for
+    a run that was already in progress when its shard moved.
+    """
+
+    def __init__(self, backend, node_id=None, shards=DEFAULT_SHARDS, ttl=10.0, replicas=64):
+        """Creates a new Cluster
+
+        Args:
+            backend: LeaseBackend shared by every node
+
+            node_id: str unique id of this node. None generates one from the host name and process id
+
+            shards: int number of shards. Must be the same on every node
+
+            ttl: float seconds a node's membership and leases last without being renewed, which is how long its
+            tasks go unrun after it dies
+
+            replicas: int points per node on the HashRing
+
+        Returns:
+            A new Cluster
+        """
+        self._backend = backend
+        self._node_id = node_id if node_id is not None else "%s-%d-%s" % (socket.gethostname(), os.getpid(),
+                                                                           uuid.uuid4().hex[:8])
+        self._shards = shards
+        self._ttl = ttl
+        self._replicas = replicas
+        # shards this node holds a lease on, replaced (never mutated) so it can be read without a lock
+        self._owned = frozenset()
+        self._valid_until = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "Cluster(%r, node_id=%r, shards=%r, ttl=%r)" % (self._backend, self._node_id, self._shards, self._ttl)
+
+    @property
+    def node_id(self):
+        return self._node_id
+
+    @property
+    def owned(self):
+        """frozenset of the shards this node holds"""
+        return self._owned
+
+    def shard_of(self, task_id):
+        """Returns the shard task_id belongs to
+
+        Args:
+            task_id: a task's task_id
+
+        Returns:
+            int between 0 and shards - 1
+        """
+        return _hash(str(task_id)) % self._shards
+
+    def refresh(self, on_change=None):
+        """Renews this node's membership, gives up the shards the ring has moved to other nodes and takes the
+        ones it has moved to this node
+
+        Args:
+            on_change: function called with (gained, lost) sets of shards when they change. Lost shards are
+            reported before their leases are released, so the caller can stop running them first
+
+        Returns:
+        """
+        nodes = self._backend.heartbeat(self._node_id, self._ttl)
+        ring = HashRing(nodes, self._replicas)
+        wanted = set(shard for shard in range(self._shards) if ring.owner("shard-%d" % shard) == self._node_id)
+        lost = self._owned - wanted
+        if lost:
+            self._owned = self._owned - lost
+            if on_change is not None:
+                on_change(frozenset(), lost)
+            self._backend.release(self._node_id, ["shard-%d" % shard for shard in lost])
+        acquiring = time.time()
+        held = self._backend.acquire(self._node_id, ["shard-%d" % shard for shard in wanted], self._ttl)
+        owned = frozenset(int(name[len("shard-"):]) for name in held)
+        now = time.time()
+        if now >= self._valid_until and self._owned:
+            # the old leases expired while the backend was blocked, so another node may have taken and run these
+            # shards in the meantime. Stop running them, and start over with the ones just acquired
+            lost, self._owned = self._owned, frozenset()
+            log.warning("Node %s renewed its leases %.1f seconds after they expired", self._node_id,
+                        now - self._valid_until)
+            if on_change is not None:
+                on_change(frozenset(), lost)
+        # the leases were taken after acquiring, so they last at least until acquiring + ttl
+        self._valid_until = acquiring + self._ttl
+        if now >= self._valid_until:
+            # and these expired before acquire returned
+            owned = frozenset()
+        gained = owned - self._owned
+        # an expired lease that another node took over in the meantime
+        lost = self._owned - owned
+        self._owned = owned
+        if (gained or lost) and on_change is not None:
+            on_change(gained, lost)
+        if gained or lost:
+            log.info("Node %s now holds %d of %d shards across %d nodes", self._node_id, len(owned), self._shards,
+                     len(nodes))
+
+    def start(self, on_change):
+        """Refreshes now, then keeps refreshing from a background thread until stop is called
+
+        Args:
+            on_change: see refresh
+
+        Returns:
+        """
+        self._stopped.clear()
+        self.refresh(on_change)
+        self._thread = threading.Thread(target=self._refresh_forever, args=(on_change,),
+                                        name="occasionally-cluster")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops refreshing, and leaves the cluster so other nodes take this node's shards without waiting for
+        its leases to expire
+
+        Args:
+
+        Returns:
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._owned = frozenset()
+        try:
+            self._backend.leave(self._node_id)
+        except Exception:
+            log.exception("Node %s failed to leave the cluster, its leases will expire in %r seconds",
+                          self._node_id, self._ttl)
+
+    def _refresh_forever(self, on_change):
+        while not self._stopped.wait(self._ttl / 3.0):
+            try:
+                self.refresh(on_change)
+            except Exception:
+                log.exception("Node %s failed to renew its leases", self._node_id)
+                # stop running shards that another node may take over before we renew again
+                if self._owned and time.time() + self._ttl / 3.0 >= self._valid_until:
+                    lost, self._owned = self._owned, frozenset()
+                    on_change(frozenset(), lost)
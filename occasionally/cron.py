@@ -0,0 +1,322 @@
+"""Calendar schedules: cron expressions and anchored intervals. Cron schedules require python 3.6+ (for
+datetime.timestamp and fold), unlike the rest of the package.
+
+Schedules are frequency functions with a next_fire method. occasionally.task.Task uses next_fire to compute the
+absolute time of the next run, so runs land on the schedule no matter how long the previous run took. Called
+like any other frequency function, a schedule returns the number of seconds until its next fire time.
+"""
+import datetime
+import time
+
+_MONTH_NAMES = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+_DAY_NAMES = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# (low, high, names) for the minute, hour, day of month, month and day of week fields. Day of week 7 is Sunday
+_FIELDS = ((0, 59, None), (0, 23, None), (1, 31, None), (1, 12, _MONTH_NAMES), (0, 7, _DAY_NAMES))
+
+_ONE_MINUTE = datetime.timedelta(minutes=1)
+
+# a schedule that can not fire within this many years never will (the calendar repeats every 28 years)
+_MAX_YEARS = 28
+
+
+# (year, month) -> (cron weekday of the 1st, bitset of the month's days), shared by every schedule
+_month_cache = dict()
+
+
+def _days_in_month(year, month):
+    if month == 12:
+        return 31
+    return (datetime.date(year, month + 1, 1) - datetime.date(year, month, 1)).days
+
+
+def _month_info(year, month):
+    info = _month_cache.get((year, month))
+    if info is None:
+        # datetime's weekday is 0 for Monday, cron's is 0 for Sunday
+        info = _month_cache[(year, month)] = ((datetime.date(year, month, 1).weekday() + 1) % 7,
+                                              (1 << _days_in_month(year, month) + 1) - 1)
+    return info
+
+
+def _next_bit(mask, position):
+    """Returns the lowest set bit of mask at or above position, or -1 if there is none"""
+    mask >>= position
+    if not mask:
+        return -1
+    return position + (mask & -mask).bit_length() - 1
+
+
+def _parse_field(text, low, high, names):
+    """Parses one cron field into a bitset with bit n set if the field matches n
+
+    Args:
+        text: str field, e.g. "*", "*/15", "1-5", "mon-fri", "0,30"
+
+        low: int lowest allowed value
+
+        high: int highest allowed value
+
+        names: tuple of names for low, low + 1, ... or None
+
+    Raises:
+        ValueError if the field is malformed or out of range
+
+    Returns:
+        int bitset
+    """
+    def value(token):
+        if names is not None and token.lower() in names:
+            return names.index(token.lower()) + low
+        try:
+            number = int(token)
+        except ValueError:
+            raise ValueError("Invalid cron value %r" % token)
+        if not low <= number <= high:
+            raise ValueError("Cron value %d is out of range %d-%d" % (number, low, high))
+        return number
+
+    mask = 0
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text) if step_text.isdigit() else 0
+            if step < 1:
+                raise ValueError("Invalid cron step %r" % step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = value(start_text), value(end_text)
+            if start > end:
+                raise ValueError("Invalid cron range %r" % part)
+        else:
+            start = value(part)
+            # "5/10" means from 5 to the end in steps of 10
+            end = high if step > 1 else start
+        for number in range(start, end + 1, step):
+            mask |= 1 << number
+    return mask
+
+
+class CronSchedule(object):
+    """A schedule from a standard 5 field cron expression (minute hour day-of-month month day-of-week), or one of
+    the @yearly, @monthly, @weekly, @daily and @hourly macros. Fields accept *, lists, ranges, steps and month and
+    day names. As in cron, if both the day of month and day of week are restricted (neither starts with *), a day matching
+either runs, otherwise a day has to match both, so "0 0 * * */2" runs every other day of the week.
+
+    The expression is parsed once into one bitset per field. next_fire finds the next matching month, day, hour
+    and minute with bit operations, skipping whole months, days and hours at a time instead of stepping through
+    every minute.
+
+    Times are matched against wall clock time in tz (the local time zone by default), so "0 9 * * *" runs at
+    9:00 in tz across DST changes. A time skipped by a DST change runs at the equivalent time after the change
+    (2:30 becomes 3:30), and a time repeated by a DST change runs once, unless the hour field is *.
+    """
+
+    def __init__(self, expression, tz=None):
+        """Parses a cron expression
+
+        Args:
+            expression: str cron expression
+
+            tz: datetime.tzinfo (e.g. zoneinfo.ZoneInfo("Europe/Paris") or datetime.timezone.utc) to match times in.
+            None uses the local time zone
+
+        Raises:
+            ValueError if the expression is malformed or can never fire
+
+        Returns:
+            A new CronSchedule
+        """
+        self._expression = expression
+        self._tz = tz
+        fields = _MACROS.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("Cron expression %r must have 5 fields" % expression)
+        self._minutes, self._hours, self._days, self._months, weekdays = (
+            _parse_field(text, low, high, names) for text, (low, high, names) in zip(fields, _FIELDS))
+        # 7 is another name for Sunday
+        if weekdays & 1 << 7:
+            weekdays = (weekdays | 1) & 0x7f
+        self._weekdays = weekdays
+        self._any_hour = fields[1] == "*"
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+        # days of the month matching weekdays, for each weekday (0 is Sunday) the 1st of the month can fall on
+        self._weekday_days = list()
+        for first_weekday in range(7):
+            mask = 0
+            for day in range(1, 32):
+                if weekdays & 1 << ((first_weekday + day - 1) % 7):
+                    mask |= 1 << day
+            self._weekday_days.append(mask)
+        if (self._any_day or self._any_weekday) and not any(self._days & ((1 << _days_in_month(2000, month) + 1) - 1)
+                                         for month in range(1, 13) if self._months & 1 << month):
+            raise ValueError("Cron expression %r can never fire" % expression)
+
+    def __repr__(self):
+        return "CronSchedule(%r, tz=%r)" % (self._expression, self._tz)
+
+    def __call__(self):
+        now = time.time()
+        return self.next_fire(now) - now
+
+    def _day_mask(self, year, month):
+        """Returns the bitset of days in month matching the day of month and day of week fields"""
+        first_weekday, month_days = _month_info(year, month)
+        weekday_days = self._weekday_days[first_weekday]
+        if self._any_day or self._any_weekday:
+            # a * field may still have a step, e.g. */2
+            return self._days & weekday_days & month_days
+        return (self._days | weekday_days) & month_days
+
+    def _next_wall(self, year, month, day, hour, minute):
+        """Finds the first wall clock time at or after the one given that matches the expression
+
+        Args:
+            year, month, day, hour, minute: ints of a valid wall clock time
+
+        Raises:
+            ValueError if nothing matches within _MAX_YEARS years
+
+        Returns:
+            (year, month, day, hour, minute) tuple
+        """
+        last_year = year + _MAX_YEARS
+        while year <= last_year:
+            next_month = _next_bit(self._months, month)
+            if next_month < 0:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+            next_day = _next_bit(self._day_mask(year, month), day)
+            if next_day < 0:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                continue
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+            next_hour = _next_bit(self._hours, hour)
+            if next_hour < 0:
+                # past the last hour of the day, move on to the next day (or month)
+                hour, minute = 0, 0
+                day += 1
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+            next_minute = _next_bit(self._minutes, minute)
+            if next_minute < 0:
+                hour, minute = hour + 1, 0
+                if hour > 23:
+                    hour = 0
+                    day += 1
+                continue
+            return year, month, day, hour, next_minute
+        raise ValueError("Cron expression %r does not fire within %d years" % (self._expression, _MAX_YEARS))
+
+    def next_fire(self, after):
+        """Returns the first time strictly after after that matches the expression
+
+        Args:
+            after: float seconds since the epoch
+
+        Returns:
+            float seconds since the epoch
+        """
+        tz = self._tz
+        moment = datetime.datetime.fromtimestamp(after, tz)
+        start = moment.replace(second=0, microsecond=0, fold=0, tzinfo=None) + _ONE_MINUTE
+        fire = self._first_fire(start, after, tz)
+        # datetime.timezone is a fixed offset, without DST changes
+        if self._any_hour and not isinstance(tz, datetime.timezone):
+            # after may be in the first pass of an hour repeated by a DST change, when the second pass is also still
+            # to come. Its times are behind start on the wall clock, so search them separately
+            repeat = moment.replace(fold=1).timestamp() - moment.replace(fold=0).timestamp()
+            if repeat > 0:
+                earlier = self._first_fire(start - datetime.timedelta(seconds=repeat), after, tz)
+                fire = min(fire, earlier)
+        return fire
+
+    def _first_fire(self, start, after, tz):
+        """Returns the first time after after whose wall clock time is at or after start and matches the expression
+
+        Args:
+            start: naive datetime.datetime wall clock time to start searching from
+
+            after: float seconds since the epoch
+
+            tz: datetime.tzinfo or None
+
+        Returns:
+            float seconds since the epoch
+        """
+        while True:
+            wall = datetime.datetime(*self._next_wall(start.year, start.month, start.day, start.hour, start.minute),
+                                     tzinfo=tz)
+            fire = wall.timestamp()
+            if fire > after:
+                return fire
+            # the first pass of an hour repeated by a DST change, which is already over
+            if self._any_hour:
+                fire = wall.replace(fold=1).timestamp()
+                if fire > after:
+                    return fire
+            start = wall.replace(tzinfo=None) + _ONE_MINUTE
+
+
+class AnchoredInterval(object):
+    """A fixed interval schedule that fires at anchor + n * seconds. Unlike after_x_seconds, a slow run does not
+    push every later run back, and runs that were missed are skipped rather than run late.
+    """
+
+    def __init__(self, seconds, anchor=0.0):
+        """Creates a new AnchoredInterval
+
+        Args:
+            seconds: positive number of seconds between runs
+
+            anchor: float seconds since the epoch of any time the schedule fires at. The default of 0 aligns
+            intervals that divide a day to UTC midnight
+
+        Raises:
+            ValueError if seconds is not positive
+
+        Returns:
+            A new AnchoredInterval
+        """
+        if seconds <= 0:
+            raise ValueError("AnchoredInterval seconds must be positive, got %r" % seconds)
+        self._seconds = seconds
+        self._anchor = anchor
+
+    def __repr__(self):
+        return "AnchoredInterval(%r, anchor=%r)" % (self._seconds, self._anchor)
+
+    def __call__(self):
+        now = time.time()
+        return self.next_fire(now) - now
+
+    def next_fire(self, after):
+        """Returns the first time strictly after after that the schedule fires at
+
+        Args:
+            after: float seconds since the epoch
+
+        Returns:
+            float seconds since the epoch
+        """
+        return self._anchor + ((after - self._anchor) // self._seconds + 1) * self._seconds
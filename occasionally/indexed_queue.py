@@ -0,0 +1,340 @@
+import heapq
+import itertools
+from .priority_queue import QueueEmptyException, QueueFullException
+from .log import log
+
+
+class IndexedPriorityQueue(object):
+    """A binary heap that keeps track of where each of its elements is, so that an element can be removed, or
+    moved after its key changed, in O(log n) without searching for it. Has the same interface as
+    occasionally.priority_queue.PriorityQueue (key engine), plus remove, update and in.
+
+    Entries are (key, insertion_order, element) tuples, like the key engine's, and each element's index in the heap
+    is kept in its _queue_index attribute (occasionally.task.Task has one), which is cheaper than a dict from
+    elements to indexes. Sifting has to update those indexes, so it runs in Python rather than in C (heapq), and
+    enqueue and dequeue cost a few times more than with PriorityQueue. Bulk operations (enqueue_many,
+    remove_where) still rebuild the heap with heapq in O(n). An element can only be in one IndexedPriorityQueue
+    at a time.
+    """
+
+    def __init__(self, key, max_size=0):
+        """Creates a new IndexedPriorityQueue
+
+        Args:
+            key: a function that maps an element to a sort key, lowest key being highest priority
+
+            max_size: the maximum number of elements. See occasionally.priority_queue.PriorityQueue. 0 indicates
+            no max size
+
+        Returns:
+            A new IndexedPriorityQueue
+        """
+        self._key = key
+        self._max_size = max_size
+        self._heap = list()
+        self._counter = itertools.count()
+
+    def __repr__(self):
+        return "IndexedPriorityQueue(key=%s, max_size=%r)" % (self._key.__name__, self._max_size)
+
+    def __str__(self):
+        return "#<IndexedPriorityQueue: max_size=%s key_function=%s>" % (self._max_size, self._key.__name__)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item):
+        index = getattr(item, "_queue_index", None)
+        return index is not None and index < len(self._heap) and self._heap[index][-1] is item
+
+    def peek(self):
+        """get the element with the lowest key, and if no items exist, raises QueueEmptyException
+
+        Args:
+
+        Raises:
+            QueueEmptyException
+
+        Returns:
+            The element with the lowest key
+        """
+        if not self._heap:
+            raise QueueEmptyException("%s is empty" % self)
+        return self._heap[0][-1]
+
+    def enqueue(self, item):
+        """Inserts a new item. An item that is already in the queue is moved to its current key instead
+
+        Args:
+            item: Any object that adheres to self._key, with a writable _queue_index attribute
+
+        Raises:
+            QueueFullException
+
+        Returns:
+        """
+        heap = self._heap
+        index = item._queue_index
+        if index is not None and index < len(heap) and heap[index][-1] is item:
+            self.update(item)
+            return
+        if 0 < self._max_size <= len(heap):
+            log.error("Excluding inserting %s into IndexedPriorityQueue due to max_size being reached", item)
+            raise QueueFullException("%s is full" % self)
+        heap.append((self._key(item), next(self._counter), item))
+        self._sift_up(len(heap) - 1)
+
+    def dequeue(self):
+        """Removes and returns the element with the lowest key
+
+        Args:
+
+        Raises:
+            QueueEmptyException
+
+        Returns:
+            The element with the lowest key
+        """
+        heap = self._heap
+        if not heap:
+            raise QueueEmptyException("%s is empty" % self)
+        last = heap.pop()
+        if not heap:
+            last[-1]._queue_index = None
+            return last[-1]
+        item = heap[0][-1]
+        heap[0] = last
+        self._sift_down(0)
+        item._queue_index = None
+        return item
+
+    def dequeue_up_to(self, key):
+        """Removes and returns every element whose key is less than or equal to key
+
+        Args:
+            key: a key as returned by self._key
+
+        Returns:
+            A list of the removed elements, lowest key first
+        """
+        heap = self._heap
+        due = list()
+        # like PriorityQueue, pops a few elements before splitting the heap in one pass
+        for _ in range(len(heap) // 16 + 1):
+            if not heap or heap[0][0] > key:
+                return due
+            due.append(self.dequeue())
+        if not heap or heap[0][0] > key:
+            return due
+        rest = list()
+        more = list()
+        for entry in heap:
+            (more if entry[0] <= key else rest).append(entry)
+        more.sort()
+        self._rebuild(rest)
+        for entry in more:
+            entry[-1]._queue_index = None
+            due.append(entry[-1])
+        return due
+
+    def enqueue_many(self, items):
+        """Inserts several items at once, rebuilding the heap in O(n) when there are as many items as queued
+        elements. If the items would not all fit within max_size, none are inserted. Items already in the queue
+        are moved to their current keys
+
+        Args:
+            items: iterable of objects that adhere to self._key
+
+        Raises:
+            QueueFullException
+
+        Returns:
+        """
+        items = list(items)
+        queued = [item for item in items if item in self]
+        if queued:
+            for item in queued:
+                self.update(item)
+            queued_ids = set(id(item) for item in queued)
+            items = [item for item in items if id(item) not in queued_ids]
+        if self._max_size > 0 and len(self._heap) + len(items) > self._max_size:
+            log.error("Excluding inserting %d items into IndexedPriorityQueue due to max_size being reached",
+                      len(items))
+            raise QueueFullException("%s is full" % self)
+        key = self._key
+        counter = self._counter
+        entries = [(key(item), next(counter), item) for item in items]
+        if len(entries) >= len(self._heap):
+            self._rebuild(self._heap + entries)
+            return
+        heap = self._heap
+        for entry in entries:
+            heap.append(entry)
+            self._sift_up(len(heap) - 1)
+
+    def remove(self, item):
+        """Removes item from the queue in O(log n)
+
+        Args:
+            item: an element
+
+        Returns:
+            bool, False if item is not in the queue
+        """
+        if item not in self:
+            return False
+        heap = self._heap
+        index = item._queue_index
+        item._queue_index = None
+        last = heap.pop()
+        if index == len(heap):
+            return True
+        removed = heap[index]
+        heap[index] = last
+        if last < removed:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+        return True
+
+    def update(self, item):
+        """Moves item to where its current key belongs in O(log n), after the key changed
+
+        Args:
+            item: an element
+
+        Returns:
+            bool, False if item is not in the queue
+        """
+        if item not in self:
+            return False
+        index = item._queue_index
+        old = self._heap[index]
+        # a new insertion order, an updated element goes after the others with the same key
+        entry = self._heap[index] = (self._key(item), next(self._counter), item)
+        if entry < old:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+        return True
+
+    def remove_where(self, predicate):
+        """Removes every element for which predicate returns True, then rebuilds the heap in O(n)
+
+        Args:
+            predicate: a function that takes an element and returns a bool
+
+        Returns:
+            A list of the removed elements, in no particular order
+        """
+        kept = list()
+        removed = list()
+        for entry in self._heap:
+            (removed if predicate(entry[-1]) else kept).append(entry)
+        self._rebuild(kept)
+        for entry in removed:
+            entry[-1]._queue_index = None
+        return [entry[-1] for entry in removed]
+
+    def sorted_view(self):
+        """Iterates over the elements from lowest key to highest without modifying the queue, see
+        occasionally.priority_queue.PriorityQueue.sorted_view
+
+        Args:
+
+        Returns:
+            An iterator of elements in key order
+        """
+        heap = list(self._heap)
+        while heap:
+            yield heapq.heappop(heap)[-1]
+
+    def set_max_size(self, new_size):
+        """Sets a new max size. If there are more elements than new_size, the ones with the highest keys are
+        purged
+
+        Args:
+            new_size: int for max new size of the queue
+
+        Returns:
+        """
+        self._max_size = new_size
+        if new_size > 0 and len(self._heap) > new_size:
+            kept = heapq.nsmallest(new_size, self._heap)
+            for entry in self._heap:
+                entry[-1]._queue_index = None
+            self._rebuild(kept)
+
+    def _elements(self):
+        """Iterates over the elements in the queue, in heap (not priority) order"""
+        return (entry[-1] for entry in self._heap)
+
+    def _rebuild(self, entries):
+        """Replaces the heap with entries, heapified in O(n), and sets every element's index
+
+        Args:
+            entries: list of (key, insertion_order, element) tuples
+
+        Returns:
+        """
+        heapq.heapify(entries)
+        self._heap = entries
+        for index, entry in enumerate(entries):
+            entry[-1]._queue_index = index
+
+    def _sift_up(self, index):
+        """Moves the entry at index towards the root until its parent's key is lower, updating the indexes of
+        the entries it passes
+
+        Args:
+            index: int index in self._heap
+
+        Returns:
+        """
+        heap = self._heap
+        entry = heap[index]
+        while index > 0:
+            parent_index = (index - 1) >> 1
+            parent = heap[parent_index]
+            if not entry < parent:
+                break
+            heap[index] = parent
+            parent[-1]._queue_index = index
+            index = parent_index
+        heap[index] = entry
+        entry[-1]._queue_index = index
+
+    def _sift_down(self, index):
+        """Moves the entry at index towards the leaves until both its children have higher keys, updating the
+        indexes of the entries it passes. Like heapq, it first follows the smaller children all the way down
+        without comparing them to the entry, then moves the entry back up, which takes about half the comparisons
+        when the entry came from the bottom of the heap, as it does in dequeue
+
+        Args:
+            index: int index in self._heap
+
+        Returns:
+        """
+        heap = self._heap
+        end = len(heap)
+        start = index
+        entry = heap[index]
+        child_index = 2 * index + 1
+        while child_index < end:
+            right_index = child_index + 1
+            if right_index < end and not heap[child_index] < heap[right_index]:
+                child_index = right_index
+            child = heap[index] = heap[child_index]
+            child[-1]._queue_index = index
+            index = child_index
+            child_index = 2 * index + 1
+        while index > start:
+            parent_index = (index - 1) >> 1
+            parent = heap[parent_index]
+            if not entry < parent:
+                break
+            heap[index] = parent
+            parent[-1]._queue_index = index
+            index = parent_index
+        heap[index] = entry
+        entry[-1]._queue_index = index
@@ -1,3 +1,28 @@
-import logging
+"""The package's logger. log stands in for the "occasionally.log" logging.Logger, and only imports logging (which
+imports re, traceback and string, and takes longer to import than the rest of the package) the first time it is used,
+so short-lived processes that never log don't pay for it."""
 
-log = logging.getLogger(__name__)
\ No newline at end of file
+
+class _LazyLogger(object):
+    """Forwards to the "occasionally.log" logging.Logger. Its methods are looked up once and then stored on the
+    instance, so calling them costs no more than calling them on the logger"""
+
+    def _logger(self):
+        import logging
+        return logging.getLogger(__name__)
+
+    def __getattr__(self, name):
+        # only called for attributes that are not stored on the instance yet
+        value = getattr(self._logger(), name)
+        if callable(value):
+            object.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self._logger(), name, value)
+
+    def __repr__(self):
+        return repr(self._logger())
+
+
+log = _LazyLogger()
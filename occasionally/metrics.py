@@ -0,0 +1,373 @@
+import bisect
+import threading
+from collections import deque
+from .log import log
+
+# runs are buffered and folded into the histograms in batches of this many
+_FOLD_EVERY = 4096
+
+# exponential bucket upper bounds in seconds, from 1 microsecond to ~134 seconds
+DEFAULT_BOUNDS = tuple(1e-6 * 2 ** exponent for exponent in range(28))
+
+
+class Histogram(object):
+    """A histogram with fixed buckets, so it takes the same memory however many values it has observed.
+    Buckets follow the Prometheus convention: a value is counted in the first bucket whose upper bound it
+    is less than or equal to, and values above the last bound go in an overflow (+Inf) bucket.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """Creates a new Histogram
+
+        Args:
+            bounds: iterable of bucket upper bounds
+
+        Returns:
+            A new Histogram
+        """
+        self._bounds = tuple(sorted(bounds))
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def __repr__(self):
+        return "Histogram(count=%d, sum=%r)" % (self._count, self._sum)
+
+    def observe(self, value):
+        """Records a value
+
+        Args:
+            value: number
+
+        Returns:
+        """
+        self._add(bisect.bisect_left(self._bounds, value), value)
+
+    def _add(self, bucket, value):
+        self._counts[bucket] += 1
+        self._sum += value
+        self._count += 1
+
+    def quantile(self, fraction):
+        """Estimates a quantile as the upper bound of the bucket it falls in
+
+        Args:
+            fraction: float between 0 and 1, e.g. 0.99
+
+        Returns:
+            float upper bound, inf if the quantile is in the overflow bucket, or None if nothing has been observed
+        """
+        if self._count == 0:
+            return None
+        rank = fraction * self._count
+        cumulative = 0
+        for index, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self._bounds[index] if index < len(self._bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        """Returns the histogram as a dict of count, sum, p50, p99 and cumulative buckets ((upper bound, count) pairs)
+
+        Args:
+
+        Returns:
+            dict
+        """
+        counts = list(self._counts)
+        cumulative = list()
+        total = 0
+        for bound, count in zip(self._bounds + (float("inf"),), counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"count": self._count, "sum": self._sum, "p50": self.quantile(0.5), "p99": self.quantile(0.99),
+                "buckets": cumulative}
+
+
+class TaskMetrics(object):
+    """Metrics for one task, or for all tasks when used as the global metrics"""
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.invoke_latency = Histogram(bounds)
+        self.call_duration = Histogram(bounds)
+        self.successes = 0
+        self.failures = 0
+
+    def snapshot(self):
+        return {"invoke_latency": self.invoke_latency.snapshot(), "call_duration": self.call_duration.snapshot(),
+                "successes": self.successes, "failures": self.failures}
+
+
+# how Metrics groups its per task metrics
+PER_FUNCTION = "function"
+PER_TASK_ID = "task_id"
+
+
+class Metrics(object):
+    """Collects metrics from a occasionally.scheduler.Scheduler, globally and per task:
+        invoke_latency: seconds between a task's _next_invoke and when it actually started
+        call_duration: seconds spent in the task's call_function (for pooled tasks, from dispatch to completion)
+        successes and failures: counts of calls that did and did not raise
+        queue_depth: number of tasks in the scheduler's queue
+        heap_time and user_time: total seconds the scheduler spent in its queue versus in call_functions
+
+    Everything is kept in fixed size histograms and counters. By default per task metrics are keyed by the
+    call_function's name, so tasks of the same kind share their metrics and their number (and the number of
+    Prometheus label values) doesn't grow with the number of tasks. PER_TASK_ID keys them by task_id instead, which
+    only suits a bounded number of tasks.
+
+    Reading the clock and filling histograms costs about as much as running an empty call_function, so by default
+    only one in sample_every inline runs is timed. The global successes and failures still count every run (the
+    runs in between are counted along with the next sampled one, and when foreground returns), everything else
+    (histograms, per task counts, heap_time and user_time) only covers sampled runs. Runs in a pool or of a
+    coalescing scheduler are always timed. See benchmarks/bench_metrics_overhead.py.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS, per_task=PER_FUNCTION, sample_every=16):
+        """Creates a new Metrics
+
+        Args:
+            bounds: iterable of histogram bucket upper bounds in seconds
+
+            per_task: PER_FUNCTION to keep metrics per call_function name as well as globally, PER_TASK_ID to keep
+            them per task_id (per call_function name for tasks without one), or False to only keep global metrics
+
+            sample_every: int, time one in this many inline runs. 1 times every run
+
+        Raises:
+            ValueError if per_task is not one of the above
+
+        Returns:
+            A new Metrics
+        """
+        if per_task not in (PER_FUNCTION, PER_TASK_ID, False, None):
+            raise ValueError("Unknown Metrics per_task %r" % (per_task,))
+        self._bounds = tuple(bounds)
+        self._per_task = per_task
+        self._sample_every = sample_every
+        self.totals = TaskMetrics(self._bounds)
+        self.tasks = dict()
+        self.heap_time = 0.0
+        self.user_time = 0.0
+        self._schedulers = list()
+        # runs not yet folded into the histograms. deque append and popleft are thread safe
+        self._samples = deque()
+        self._fold_lock = threading.Lock()
+
+    def __repr__(self):
+        return "Metrics(per_task=%r, sample_every=%r)" % (self._per_task, self._sample_every)
+
+    def _attach(self, scheduler):
+        """Called by a Scheduler that reports to these metrics, so queue_depth can be read from it"""
+        self._schedulers.append(scheduler)
+
+    @property
+    def queue_depth(self):
+        return sum(len(scheduler) for scheduler in self._schedulers)
+
+    @property
+    def sample_every(self):
+        """int, a scheduler times one in this many of its inline runs"""
+        return self._sample_every
+
+    def record(self, task, latency, duration, failed, unsampled=0, unsampled_failures=0):
+        """Records a timed run of task, along with the outcomes of the runs since the last timed one that were
+        not. Called by the scheduler for every timed run, so it only buffers the run, runs are folded into the
+        histograms in batches
+
+        Args:
+            task: occasionally.task.Task that ran
+
+            latency: float seconds between the task's _next_invoke and the start of the run
+
+            duration: float seconds the run took
+
+            failed: bool, whether call_function raised
+
+            unsampled: int number of runs that were not timed
+
+            unsampled_failures: int number of those that raised
+
+        Returns:
+        """
+        samples = self._samples
+        samples.append((task, latency, duration, failed, unsampled, unsampled_failures))
+        if len(samples) >= _FOLD_EVERY:
+            self._fold()
+
+    def count_unsampled(self, runs, failures):
+        """Records the outcomes of runs that were not timed, which a scheduler has not reported with a timed run
+
+        Args:
+            runs: int number of runs
+
+            failures: int number of those that raised
+
+        Returns:
+        """
+        self._samples.append((None, None, None, False, runs, failures))
+
+    def _fold(self):
+        """Moves buffered runs into the histograms and counters. The only place the counters are updated, so
+        runs recorded by several schedulers and read by snapshot from another thread are never lost
+
+        Args:
+
+        Returns:
+        """
+        with self._fold_lock:
+            samples = self._samples
+            totals = self.totals
+            per_task = self._per_task
+            bounds = self._bounds
+            latency_counts = totals.invoke_latency._counts
+            duration_counts = totals.call_duration._counts
+            latency_sum = duration_sum = 0.0
+            failures = runs = count = 0
+            # call_function -> its TaskMetrics, saves working out the name of every run's task
+            by_function = dict() if per_task == PER_FUNCTION else None
+            for _ in range(len(samples)):
+                task, latency, duration, failed, unsampled, unsampled_failures = samples.popleft()
+                runs += unsampled
+                failures += unsampled_failures
+                if task is None:
+                    # only counts
+                    continue
+                runs += 1
+                failures += failed
+                count += 1
+                latency_bucket = bisect.bisect_left(bounds, latency)
+                duration_bucket = bisect.bisect_left(bounds, duration)
+                latency_counts[latency_bucket] += 1
+                duration_counts[duration_bucket] += 1
+                latency_sum += latency
+                duration_sum += duration
+                if not per_task:
+                    continue
+                if by_function is not None:
+                    task_metrics = by_function.get(task._call_function)
+                    if task_metrics is None:
+                        task_metrics = by_function[task._call_function] = self._metrics_of(task, per_task)
+                else:
+                    task_metrics = self._metrics_of(task, per_task)
+                task_metrics.invoke_latency._add(latency_bucket, latency)
+                task_metrics.call_duration._add(duration_bucket, duration)
+                if failed:
+                    task_metrics.failures += 1
+                else:
+                    task_metrics.successes += 1
+            totals.invoke_latency._count += count
+            totals.invoke_latency._sum += latency_sum
+            totals.call_duration._count += count
+            totals.call_duration._sum += duration_sum
+            totals.failures += failures
+            totals.successes += runs - failures
+
+    def _metrics_of(self, task, per_task):
+        name = self._task_name(task, per_task)
+        task_metrics = self.tasks.get(name)
+        if task_metrics is None:
+            task_metrics = self.tasks[name] = TaskMetrics(self._bounds)
+        return task_metrics
+
+    @staticmethod
+    def _task_name(task, per_task):
+        if per_task == PER_TASK_ID and task._task_id is not None:
+            return str(task._task_id)
+        return getattr(task._call_function, "__name__", repr(task._call_function))
+
+    def snapshot(self):
+        """Returns all of the metrics as a dict
+
+        Args:
+
+        Returns:
+            dict with keys totals, tasks (task name -> metrics), queue_depth, heap_time and user_time
+        """
+        self._fold()
+        return {"totals": self.totals.snapshot(),
+                "tasks": dict((name, metrics.snapshot()) for name, metrics in list(self.tasks.items())),
+                "queue_depth": self.queue_depth, "heap_time": self.heap_time, "user_time": self.user_time}
+
+    def prometheus_text(self):
+        """Returns all of the metrics in the Prometheus text exposition format
+
+        Args:
+
+        Returns:
+            str
+        """
+        self._fold()
+        lines = list()
+        for name, kind, help_text in (
+                ("occasionally_invoke_latency_seconds", "histogram", "Seconds between a task being due and starting"),
+                ("occasionally_call_duration_seconds", "histogram", "Seconds spent running a task"),
+                ("occasionally_calls_total", "counter", "Task calls by outcome")):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            groups = [(None, self.totals)] + sorted(self.tasks.items())
+            for task_name, metrics in groups:
+                labels = "" if task_name is None else 'task="%s"' % _escape(task_name)
+                if kind == "counter":
+                    for outcome, value in (("success", metrics.successes), ("failure", metrics.failures)):
+                        lines.append("%s{%s} %d" % (name, _join(labels, 'outcome="%s"' % outcome), value))
+                    continue
+                histogram = metrics.invoke_latency if "latency" in name else metrics.call_duration
+                for bound, count in histogram.snapshot()["buckets"]:
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('%s_bucket{%s} %d' % (name, _join(labels, 'le="%s"' % le), count))
+                lines.append("%s_sum%s %r" % (name, "{%s}" % labels if labels else "", histogram._sum))
+                lines.append("%s_count%s %d" % (name, "{%s}" % labels if labels else "", histogram._count))
+        for name, kind, help_text, value in (
+                ("occasionally_queue_depth", "gauge", "Tasks in the scheduler queue", self.queue_depth),
+                ("occasionally_heap_seconds_total", "counter", "Seconds spent in the scheduler queue", self.heap_time),
+                ("occasionally_user_seconds_total", "counter", "Seconds spent in call_functions", self.user_time)):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.append("%s %r" % (name, value))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=0, host="127.0.0.1"):
+        """Serves prometheus_text over HTTP from a background thread
+
+        Args:
+            port: int port to listen on, 0 picks a free one (see server.server_address)
+
+            host: str address to listen on, only the local machine by default
+
+        Returns:
+            The http server. Call shutdown on it to stop serving
+        """
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            # python 2.7
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("metrics server: " + format, *args)
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name="occasionally-metrics")
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _join(*labels):
+    return ",".join(label for label in labels if label)
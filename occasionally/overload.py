@@ -0,0 +1,224 @@
+"""Overload policies: what a Scheduler does when tasks come due faster than it can run them
+
+A Scheduler falls behind when its call_functions take longer, in total, than the time between their runs. Without a
+policy it runs every overdue task back to back, and with RESCHEDULE_ON_DISPATCH the pool's queue keeps growing, so
+tasks start later and later. A policy is told the lag of every task that comes due, i.e. how long after its next
+invoke time it is being started, plus how long runs currently wait in the pool's queue, and decides whether the task
+runs and how far away its next run is.
+
+    scheduler = Scheduler(overload=SkipMissedRuns(max_lag=5))
+"""
+import bisect
+import heapq
+from .log import log
+
+
+class OverloadPolicy(object):
+    """Runs every due task, like a Scheduler without a policy, while keeping track of the lag. The base class of the
+    other policies, which override admit, stretch or evict
+
+    Attributes:
+        max_lag: float seconds of lag the policy tolerates
+
+        lag: float seconds, exponentially weighted moving average of the lag of the tasks that came due
+
+        skipped: int number of runs the policy did not let run
+
+        shed: int number of tasks dropped because the queue was at max_size
+    """
+
+    def __init__(self, max_lag=1.0, smoothing=0.1):
+        """Creates a new OverloadPolicy
+
+        Args:
+            max_lag: float seconds, more than 0
+
+            smoothing: float between 0 and 1, the weight of each new lag in the moving average
+
+        Raises:
+            ValueError if max_lag is not more than 0
+
+        Returns:
+            A new OverloadPolicy
+        """
+        if max_lag <= 0:
+            raise ValueError("max_lag must be more than 0, got %r" % (max_lag,))
+        self.max_lag = max_lag
+        self.lag = 0.0
+        self.skipped = 0
+        self.shed = 0
+        self._smoothing = smoothing
+        # scheduler clock time and self.lag at the last call to _adjust
+        self._adjusted_at = 0.0
+        self._adjusted_lag = 0.0
+
+    def __repr__(self):
+        return "%s(max_lag=%r)" % (type(self).__name__, self.max_lag)
+
+    @property
+    def overloaded(self):
+        return self.lag > self.max_lag
+
+    def _observe(self, lag, now):
+        """Folds the lag of a due task into the moving average, and lets the policy adjust itself at most once
+        every max_lag seconds
+
+        Args:
+            lag: float seconds
+
+            now: float time on the scheduler's clock
+
+        Returns:
+        """
+        self.lag += self._smoothing * (lag - self.lag)
+        if now - self._adjusted_at >= self.max_lag:
+            self._adjust()
+            self._adjusted_at = now
+            self._adjusted_lag = self.lag
+
+    def _adjust(self):
+        """Called every max_lag seconds while tasks come due, to react to self.lag"""
+
+    @property
+    def _lag_rising(self):
+        """Whether the lag is above max_lag and has not gone down since the last _adjust. While a backlog built up
+        earlier is being worked through the lag stays high for a while, but falls, and the policy holds steady
+        instead of overreacting"""
+        return self.lag > self.max_lag and self.lag >= self._adjusted_lag
+
+    def admit(self, task, lag):
+        """Decides whether a due task runs. A task that doesn't is rescheduled from now without running
+
+        Args:
+            task: occasionally.task.Task that is due
+
+            lag: float seconds the task is late by, including the time it is expected to wait in the pool
+
+        Returns:
+            bool
+        """
+        return True
+
+    def stretch(self, task, delay):
+        """Decides how long until a task that was just rescheduled runs again
+
+        Args:
+            task: occasionally.task.Task
+
+            delay: float seconds until the next run its frequency_function asked for
+
+        Returns:
+            float seconds
+        """
+        return delay
+
+    def evict(self, queued, incoming, count):
+        """Picks tasks to drop when the tasks being put back in the queue don't all fit within max_size
+
+        Args:
+            queued: iterable of the occasionally.task.Task in the queue
+
+            incoming: list of the occasionally.task.Task being put back
+
+            count: int number of tasks to drop
+
+        Returns:
+            list of count tasks, from queued or incoming
+        """
+        return incoming[-count:]
+
+
+class SkipMissedRuns(OverloadPolicy):
+    """Skips the run of a task that is more than max_lag late, and reschedules it from now, so no run starts more
+    than max_lag late and the backlog is dropped instead of worked through"""
+
+    def admit(self, task, lag):
+        return lag <= self.max_lag
+
+
+class CoalesceMissedRuns(OverloadPolicy):
+    """Lets a task that is more than max_lag late make a single catch-up run for all of the runs it missed. Inline,
+    a late task already runs once and is rescheduled from when it finishes. With a pool and RESCHEDULE_ON_DISPATCH,
+    a late task that still has a run waiting in the pool is not handed another one, so the pool's queue holds at
+    most one run per task instead of growing without bound"""
+
+    def admit(self, task, lag):
+        return lag <= self.max_lag or task._running == 0
+
+
+class ShedLowestPriority(OverloadPolicy):
+    """Skips the runs of the lowest priority tasks (see occasionally.task.Task priority) while the average lag is
+    above max_lag. Every max_lag seconds that the lag is high and not falling, the next priority up is shed too, and
+    every max_lag seconds it stays below half of max_lag, the highest shed priority runs again. The highest priority is
+    never shed. When the queue is full, the lowest priority tasks are the ones dropped."""
+
+    def __init__(self, max_lag=1.0, smoothing=0.1):
+        super(ShedLowestPriority, self).__init__(max_lag=max_lag, smoothing=smoothing)
+        # sorted priorities of the tasks seen so far, runs of tasks below _levels[_shed_level] are skipped
+        self._levels = list()
+        self._shed_level = 0
+
+    @property
+    def shedding_below(self):
+        """int priority that tasks need to run, None while nothing is shed"""
+        if self._shed_level == 0:
+            return None
+        return self._levels[self._shed_level]
+
+    def _adjust(self):
+        if self._lag_rising and self._shed_level < len(self._levels) - 1:
+            self._shed_level += 1
+            log.warning("Lag of %.3fs is over %.3fs, shedding tasks with priority below %d", self.lag, self.max_lag,
+                        self._levels[self._shed_level])
+        elif self.lag < self.max_lag / 2.0 and self._shed_level > 0:
+            self._shed_level -= 1
+            log.info("Lag is down to %.3fs, shedding tasks with priority below %s", self.lag, self.shedding_below)
+
+    def admit(self, task, lag):
+        priority = task.priority
+        levels = self._levels
+        index = bisect.bisect_left(levels, priority)
+        if index == len(levels) or levels[index] != priority:
+            levels.insert(index, priority)
+            if index < self._shed_level:
+                self._shed_level += 1
+        return priority >= levels[self._shed_level]
+
+    def evict(self, queued, incoming, count):
+        return heapq.nsmallest(count, list(queued) + list(incoming), key=lambda task: task.priority)
+
+
+class StretchFrequencies(OverloadPolicy):
+    """Stretches the time between runs of every task while the average lag is above max_lag. Every max_lag seconds
+    that the lag is high and not falling, the stretch grows by step (up to max_stretch), and every max_lag seconds it
+    stays below half of max_lag, it shrinks by step (down to no stretch). Every run still happens, just less often."""
+
+    def __init__(self, max_lag=1.0, smoothing=0.1, step=2.0, max_stretch=16.0):
+        """Creates a new StretchFrequencies
+
+        Args:
+            max_lag, smoothing: see OverloadPolicy
+
+            step: float more than 1 the stretch is multiplied or divided by
+
+            max_stretch: float, the most the time between runs is multiplied by
+
+        Returns:
+            A new StretchFrequencies
+        """
+        super(StretchFrequencies, self).__init__(max_lag=max_lag, smoothing=smoothing)
+        self.factor = 1.0
+        self._step = step
+        self._max_stretch = max_stretch
+
+    def _adjust(self):
+        if self._lag_rising and self.factor < self._max_stretch:
+            self.factor = min(self._max_stretch, self.factor * self._step)
+            log.warning("Lag of %.3fs is over %.3fs, stretching frequencies by %.2fx", self.lag, self.max_lag,
+                        self.factor)
+        elif self.lag < self.max_lag / 2.0 and self.factor > 1.0:
+            self.factor = max(1.0, self.factor / self._step)
+            log.info("Lag is down to %.3fs, stretching frequencies by %.2fx", self.lag, self.factor)
+
+    def stretch(self, task, delay):
+        return delay * self.factor
@@ -1,5 +1,7 @@
+import heapq
+import itertools
 from collections import deque
-from log import log
+from .log import log
 
 class QueueFullException(Exception):
     """An exception to raise when an item is inserted into an already full queue"""
@@ -8,11 +10,24 @@ class QueueEmptyException(Exception):
     """An exception to raise when the queue is empty and someone tries to dequeue or peek"""
 
 class PriorityQueue(object):
-    """A class representing a priority queue. Backed by deque (thread safe double-ended queue)
+    """A class representing a priority queue. Backed by deque (double-ended queue)
     Follows a traditional priority queue model, where elements are either floated up (on insert)
     or down (on dequeue) so that index 0 is the next element to be executed. Index > 0 implies
     they will be dequeued later.
 
+    Two engines are available, chosen by the constructor:
+        comparator: elements are ordered by calling comparator(a, b), which returns the element with
+        higher priority. Elements are stored directly in the deque.
+
+        key: elements are ordered by key(element), lowest key first. Entries are stored in a list as
+        (key, insertion_order, element) tuples and maintained with heapq, so sifting is iterative and
+        runs in C. Insertion order breaks ties, so elements with equal keys are dequeued first in, first out
+        and never compared to each other.
+
+    Not thread safe: enqueue and dequeue move several elements around, so concurrent calls can corrupt the heap.
+    Guard the queue with a lock, or use occasionally.scheduler.Scheduler, whose add_task and add_tasks are safe
+    to call from any thread.
+
     Parent/child relationship based on index:
                         0
                      /     \
@@ -21,7 +36,7 @@ class PriorityQueue(object):
                  3     4  5     6
     """
 
-    def __init__(self, comparator, max_size=0):
+    def __init__(self, comparator=None, max_size=0, key=None):
         """Creates a new PriorityQueue
 
         Args:
@@ -31,19 +46,39 @@ class PriorityQueue(object):
             another element is attempted to be enqueued, that element will not (preserving existing elements).
             0 indicates no max size
 
+            key: a function that maps an element to a sort key, lowest key being highest priority. When given,
+            the key engine is used instead of the comparator engine. Exactly one of comparator and key must be set.
+
+        Raises:
+            ValueError if neither or both of comparator and key are given
+
         Returns:
             A new PriorityQueue
         """
+        if (comparator is None) == (key is None):
+            raise ValueError("PriorityQueue requires exactly one of comparator or key")
         self._comparator = comparator
+        self._key = key
         self._max_size = max_size
-        self._queue = deque()
+        if key is None:
+            self._queue = deque()
+        else:
+            self._queue = list()
+            self._counter = itertools.count()
 
     def __repr__(self):
+        if self._key is not None:
+            return "PriorityQueue(key=%s, max_size=%r)" % (self._key.__name__, self._max_size)
         return "PriorityQueue(%s, max_size=%r)" % (self._comparator.__name__, self._max_size)
 
     def __str__(self):
+        if self._key is not None:
+            return "#<PriorityQueue: max_size=%s key_function=%s>" % (self._max_size, self._key.__name__)
         return "#<PriorityQueue: max_size=%s comparator_function=%s>" % (self._max_size, self._comparator.__name__)
 
+    def __len__(self):
+        return len(self._queue)
+
     def peek(self):
         """get the first element of the queue, and if no items exist, raises QueueEmptyException
 
@@ -57,6 +92,8 @@ class PriorityQueue(object):
         """
         if len(self._queue) == 0:
             raise QueueEmptyException("%s is full" % self)
+        if self._key is not None:
+            return self._queue[0][-1]
         return self._queue[0]
 
     def enqueue(self, item):
@@ -68,6 +105,9 @@ class PriorityQueue(object):
             Returns:
         """
         if self._max_size <= 0 or len(self._queue) < self._max_size:
+            if self._key is not None:
+                heapq.heappush(self._queue, (self._key(item), next(self._counter), item))
+                return
             self._queue.append(item)
             self._float_up(len(self._queue) - 1)
         else:
@@ -89,12 +129,118 @@ class PriorityQueue(object):
 
         if len(self._queue) == 0:
             raise QueueEmptyException("%s is full" % self)
+        if self._key is not None:
+            return heapq.heappop(self._queue)[-1]
         # swap index 0 and -1 so we can float 0 (not guarenteed to be the top anymore) down
         self._swap(0, len(self._queue)-1)
         to_return = self._queue.pop()
         self._float_down(0)
         return to_return
 
+    def dequeue_up_to(self, key):
+        """Removes and returns every element whose key is less than or equal to key. Key engine only
+
+        Args:
+            key: a key as returned by self._key
+
+        Raises:
+            ValueError if the queue uses the comparator engine
+
+        Returns:
+            A list of the removed elements, lowest key first
+        """
+        if self._key is None:
+            raise ValueError("dequeue_up_to requires the key engine")
+        queue = self._queue
+        due = list()
+        # popping is O(log n) per element, which is cheaper than a full pass over the queue for a few elements
+        for _ in range(len(queue) // 16 + 1):
+            if not queue or queue[0][0] > key:
+                return due
+            due.append(heapq.heappop(queue)[-1])
+        if not queue or queue[0][0] > key:
+            return due
+        # many elements are due, split the queue in one pass instead
+        rest = list()
+        more = list()
+        for entry in queue:
+            (more if entry[0] <= key else rest).append(entry)
+        more.sort()
+        queue[:] = rest
+        heapq.heapify(queue)
+        due.extend(entry[-1] for entry in more)
+        return due
+
+    def enqueue_many(self, items):
+        """Inserts several items at once. Instead of floating each item up, the heap is rebuilt bottom up, which
+        is O(n) rather than O(n log n). If the items would not all fit within max_size, none are inserted.
+
+            Args:
+                items: iterable of objects that adhere to self._comparator or self._key
+
+            Raises:
+                QueueFullException
+
+            Returns:
+        """
+        items = list(items)
+        if self._max_size > 0 and len(self._queue) + len(items) > self._max_size:
+            log.error("Excluding inserting %d items into PriorityQueue due to max_size being reached", len(items))
+            raise QueueFullException("%s is full" % self)
+        if self._key is not None:
+            key = self._key
+            counter = self._counter
+            entries = [(key(item), next(counter), item) for item in items]
+            # rebuilding is O(len(queue) + len(items)), pushing each is O(len(items) * log(len(queue)))
+            if len(entries) >= len(self._queue):
+                self._queue.extend(entries)
+                heapq.heapify(self._queue)
+            else:
+                for entry in entries:
+                    heapq.heappush(self._queue, entry)
+            return
+        self._queue.extend(items)
+        self._heapify()
+
+    def remove_where(self, predicate):
+        """Removes every element for which predicate returns True, then rebuilds the heap in O(n)
+
+        Args:
+            predicate: a function that takes an element and returns a bool
+
+        Returns:
+            A list of the removed elements, in no particular order
+        """
+        kept = list()
+        removed = list()
+        if self._key is not None:
+            for entry in self._queue:
+                (removed if predicate(entry[-1]) else kept).append(entry)
+            self._queue[:] = kept
+            heapq.heapify(self._queue)
+            return [entry[-1] for entry in removed]
+        for item in self._queue:
+            (removed if predicate(item) else kept).append(item)
+        self._queue = deque(kept)
+        self._heapify()
+        return removed
+
+    def _elements(self):
+        """Iterates over the elements in the queue, in heap (not priority) order"""
+        if self._key is not None:
+            return (entry[-1] for entry in self._queue)
+        return iter(self._queue)
+
+    def _heapify(self):
+        """Restores the heap property of the whole comparator engine queue bottom up, in O(n)
+
+        Args:
+
+        Returns:
+        """
+        for index in range(len(self._queue) // 2 - 1, -1, -1):
+            self._float_down(index)
+
     def _swap(self, i1, i2):
         """Swaps the order of self._queue[i1] and self._queue[i2]
 
@@ -141,21 +287,21 @@ class PriorityQueue(object):
         me = self._queue[index]
         left_child_index = index*2 + 1
         right_child_index = index*2 + 2
-        left_child = self._queue[left_child_index] if left_child_index < len(self._queue) else None
-        right_child = self._queue[right_child_index] if right_child_index < len(self._queue) else None
 
         # no children
-        if not left_child and not right_child:
+        if left_child_index >= len(self._queue):
             return
 
+        left_child = self._queue[left_child_index]
         # only left child exists
-        if not right_child:
+        if right_child_index >= len(self._queue):
             # child has priority over index -- swap them
             if self._comparator(me, left_child) == left_child:
                 self._swap(index, left_child_index)
                 self._float_down(left_child_index)
         # both children exist
         else:
+            right_child = self._queue[right_child_index]
             highest_priority = self._comparator(right_child, left_child)
             highest_index = right_child_index if highest_priority == right_child else left_child_index
             # index is above highest priority -- swap them
@@ -165,22 +311,51 @@ class PriorityQueue(object):
 
 
     def queue_sort(self):
-        """Sorts the elements in the queue using dequeue. This means highest priority element
-        will be at index 0, lowest priority element at index -1. This empties the queue.
+        """Sorts the elements in the queue. This means highest priority element will be at index 0, lowest
+        priority element at index -1. This empties the queue, use sorted_view to inspect the queue instead.
 
         Args:
 
         Returns:
             A list of elements sorted in order from highest priority to lowest
         """
-        to_return = list()
-        while len(self._queue) > 0:
-            to_return.append(self.dequeue())
+        to_return = list(self.sorted_view())
+        if self._key is not None:
+            del self._queue[:]
+        else:
+            self._queue.clear()
         return to_return
 
+    def sorted_view(self):
+        """Iterates over the elements from highest priority to lowest without modifying the queue. The heap is
+        copied up front, and each element is then popped off the copy as it is needed, so looking at the first k
+        elements costs O(n + k log n).
+
+        Args:
+
+        Returns:
+            An iterator of elements in priority order
+        """
+        if self._key is not None:
+            return self._pop_all(list(self._queue))
+        copy = PriorityQueue(self._comparator)
+        copy._queue = deque(self._queue)
+        return copy._dequeue_all()
+
+    @staticmethod
+    def _pop_all(heap):
+        while heap:
+            yield heapq.heappop(heap)[-1]
+
+    def _dequeue_all(self):
+        while len(self._queue) > 0:
+            yield self.dequeue()
+
     def set_max_size(self, new_size):
         """Sets a new max size for the PriorityQueue. See __init__ doc for implications. If
-        there are more elements in the queue than new_size, will purge elements based on queue sort
+        there are more elements in the queue than new_size, the lowest priority elements are purged.
+        Only the new_size elements that are kept are selected (O(n log new_size) for the key engine,
+        O(new_size log n) for the comparator engine), the queue is not drained and refilled.
 
         Args:
             new_size: int for max new size of the queue
@@ -189,7 +364,9 @@ class PriorityQueue(object):
         """
         self._max_size = new_size
         # have entries to purge
-        if new_size >= 0 and new_size > len(self._queue):
-            sorted_elements = self.queue_sort()
-            for element in sorted_elements[:new_size]:
-                self.enqueue(element)
+        if new_size > 0 and len(self._queue) > new_size:
+            if self._key is not None:
+                # a sorted list is a valid heap
+                self._queue[:] = heapq.nsmallest(new_size, self._queue)
+            else:
+                self._queue = deque(itertools.islice(self.sorted_view(), new_size))
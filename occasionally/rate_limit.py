@@ -0,0 +1,70 @@
+"""Rate limits on how often a Scheduler starts the runs of tasks that share a resource
+
+Tasks created together on the same schedule come due at the same moment, and hit whatever they talk to all at once.
+Give the tasks that use a resource the same tag, and the Scheduler a TokenBucket for that tag: a due task whose run
+would exceed the rate is pushed back to the time a token will be free for it, and is not held back again when it
+comes due then. Tokens are handed out in the order tasks come due, so a burst is spread out at the bucket's rate
+with every deferred task moved exactly once.
+
+    scheduler = Scheduler(rate_limits={"db": TokenBucket(rate=50, burst=10)})
+    scheduler.add_tasks(Task(clean_tenant, after_x_mintes(5), call_args=(t,), tag="db") for t in tenants)
+"""
+
+
+class TokenBucket(object):
+    """Allows rate runs per second on average, and bursts of up to burst runs at once
+
+    Attributes:
+        rate: float tokens added per second
+
+        burst: float most tokens the bucket holds
+
+        deferred: int number of runs pushed back to wait for a token
+    """
+
+    def __init__(self, rate, burst=1):
+        """Creates a new TokenBucket, full
+
+        Args:
+            rate: float runs per second, more than 0
+
+            burst: number of runs that can start at once after the bucket has filled up, at least 1
+
+        Raises:
+            ValueError if rate is not more than 0 or burst is less than 1
+
+        Returns:
+            A new TokenBucket
+        """
+        if rate <= 0:
+            raise ValueError("rate must be more than 0, got %r" % (rate,))
+        if burst < 1:
+            raise ValueError("burst must be at least 1, got %r" % (burst,))
+        self.rate = float(rate)
+        self.burst = burst
+        self.deferred = 0
+        self._tokens = float(burst)
+        # scheduler clock time self._tokens was worked out at, None until the first reservation
+        self._updated = None
+
+    def __repr__(self):
+        return "TokenBucket(rate=%r, burst=%r)" % (self.rate, self.burst)
+
+    def _reserve(self, now):
+        """Takes a token, going into debt if there is none, which the tokens added later pay off
+
+        Args:
+            now: float time on the scheduler's clock
+
+        Returns:
+            float seconds until the token taken is actually available, 0 if it is available now
+        """
+        if self._updated is not None and now > self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        if self._updated is None or now > self._updated:
+            self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        self.deferred += 1
+        return -self._tokens / self.rate
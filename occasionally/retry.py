@@ -0,0 +1,195 @@
+"""Retrying failed runs sooner than a task's frequency, and circuit breakers that stop running tasks whose dependency
+is failing
+
+A task created with a RetryPolicy goes back in the queue after a failed run with a short, exponentially growing
+delay instead of its frequency, up to max_attempts attempts in a row, after which it waits its frequency as usual
+(and the next failure starts a new round of attempts). Retries are ordinary runs: they don't block foreground, and
+count towards just_x_times.
+
+    Task(sync_accounts, after_x_hours(24), retry=RetryPolicy(max_attempts=5, base_delay=10))
+
+A CircuitBreaker is shared by every task with the same tag (see occasionally.task.Task tag), e.g. the tasks that use
+the same database. After failure_threshold failed runs in a row it opens, and the tasks that come due are held
+back instead of run. reset_timeout seconds later one of them is let through as a trial: if it succeeds the breaker
+closes and the held tasks run, if it fails the breaker opens again.
+
+    scheduler = Scheduler(circuit_breakers={"db": CircuitBreaker(failure_threshold=5, reset_timeout=60)})
+"""
+import random
+from .log import log
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class RetryPolicy(object):
+    """Exponential backoff with jitter: attempt n after a failure waits base_delay * multiplier ** (n - 1) seconds, at
+    most max_delay, minus up to jitter of that at random"""
+
+    def __init__(self, max_attempts=3, base_delay=1.0, multiplier=2.0, max_delay=300.0, jitter=0.5):
+        """Creates a new RetryPolicy
+
+        Args:
+            max_attempts: int number of attempts in a row, counting the run that failed first, at least 2
+
+            base_delay: float seconds to wait before the first retry
+
+            multiplier: float the delay is multiplied by after every retry
+
+            max_delay: float most seconds to wait before a retry
+
+            jitter: float between 0 and 1, the fraction of each delay taken off at random, so that tasks that failed
+            together don't retry together
+
+        Raises:
+            ValueError if max_attempts is less than 2 or jitter is not between 0 and 1
+
+        Returns:
+            A new RetryPolicy
+        """
+        if max_attempts < 2:
+            raise ValueError("max_attempts must be at least 2, got %r" % (max_attempts,))
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1, got %r" % (jitter,))
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def __repr__(self):
+        return "RetryPolicy(max_attempts=%r, base_delay=%r)" % (self.max_attempts, self.base_delay)
+
+    def delay(self, failures):
+        """Returns how long to wait before the next attempt
+
+        Args:
+            failures: int number of failed runs in a row, counted from the start of this round of attempts
+
+        Returns:
+            float seconds
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (failures - 1))
+        return delay - delay * self.jitter * random.random()
+
+
+class CircuitBreaker(object):
+    """Stops a Scheduler from running the tasks of a failing dependency, see the module docstring
+
+    Attributes:
+        state: CLOSED, OPEN or HALF_OPEN
+
+        failures: int number of failed runs in a row
+
+        trips: int number of times the breaker opened
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """Creates a new CircuitBreaker, closed
+
+        Args:
+            failure_threshold: int number of failed runs in a row that open the breaker
+
+            reset_timeout: float seconds the breaker stays open before letting a trial run through
+
+        Raises:
+            ValueError if failure_threshold is less than 1
+
+        Returns:
+            A new CircuitBreaker
+        """
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1, got %r" % (failure_threshold,))
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        # scheduler clock time the breaker last opened, or half opened
+        self._since = None
+        # the task queued to come due when the breaker half opens, to run the trial
+        self._probe = None
+        # the other tasks held back while the breaker is not closed
+        self._held = list()
+
+    def __repr__(self):
+        return "CircuitBreaker(failure_threshold=%r, reset_timeout=%r)" % (self.failure_threshold,
+                                                                           self.reset_timeout)
+
+    @property
+    def retry_at(self):
+        """Scheduler clock time the breaker lets the next trial through at, None if it is closed"""
+        if self.state == CLOSED:
+            return None
+        return self._since + self.reset_timeout
+
+    def _allow(self, now):
+        """Whether a due task may run now. Half opens the breaker, letting the caller run the trial, once it has
+        been open for reset_timeout seconds. A trial that has not finished reset_timeout seconds later (e.g. it was
+        skipped) is given up on, and another one is let through
+
+        Args:
+            now: float time on the scheduler's clock
+
+        Returns:
+            bool
+        """
+        if self.state == CLOSED:
+            return True
+        if now < self._since + self.reset_timeout:
+            return False
+        log.info("%s is half open, letting a trial run through", self)
+        self.state = HALF_OPEN
+        self._since = now
+        return True
+
+    def _hold(self, task):
+        """Holds back a due task that may not run. One task is queued again for when the breaker lets the next
+        trial through, the others are held until the breaker closes
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+            The task if it should be queued again, with its next invoke moved to retry_at. None if it is held
+        """
+        if self._probe is None or self._probe is task or self._probe.cancelled:
+            self._probe = task
+            task._next_invoke = self._since + self.reset_timeout
+            return task
+        self._held.append(task)
+        return None
+
+    def _record(self, failed, now):
+        """Records the outcome of a run of one of the tasks
+
+        Args:
+            failed: bool, whether the run failed
+
+            now: float time on the scheduler's clock
+
+        Returns:
+            list of the held tasks to queue again: all of them if the breaker closed, or one to run the next trial if
+            it opened
+        """
+        if not failed:
+            self.failures = 0
+            if self.state == CLOSED:
+                return ()
+            log.info("%s closed after a successful run, releasing %d tasks", self, len(self._held))
+            self.state = CLOSED
+            self._probe = None
+            held, self._held = self._held, list()
+            return held
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            log.warning("%s opened after %d failed runs in a row", self, self.failures)
+            self.state = OPEN
+            self._since = now
+            self.trips += 1
+            # the task queued for the last trial may have run it, or be gone, so a held one is queued for the next
+            self._probe = None
+            if self._held:
+                return [self._hold(self._held.pop())]
+        return ()
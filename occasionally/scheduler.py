@@ -1,63 +1,1448 @@
+import functools
+import heapq
+import itertools
+import threading
 import time
-from priority_queue import PriorityQueue
-from task import Task, MaxCallException, soonest_task_comparator
-from log import log
+from collections import deque
+from .priority_queue import PriorityQueue, QueueFullException
+from .task import Task, MaxCallException, soonest_task_key, _phase_fraction
+from .timing_wheel import TimingWheel
+from .indexed_queue import IndexedPriorityQueue
+from .clock import SystemClock
+from .log import log
+
+HEAP_BACKEND = "heap"
+WHEEL_BACKEND = "wheel"
+INDEXED_BACKEND = "indexed"
+
+INLINE_EXECUTION = "inline"
+THREAD_EXECUTION = "thread"
+PROCESS_EXECUTION = "process"
+
+LOCKED_PRODUCERS = "lock"
+INBOX_PRODUCERS = "inbox"
+
+RESCHEDULE_ON_DISPATCH = "dispatch"
+RESCHEDULE_ON_COMPLETE = "complete"
+
+# for measuring durations, falls back to time.time on python 2.7
+_perf_counter = getattr(time, "perf_counter", time.time)
+
+
+def _call_timed(call_function, call_args, call_kwargs):
+    """Runs call_function in a pool worker, returning how many seconds it took, for overload policies and fair
+    scheduling"""
+    started = _perf_counter()
+    call_function(*call_args, **call_kwargs)
+    return _perf_counter() - started
 
 
 class Scheduler(PriorityQueue):
 
-    def __init__(self, max_size=0, sleep_interval=0.5):
+    def __init__(self, max_size=0, sleep_interval=None, backend=HEAP_BACKEND, tick=1.0, execution=INLINE_EXECUTION,
+                 workers=None, reschedule_on=RESCHEDULE_ON_COMPLETE, state_store=None,
+                 metrics=None, coalesce=False, cluster=None, producers=LOCKED_PRODUCERS, overload=None,
+                 fair=False, clock=None, isolation=None, spread=None, jitter=None, rate_limits=None,
+                 circuit_breakers=None):
         """Initializes the Scheduler
 
         Args:
             max_size: int ax size for ocassionally.priority_queue.PriorityQueue
 
-            sleep_interval: number for how long to sleep if the next task is not ready yet
+            sleep_interval: the longest number of seconds to wait before checking the queue again. None (the default)
+            waits until the next task is due, or until add_task or stop wakes the scheduler up
+
+            backend: HEAP_BACKEND to keep tasks in the inherited binary heap, WHEEL_BACKEND to keep them in an
+            occasionally.timing_wheel.TimingWheel, which reschedules in O(1) and suits very large numbers of
+            short interval tasks, or INDEXED_BACKEND to keep them in an
+            occasionally.indexed_queue.IndexedPriorityQueue, which makes reschedule, run_now, pause, remove and
+            update_frequency O(log n) instead of O(n), at the cost of slower enqueues and dequeues
+
+            tick: number of seconds per slot of the finest timing wheel. Only used by WHEEL_BACKEND
+
+            execution: INLINE_EXECUTION to invoke tasks in the foreground loop, or THREAD_EXECUTION / PROCESS_EXECUTION
+            to hand them to a concurrent.futures thread or process pool so slow tasks don't delay other tasks.
+            With PROCESS_EXECUTION, call_function and its args and kwargs must be picklable
+
+            workers: int max number of workers in the pool. None uses the concurrent.futures default
+
+            reschedule_on: RESCHEDULE_ON_COMPLETE to compute a pooled task's next invoke once it finishes, or
+            RESCHEDULE_ON_DISPATCH to compute it as soon as it is handed to the pool, which lets runs overlap up to
+            the task's max_concurrency. Inline tasks are always rescheduled when they complete
+
+            state_store: occasionally.state_store.StateStore. If given, tasks with a task_id that are added pick up
+            the next invoke time and call counts saved by a previous process instead of starting over, and their
+            state is saved after every run
+
+            metrics: occasionally.metrics.Metrics to record invoke latency, call duration, outcomes, queue depth and
+            time spent in the queue versus in call_functions to
+
+            coalesce: bool. If True, every task due when foreground wakes up is dequeued in one pass, tasks with the
+            same call_function are run together (in one call if it is decorated with
+            occasionally.task.batch_capable, with INLINE_EXECUTION), and they are all rescheduled from one clock read
+            and re-enqueued in one bulk operation. This suits many tasks sharing a schedule. With metrics, a batch's
+            duration is split evenly between its tasks
+
+            cluster: occasionally.cluster.Cluster. If given, every node adds the same tasks but this scheduler only
+            runs the ones in the shards this node holds, and keeps the others aside until the cluster hands their
+            shard to this node. Tasks need a task_id. foreground keeps running while other nodes hold tasks, until
+            stop is called
+
+            producers: how add_task and add_tasks hand tasks to a running foreground. LOCKED_PRODUCERS enqueues
+            them under the scheduler's lock, which is held only for the queue operation itself. INBOX_PRODUCERS
+            appends them to an inbox without taking the lock (unless foreground has to be woken up sooner), and
+            foreground moves the inbox into the queue in batches, which suits many threads adding tasks at once.
+            Tasks in the inbox are not counted by len or seen by sorted_view until foreground drains them
+
+            overload: occasionally.overload.OverloadPolicy deciding what happens to tasks that come due while the
+            scheduler is behind, e.g. SkipMissedRuns or StretchFrequencies. Whatever the policy, tasks that no longer
+            fit within max_size when foreground puts them back in the queue are dropped with a warning (the lowest
+            priority ones with ShedLowestPriority) instead of QueueFullException stopping foreground
+
+            fair: bool. If True, tasks that are due are run by priority (see occasionally.task.Task priority) rather
+            than strictly in the order they came due, and due tasks of the same priority share the scheduler's time
+            in proportion to their weights (start-time fair queueing), ties going to the task that was due first.
+            Due tasks move from the time ordered queue to a second heap keyed on (-priority, virtual start time,
+            next invoke), so a burst of cheap tasks can't hold up more important ones. Can't be combined with
+            coalesce
+
+            clock: occasionally.clock.Clock to read the time from and wait on. None uses a SystemClock, which is
+            monotonic, so changes to the system time don't affect when interval tasks run. A VirtualClock simulates
+            time instead, for running days of schedules in seconds
+
+            isolation: occasionally.worker_pool.IsolatedPool to run the tasks created with isolated=True in,
+            whatever the execution. foreground starts the pool (unless it has been started already) and shuts it
+            down when it returns
+
+            spread: number of seconds to spread the runs of tasks created without a spread over, see
+            occasionally.task.Task spread. Spreads out tasks that would otherwise all run at the same moment, e.g.
+            schedule_immediately tasks when foreground starts
+
+            jitter: number of seconds of random delay to add to every run of tasks created without a jitter, see
+            occasionally.task.Task jitter
+
+            rate_limits: dict of task tag -> occasionally.rate_limit.TokenBucket. Due tasks with a tag whose bucket
+            has no token left are pushed back to when one will be free
+
+            circuit_breakers: dict of task tag -> occasionally.retry.CircuitBreaker, which records the outcome of
+            every run of the tasks with that tag. While a breaker is open, its tasks that come due are held back
+            instead of run, until a trial run succeeds. With coalesce, the breakers are checked as the due tasks are
+            taken off the queue, so tasks that came due together all run even if the first ones fail
+
+        Raises:
+            ValueError if backend, execution, reschedule_on or producers is not one of the constants above, or both
+            coalesce and fair are set
 
         Returns:
             Scheduler object
         """
-        super(Scheduler, self).__init__(soonest_task_comparator, max_size=max_size)
+        super(Scheduler, self).__init__(key=soonest_task_key, max_size=max_size)
         self._sleep_interval = sleep_interval
+        self._clock = clock if clock is not None else SystemClock()
+        # guards the queue, and is notified when a task is added at the head or the scheduler is stopped
+        self._condition = threading.Condition()
+        self._stopped = False
+        # the queue tasks are kept in, None for the inherited binary heap
+        if backend == WHEEL_BACKEND:
+            self._backend = TimingWheel(soonest_task_key, tick=tick, max_size=max_size)
+        elif backend == INDEXED_BACKEND:
+            self._backend = IndexedPriorityQueue(soonest_task_key, max_size=max_size)
+        elif backend == HEAP_BACKEND:
+            self._backend = None
+        else:
+            raise ValueError("Unknown Scheduler backend %r" % backend)
+        if execution not in (INLINE_EXECUTION, THREAD_EXECUTION, PROCESS_EXECUTION):
+            raise ValueError("Unknown Scheduler execution %r" % execution)
+        if reschedule_on not in (RESCHEDULE_ON_DISPATCH, RESCHEDULE_ON_COMPLETE):
+            raise ValueError("Unknown Scheduler reschedule_on %r" % reschedule_on)
+        if producers not in (LOCKED_PRODUCERS, INBOX_PRODUCERS):
+            raise ValueError("Unknown Scheduler producers %r" % producers)
+        if coalesce and fair:
+            raise ValueError("A Scheduler can't both coalesce and be fair")
+        # tasks added by producers that foreground has not moved into the queue yet. deque append and popleft are
+        # thread safe, so producers never wait for each other or for foreground
+        self._inbox = deque() if producers == INBOX_PRODUCERS else None
+        # clock time foreground is waiting until, 0 while it is not waiting. Producers only wake it up for tasks
+        # due before then
+        self._wake_at = 0
+        self._execution = execution
+        self._workers = workers
+        self._reschedule_on = reschedule_on
+        self._executor = None
+        # number of calls handed to the pool that have not completed yet
+        self._in_flight = 0
+        # number of cancelled tasks waiting to be dropped from the queue. Approximate, a task cancelled while it
+        # is running is counted but never queued again
+        self._cancelled_in_queue = 0
+        self._state_store = state_store
+        self._metrics = metrics
+        self._coalesce = coalesce
+        self._cluster = cluster
+        # shard -> tasks in shards this node does not hold, only used with a cluster
+        self._parked = dict()
+        if metrics is not None:
+            metrics._attach(self)
+        # _perf_counter() at the end of the last measured run, see _invoke_measured
+        self._last_returned = None
+        # inline runs left until the next one metrics time, out of the sample_every counted down from at the last
+        # timed run, so the runs in between that were not timed are _sample_period - _sample_countdown
+        self._sample_countdown = self._sample_period = 1
+        self._unsampled_failures = 0
+        self._overload = overload
+        # moving average of how long pooled runs take, only measured with an overload policy
+        self._run_time = 0.0
+        self._fair = fair
+        # with fair, heap of (-priority, virtual start time, next invoke, sequence number, task) of the due tasks
+        # waiting for their turn
+        self._ready = list()
+        self._ready_counter = itertools.count()
+        # with fair, priority -> virtual start time of the last task of that priority to run
+        self._virtual_times = dict()
+        self._isolation = isolation
+        # the isolation pool while foreground is running, None otherwise
+        self._isolation_executor = None
+        self._spread = spread
+        self._jitter = jitter
+        self._rate_limits = rate_limits
+        self._breakers = circuit_breakers
+        self._indexed = backend == INDEXED_BACKEND
+        # task_id -> task, for the tasks with a task_id that have been added and not dropped. Changed under
+        # _registry_lock (inside self._condition if both are held), so producers can register tasks without taking
+        # the scheduler's lock. Reads need neither
+        self._registry = dict()
+        self._registry_lock = threading.Lock()
+        # task_id -> paused task, or None if it is not set aside yet because it was running
+        self._paused = dict()
+
+    @property
+    def clock(self):
+        """The occasionally.clock.Clock next invoke times are kept on. Its time() is not time.time(): the default
+        SystemClock is monotonic, so it drifts from time.time() whenever the system time is changed"""
+        return self._clock
+
+    def __len__(self):
+        if self._backend is not None:
+            return len(self._backend)
+        return super(Scheduler, self).__len__()
+
+    def peek(self):
+        if self._backend is not None:
+            return self._backend.peek()
+        return super(Scheduler, self).peek()
+
+    def enqueue(self, item):
+        if self._backend is not None:
+            return self._backend.enqueue(item)
+        return super(Scheduler, self).enqueue(item)
+
+    def dequeue(self):
+        if self._backend is not None:
+            return self._backend.dequeue()
+        return super(Scheduler, self).dequeue()
+
+    def dequeue_up_to(self, key):
+        if self._backend is not None:
+            return self._backend.dequeue_up_to(key)
+        return super(Scheduler, self).dequeue_up_to(key)
+
+    def enqueue_many(self, items):
+        if self._backend is not None:
+            return self._backend.enqueue_many(items)
+        return super(Scheduler, self).enqueue_many(items)
+
+    def remove_where(self, predicate):
+        if self._backend is not None:
+            return self._backend.remove_where(predicate)
+        return super(Scheduler, self).remove_where(predicate)
+
+    def sorted_view(self):
+        """Iterates over the queued tasks from soonest to latest without modifying the queue. Safe to call while
+        foreground is running, the queue is copied under the scheduler's lock.
+
+        Args:
+
+        Returns:
+            An iterator of ocassionally.task.Task
+        """
+        with self._condition:
+            if self._ready:
+                # due tasks waiting for their turn in fair mode are listed too, by next invoke like the others
+                return iter(sorted(itertools.chain(self._elements(), (entry[-1] for entry in self._ready)),
+                                   key=soonest_task_key))
+            if self._backend is not None:
+                return iter(list(self._backend.sorted_view()))
+            return super(Scheduler, self).sorted_view()
+
+    def set_max_size(self, new_size):
+        with self._condition:
+            # trimmed tasks are no longer scheduled, so their task_ids are forgotten and can be added again
+            queued = list(self._elements()) if 0 < new_size < len(self) else None
+            if self._backend is not None:
+                self._max_size = new_size
+                self._backend.set_max_size(new_size)
+            else:
+                super(Scheduler, self).set_max_size(new_size)
+            if queued is not None:
+                kept = set(id(task) for task in self._elements())
+                for task in queued:
+                    if id(task) not in kept:
+                        self._forget(task)
+
+    def _elements(self):
+        if self._backend is not None:
+            return self._backend._elements()
+        return super(Scheduler, self)._elements()
 
     def add_task(self, task):
         # type: (Task) -> None
         """Takes in occasionally.task.Task, computes its next invoke time, then enqueues it into its
-        priority queue.
+        priority queue. Safe to call from other threads while foreground is running; if the task is
+        now the soonest one, foreground wakes up to wait for it instead.
 
         Args:
             task: ocassionally.task.Task to be enqueued
 
+        Raises:
+            ValueError if the task has been cancelled
+
         Returns:
         """
+        if self._inbox is not None:
+            self._post([task])
+            return
+        if not self._prepare_batch([task]):
+            return
+        with self._condition:
+            if self._park(task):
+                return
+            try:
+                self.enqueue(task)
+            except QueueFullException:
+                self._forget(task)
+                raise
+            if self.peek() is task:
+                self._condition.notify()
 
-        task.set_next_invoke()
-        self.enqueue(task)
+    def add_tasks(self, tasks):
+        """Like add_task for many tasks at once. The heap is built in O(n) rather than floating each task up,
+        which makes loading a large catalog of tasks at startup much faster.
+
+        Args:
+            tasks: iterable of ocassionally.task.Task to be enqueued
+
+        Raises:
+            ValueError if any of the tasks has been cancelled
+
+        Returns:
+        """
+        tasks = list(tasks)
+        if self._inbox is not None:
+            self._post(tasks)
+            return
+        tasks = self._prepare_batch(tasks)
+        with self._condition:
+            queued = [task for task in tasks if not self._park(task)]
+            try:
+                self.enqueue_many(queued)
+            except QueueFullException:
+                for task in queued:
+                    self._forget(task)
+                raise
+            self._condition.notify()
+
+    def _post(self, tasks):
+        """Appends tasks to the inbox, and wakes foreground up if one of them is due before it would wake up
+
+        Args:
+            tasks: list of ocassionally.task.Task
+
+        Raises:
+            ValueError if any of the tasks has been cancelled
+
+        Returns:
+        """
+        tasks = self._prepare_batch(tasks)
+        self._inbox.extend(tasks)
+        # foreground sets _wake_at before it checks the inbox for the last time, so either it sees these tasks
+        # or we see when it is waiting until
+        if tasks and min(task._next_invoke for task in tasks) < self._wake_at:
+            with self._condition:
+                self._condition.notify()
 
-    def foreground(self):
+    def _drain_inbox(self):
+        """Moves every task in the inbox into the queue. Must be called with self._condition held
+
+        Args:
+
+        Returns:
+        """
+        inbox = self._inbox
+        tasks = list()
+        for _ in range(len(inbox)):
+            task = inbox.popleft()
+            # cancelled while it was in the inbox
+            if not task.cancelled and not self._park(task):
+                tasks.append(task)
+        self._requeue(tasks)
+
+    def _prepare_batch(self, tasks):
+        """Prepares tasks that are being added (see _prepare) from one clock read, then registers their task_ids.
+        Nothing is registered unless every task could be prepared, so a batch that raises can be fixed and added
+        again
+
+        Args:
+            tasks: list of ocassionally.task.Task being added
+
+        Raises:
+            ValueError, see _prepare, or if two of the tasks have the same task_id
+
+        Returns:
+            list of the tasks to add, without the ones that have already hit their call limit
+        """
+        now, wall = self._clock.time(), self._clock.wall()
+        prepared = [task for task in tasks if self._prepare(task, now, wall)]
+        identified = [task for task in prepared if task._task_id is not None]
+        if not identified:
+            return prepared
+        with self._registry_lock:
+            batch = dict()
+            for task in identified:
+                registered = batch.setdefault(task._task_id, self._registry.get(task._task_id, task))
+                if registered is not task:
+                    raise ValueError("A task with task_id %r has already been added" % (task._task_id,))
+            self._registry.update(batch)
+        return prepared
+
+    def _prepare(self, task, now=None, wall=None):
+        """Sets the next invoke of a task that is being added, restoring its saved state if there is any
+
+        Args:
+            task: ocassionally.task.Task being added
+
+            now, wall: float clock time and wall clock time to schedule the task from, None reads the clock
+
+        Raises:
+            ValueError if the task has been cancelled, has no task_id and the scheduler has a cluster, is
+            isolated and the scheduler has no isolation pool, or another task with its task_id has been added
+
+        Returns:
+            bool, False if the task has already hit its call limit and should not be added
+        """
+        if task.cancelled:
+            raise ValueError("Task %s has been cancelled and cannot be added again" % task)
+        if self._cluster is not None and task.task_id is None:
+            raise ValueError("Task %s needs a task_id to be sharded across a cluster" % task)
+        if task._isolated and self._isolation is None:
+            raise ValueError("Task %s is isolated but the scheduler has no isolation pool" % task)
+        if task._task_id is not None and self._registry.get(task._task_id, task) is not task:
+            # checked again when the batch is registered, this saves preparing the rest of the batch
+            raise ValueError("A task with task_id %r has already been added" % (task._task_id,))
+        if task._phase is None and self._spread:
+            task._phase = self._spread * _phase_fraction(task)
+        if task._jitter is None and self._jitter:
+            task._jitter = self._jitter
+        if now is None:
+            now, wall = self._clock.time(), self._clock.wall()
+        state = None
+        if self._state_store is not None and task.task_id is not None:
+            state = self._state_store.get(task.task_id)
+        if state is None:
+            task.set_next_invoke(now, wall)
+            return True
+        task._restore_state(state)
+        if task._max_calls_hit():
+            log.info("Not adding task %s, it already hit its max invokes of %d before restarting", task,
+                     task._max_calls)
+            return False
+        if task._next_invoke is None:
+            task.set_next_invoke(now, wall)
+        return True
+
+    def cancel(self, task):
+        """Cancels task so it is never invoked again. The task is only marked as cancelled, and is dropped when it
+        reaches the head of the queue (or the queue is compacted), so cancelling does not scan the queue.
+        Cancelled tasks still count towards len until they are dropped. A run in progress is not interrupted.
+
+        Args:
+            task: ocassionally.task.Task to cancel
+
+        Returns:
+            bool, False if the task was already cancelled
+        """
+        with self._condition:
+            if task.cancelled:
+                return False
+            task._cancelled = True
+            self._forget(task)
+            self._cancelled_in_queue += 1
+            # dropping cancelled tasks one by one at the head is cheapest, until they make up most of the queue
+            if self._cancelled_in_queue > len(self) // 2:
+                self.remove_where(lambda queued: queued.cancelled)
+                self._cancelled_in_queue = 0
+            self._condition.notify()
+            return True
+
+    def cancel_where(self, predicate):
+        """Cancels and removes every queued task for which predicate returns True, in one O(n) pass
+
+        Args:
+            predicate: a function that takes an ocassionally.task.Task and returns a bool
+
+        Returns:
+            A list of the cancelled tasks
+        """
+        with self._condition:
+            cancelled = self.remove_where(lambda task: not task.cancelled and predicate(task))
+            cancelled.extend(self._remove_ready(lambda task: not task.cancelled and predicate(task)))
+            for shard, parked in list(self._parked.items()):
+                kept = [task for task in parked if task.cancelled or not predicate(task)]
+                cancelled.extend(task for task in parked if not task.cancelled and predicate(task))
+                self._parked[shard] = kept
+            for task in cancelled:
+                task._cancelled = True
+                self._forget(task)
+            self._condition.notify()
+            return cancelled
+
+    def get_task(self, task_id):
+        """Looks up an added task by its task_id in O(1)
+
+        Args:
+            task_id: the task's task_id
+
+        Returns:
+            occasionally.task.Task, or None if no task with task_id has been added, or it has been cancelled,
+            removed or has hit its call limit
+        """
+        return self._registry.get(task_id)
+
+    def reschedule(self, task_id, when):
+        """Moves the next run of a queued task. O(log n) with INDEXED_BACKEND, O(n) with the other backends. The
+        runs after it are scheduled from when it ran, as usual
+
+        Args:
+            task_id: the task's task_id
+
+            when: float time on the scheduler's clock to run it at, e.g. scheduler.clock.time() + 60 for a minute
+            from now. Not time.time(), see clock
+
+        Returns:
+            bool, False if there is no such task, or it is not waiting in the queue: it is running, paused, or
+            held by another node of the cluster
+        """
+        with self._condition:
+            task = self._registry.get(task_id)
+            if task is None or not self._move(task, lambda: setattr(task, "_next_invoke", when)):
+                return False
+            self._condition.notify()
+            return True
+
+    def run_now(self, task_id):
+        """Moves the next run of a queued task to now, see reschedule
+
+        Args:
+            task_id: the task's task_id
+
+        Returns:
+            bool, False if there is no such task or it is not waiting in the queue
+        """
+        return self.reschedule(task_id, self._clock.time())
+
+    def update_frequency(self, task_id, frequency_function):
+        """Changes the frequency_function of a task (see occasionally.task.Task). If the task is waiting in the
+        queue, its next run is worked out again from now with the new frequency_function, otherwise the new one
+        takes effect once its current run finishes. O(log n) with INDEXED_BACKEND, O(n) with the other backends
+
+        Args:
+            task_id: the task's task_id
+
+            frequency_function: the new frequency_function
+
+        Returns:
+            bool, False if there is no such task
+        """
+        with self._condition:
+            task = self._registry.get(task_id)
+            if task is None:
+                return False
+            task._frequency_function = frequency_function
+            task._next_fire = getattr(frequency_function, "next_fire", None)
+            now, wall = self._clock.time(), self._clock.wall()
+            if self._move(task, lambda: task.set_next_invoke(now, wall)):
+                self._condition.notify()
+            return True
+
+    def pause(self, task_id):
+        """Stops running a task until resume is called. A queued task is taken out of the queue, in O(log n) with
+        INDEXED_BACKEND and O(n) with the other backends. A running task is set aside once it finishes
+
+        Args:
+            task_id: the task's task_id
+
+        Returns:
+            bool, False if there is no such task or it is already paused
+        """
+        with self._condition:
+            task = self._registry.get(task_id)
+            if task is None or task_id in self._paused:
+                return False
+            held = self._unqueue(task)
+            if not held and self._cluster is not None:
+                # held by another node
+                parked = self._parked.get(self._cluster.shard_of(task_id), list())
+                held = any(parked_task is task for parked_task in parked)
+                if held:
+                    parked.remove(task)
+            self._paused[task_id] = task if held else None
+            return True
+
+    def resume(self, task_id):
+        """Puts a paused task back in the queue. Its next run is still the one it had when it was paused, so a task
+        paused past its next run time runs straight away
+
+        Args:
+            task_id: the task's task_id
+
+        Returns:
+            bool, False if the task is not paused
+        """
+        with self._condition:
+            if task_id not in self._paused:
+                return False
+            task = self._paused.pop(task_id)
+            if task is not None and not task.cancelled and not self._park(task):
+                self._requeue([task])
+                self._condition.notify()
+            return True
+
+    def remove(self, task_id):
+        """Removes a task from the scheduler for good. O(log n) with INDEXED_BACKEND, otherwise the task is
+        cancelled and dropped when it reaches the head of the queue, see cancel
+
+        Args:
+            task_id: the task's task_id
+
+        Returns:
+            bool, False if there is no such task
+        """
+        with self._condition:
+            task = self._registry.get(task_id)
+            if task is None:
+                return False
+            self._paused.pop(task_id, None)
+            if self._indexed and self._backend.remove(task):
+                task._cancelled = True
+                self._forget(task)
+                return True
+            return self.cancel(task)
+
+    def stop(self):
+        """Makes a running foreground call return as soon as the task it is currently invoking (if any) finishes.
+        If foreground is not running, the next call to foreground returns immediately. Safe to call from
+        other threads and from within tasks.
+
+        Args:
+
+        Returns:
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def foreground(self, run_forever=False):
         """The meat and potatoes. This takes all of the tasks in the queue, executes them, then re-enqueues them
-        for their next execution. This is a blocking method call
+        for their next execution. This is a blocking method call. Between tasks it waits until the soonest task
+        is due, rather than polling.
 
         Args:
+            run_forever: bool, if True keep waiting for new tasks when the queue is empty instead of returning.
+            Use stop to return
 
         Returns:
         """
-        while len(self._queue) > 0:
-            now = time.time()
+        if self._execution != INLINE_EXECUTION:
+            self._executor = self._make_executor()
+        if self._isolation is not None:
+            self._isolation.start()
+            self._isolation_executor = self._isolation
+        try:
+            if self._cluster is not None:
+                self._cluster.start(self._on_shards_changed)
+            with self._condition:
+                self._run(run_forever)
+        finally:
+            if self._cluster is not None:
+                self._cluster.stop()
+            with self._condition:
+                # from here on, completion callbacks run chained tasks inline
+                executor, self._executor = self._executor, None
+                isolation, self._isolation_executor = self._isolation_executor, None
+                unsampled = self._sample_period - self._sample_countdown
+                if unsampled:
+                    # runs not timed since the last one that was
+                    self._metrics.count_unsampled(unsampled, self._unsampled_failures)
+                    self._sample_countdown = self._sample_period = 1
+                    self._unsampled_failures = 0
+            # outside of the lock, completion callbacks need it to finish
+            if executor is not None:
+                executor.shutdown(wait=True)
+            if isolation is not None:
+                isolation.shutdown(wait=True)
+            if self._state_store is not None:
+                self._state_store.flush()
+
+    def _run(self, run_forever):
+        """The foreground loop. Must be called with self._condition held
+
+        Args:
+            run_forever: see foreground
+
+        Returns:
+        """
+        inbox = self._inbox
+        while not self._stopped:
+            if inbox:
+                self._drain_inbox()
+            if self._ready:
+                self._run_ready()
+                continue
+            if len(self) == 0:
+                if not run_forever and self._in_flight == 0 and not any(self._parked.values()) and not inbox:
+                    log.info("The scheduler ran out of tasks and is returning from foreground")
+                    break
+                # pooled tasks that complete get re-enqueued and notify
+                self._wait(self._sleep_interval, float("inf"))
+                continue
             task = self.peek()  # type: Task
+            if task.cancelled:
+                self.dequeue()
+                self._cancelled_in_queue = max(0, self._cancelled_in_queue - 1)
+                continue
+            now = self._clock.time()
+            wait = task._next_invoke - now
+            # it is not time to call the task yet
+            if wait > 0:
+                # waiting is not time spent in the queue
+                self._last_returned = None
+                if self._sleep_interval is not None:
+                    wait = min(wait, self._sleep_interval)
+                self._wait(wait, now + wait)
+                continue
             # it is time to execute the task
-            if task._next_invoke <= now:
-                task = self.dequeue()
+            if self._fair:
+                self._make_ready(now)
+                continue
+            if self._rate_limits is not None and task._tag is not None and not self._coalesce:
+                deferred_until = self._throttle(task, now)
+                if deferred_until is not None:
+                    self.dequeue()
+                    task._next_invoke = deferred_until
+                    self.enqueue(task)
+                    continue
+            if self._overload is not None and not self._admit(task, -wait):
+                self.dequeue()
+                self._reschedule(task)
+                continue
+            if self._breakers is not None and task._tag is not None and not self._coalesce:
+                breaker = self._open_breaker(task, now)
+                if breaker is not None:
+                    self.dequeue()
+                    if breaker._hold(task) is not None:
+                        self.enqueue(task)
+                    continue
+            if self._coalesce:
+                self._run_due(now)
+                continue
+            task = self.dequeue()
+            metrics = self._metrics
+            if self._executor_for(task) is not None:
+                if metrics is None:
+                    self._dispatch(task)
+                    continue
+                start = _perf_counter()
+                self._dispatch(task, latency=-wait)
+                metrics.heap_time += _perf_counter() - start
+                continue
+            if metrics is not None:
+                countdown = self._sample_countdown - 1
+                if countdown <= 0:
+                    self._invoke_measured(task, -wait)
+                    continue
+                # not sampled, only the outcome is counted
+                self._sample_countdown = countdown
+            self._condition.release()
+            try:
                 task.invoke()
+            finally:
+                self._condition.acquire()
+            if metrics is not None:
+                if task._failures:
+                    # only reset by a successful call
+                    self._unsampled_failures += 1
+                if countdown == 1:
+                    # the next run is sampled, its time in the queue is measured from here
+                    self._last_returned = _perf_counter()
+            if self._breakers is not None and task._tag is not None:
+                self._settle(task)
+            self._reschedule(task)
+        self._stopped = False
+
+    def _wait(self, timeout, wake_at):
+        """Waits on self._condition for timeout seconds (None waits until notified), unless producers have put
+        tasks in the inbox since foreground last drained it. Must be called with self._condition held
+
+        Args:
+            timeout: float seconds or None
+
+            wake_at: float clock time foreground wakes up at by itself, inf if it does not
 
+        Returns:
+        """
+        if self._inbox is None:
+            self._clock.wait(self._condition, timeout)
+            return
+        self._wake_at = wake_at
+        try:
+            if not self._inbox:
+                self._clock.wait(self._condition, timeout)
+        finally:
+            self._wake_at = 0
+
+    def _invoke_measured(self, task, latency):
+        """Invokes and reschedules a dequeued task like foreground, for a run that metrics time. Must be called
+        with self._condition held
+
+        foreground only counts the outcome of the other inline runs, and reads the clock after the run before each
+        sampled one. Time in the queue is measured from the end of that run to the start of the sampled one, which
+        covers rescheduling the previous task and dequeuing this one, unless the scheduler waited in between. The
+        runs that were not sampled are handed to the metrics along with this one.
+
+        Args:
+            task: occasionally.task.Task, just dequeued
+
+            latency: float seconds between task's _next_invoke and now
+
+        Returns:
+        """
+        metrics = self._metrics
+        failures = task._unsuccessful_calls
+        unsampled = self._sample_period - self._sample_countdown
+        self._sample_countdown = self._sample_period = metrics.sample_every
+        self._condition.release()
+        called = _perf_counter()
+        try:
+            task.invoke()
+        finally:
+            returned = _perf_counter()
+            self._condition.acquire()
+        if self._last_returned is not None:
+            metrics.heap_time += called - self._last_returned
+        metrics.user_time += returned - called
+        metrics.record(task, latency, returned - called, task._unsuccessful_calls != failures,
+                       unsampled, self._unsampled_failures)
+        self._unsampled_failures = 0
+        if self._breakers is not None and task._tag is not None:
+            self._settle(task)
+        self._reschedule(task)
+        self._last_returned = returned
+
+    def _run_due(self, now):
+        """Dequeues every task due at now, runs them grouped by call_function, then reschedules them all at once.
+        Must be called with self._condition held
+
+        Args:
+            now: float clock time the tasks are due by
+
+        Returns:
+        """
+        metrics = self._metrics
+        groups = dict()
+        order = list()
+        deferred = list()
+        for task in self.dequeue_up_to(now):
+            if task.cancelled:
+                self._cancelled_in_queue = max(0, self._cancelled_in_queue - 1)
+                continue
+            if self._rate_limits is not None and task._tag is not None:
+                deferred_until = self._throttle(task, now)
+                if deferred_until is not None:
+                    task._next_invoke = deferred_until
+                    deferred.append(task)
+                    continue
+            if self._overload is not None and not self._admit(task, now - task._next_invoke):
+                self._reschedule(task)
+                continue
+            if self._breakers is not None and task._tag is not None:
+                breaker = self._open_breaker(task, now)
+                if breaker is not None:
+                    if breaker._hold(task) is not None:
+                        deferred.append(task)
+                    continue
+            if self._executor_for(task) is not None:
+                self._dispatch(task, latency=now - task._next_invoke if metrics is not None else None)
+                continue
+            group = groups.get(task._call_function)
+            if group is None:
+                group = groups[task._call_function] = list()
+                order.append(task._call_function)
+            group.append(task)
+        if deferred:
+            self._requeue(deferred)
+        if not order:
+            return
+        self._condition.release()
+        try:
+            for call_function in order:
+                tasks = groups[call_function]
+                if metrics is None:
+                    self._run_group(call_function, tasks)
+                    continue
+                failures = [task._unsuccessful_calls for task in tasks]
+                called = _perf_counter()
+                self._run_group(call_function, tasks)
+                duration = _perf_counter() - called
+                metrics.user_time += duration
+                duration /= len(tasks)
+                for task, before in zip(tasks, failures):
+                    failed = task._unsuccessful_calls != before
+                    metrics.record(task, now - task._next_invoke, duration, failed)
+        finally:
+            self._condition.acquire()
+        now = self._clock.time()
+        wall = self._clock.wall()
+        rescheduled = list()
+        for call_function in order:
+            for task in groups[call_function]:
+                if self._breakers is not None and task._tag is not None:
+                    self._settle(task)
+                if task.cancelled:
+                    log.info("Removing task %s because it was cancelled", task)
+                    continue
                 try:
-                    # task should be called again
-                    task.set_next_invoke()
-                    self.enqueue(task)
+                    task.set_next_invoke(now, wall)
+                    if self._overload is not None:
+                        self._stretch(task, now)
+                    if not self._park(task):
+                        rescheduled.append(task)
                 except MaxCallException:
-                    # task has hit its call limit and will not be invoked
                     log.info("Removing task %s due to max invokes of %d being reached", task, task._max_calls)
-            # it is not time to call the task yet
+                    self._forget(task)
+                if self._state_store is not None:
+                    self._state_store.record(task)
+        self._requeue(rescheduled)
+
+    def _make_ready(self, now):
+        """Moves every task due at now to the ready heap, tagged with its virtual start time: the virtual time of
+        its priority, or where its own last run finished if that is later. Must be called with self._condition held
+
+        Args:
+            now: float clock time the tasks are due by
+
+        Returns:
+        """
+        ready = self._ready
+        virtual_times = self._virtual_times
+        counter = self._ready_counter
+        entries = list()
+        deferred = list()
+        for task in self.dequeue_up_to(now):
+            if task.cancelled:
+                self._cancelled_in_queue = max(0, self._cancelled_in_queue - 1)
+                continue
+            if self._rate_limits is not None and task._tag is not None:
+                deferred_until = self._throttle(task, now)
+                if deferred_until is not None:
+                    task._next_invoke = deferred_until
+                    deferred.append(task)
+                    continue
+            start = max(virtual_times.get(task._priority, 0.0), task._virtual_time)
+            entries.append((-task._priority, start, task._next_invoke, next(counter), task))
+        if deferred:
+            self._requeue(deferred)
+        if len(entries) > len(ready):
+            ready.extend(entries)
+            heapq.heapify(ready)
+        else:
+            for entry in entries:
+                heapq.heappush(ready, entry)
+
+    def _run_ready(self):
+        """Runs (or dispatches) the ready task with the highest priority and the lowest virtual start time, after
+        moving the tasks that came due meanwhile into the ready heap, then reschedules it. Must be called with
+        self._condition held
+
+        Args:
+
+        Returns:
+        """
+        now = self._clock.time()
+        if len(self) > 0 and self.peek()._next_invoke <= now:
+            self._make_ready(now)
+        _, start, _, _, task = heapq.heappop(self._ready)
+        if task.cancelled:
+            self._cancelled_in_queue = max(0, self._cancelled_in_queue - 1)
+            return
+        latency = now - task._next_invoke
+        if self._overload is not None and not self._admit(task, latency):
+            self._reschedule(task)
+            return
+        if self._breakers is not None and task._tag is not None:
+            breaker = self._open_breaker(task, now)
+            if breaker is not None:
+                if breaker._hold(task) is not None:
+                    self._requeue([task])
+                return
+        self._virtual_times[task._priority] = start
+        task._virtual_time = start
+        metrics = self._metrics
+        if self._executor_for(task) is not None:
+            # charged for its run in _on_complete
+            self._dispatch(task, latency=latency if metrics is not None else None)
+            return
+        failures = task._unsuccessful_calls
+        self._condition.release()
+        called = _perf_counter()
+        try:
+            task.invoke()
+        finally:
+            duration = _perf_counter() - called
+            self._condition.acquire()
+        task._virtual_time = start + duration / task._weight
+        if metrics is not None:
+            metrics.user_time += duration
+            metrics.record(task, latency, duration, task._unsuccessful_calls != failures)
+        if self._breakers is not None and task._tag is not None:
+            self._settle(task)
+        self._reschedule(task)
+
+    def _remove_ready(self, predicate):
+        """Removes the tasks for which predicate returns True from the ready heap. Must be called with
+        self._condition held
+
+        Args:
+            predicate: a function that takes an ocassionally.task.Task and returns a bool
+
+        Returns:
+            list of the removed tasks
+        """
+        if not self._ready:
+            return list()
+        removed = [entry[-1] for entry in self._ready if predicate(entry[-1])]
+        if removed:
+            self._ready = [entry for entry in self._ready if not predicate(entry[-1])]
+            heapq.heapify(self._ready)
+        return removed
+
+    @staticmethod
+    def _run_group(call_function, tasks):
+        """Runs tasks that share call_function, in one call to its batch_function if it has one
+
+        Args:
+            call_function: the tasks' call_function
+
+            tasks: list of occasionally.task.Task
+
+        Returns:
+        """
+        batch_function = getattr(call_function, "batch_function", None)
+        if batch_function is None or len(tasks) == 1:
+            for task in tasks:
+                task.invoke()
+            return
+        batched = list()
+        for task in tasks:
+            # keyword arguments can't be passed in a batch
+            if task._call_kwargs:
+                task.invoke()
+            else:
+                batched.append(task)
+        hit_exception = False
+        try:
+            batch_function([task._call_args for task in batched])
+            log.debug("Successfully completed a batch of %d calls to %s", len(batched), call_function.__name__)
+        except Exception:
+            hit_exception = True
+            log.exception("Batch of %d calls to %s hit exception:", len(batched), call_function.__name__)
+        for task in batched:
+            for chained in task._complete_call(hit_exception):
+                chained.invoke()
+
+    def _reschedule(self, task):
+        """Computes the next invoke of task and enqueues it, unless it has hit its call limit. Must be called with
+        self._condition held
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+        """
+        if task.cancelled:
+            log.info("Removing task %s because it was cancelled", task)
+            return
+        try:
+            # task should be called again
+            now = self._clock.time()
+            task.set_next_invoke(now, self._clock.wall())
+            if self._overload is not None:
+                self._stretch(task, now)
+            if self._park(task):
+                return
+            if 0 < self._max_size <= len(self):
+                self._requeue([task])
+            else:
+                self.enqueue(task)
+        except MaxCallException:
+            # task has hit its call limit and will not be invoked
+            log.info("Removing task %s due to max invokes of %d being reached", task, task._max_calls)
+            self._forget(task)
+            return
+        finally:
+            if self._state_store is not None:
+                self._state_store.record(task)
+        if self.peek() is task:
+            self._condition.notify()
+
+    def _admit(self, task, lag):
+        """Asks the overload policy whether a due task runs, counting it as skipped if not. Must be called with
+        self._condition held
+
+        Args:
+            task: occasionally.task.Task that is due
+
+            lag: float seconds since task's _next_invoke
+
+        Returns:
+            bool, False if the caller should reschedule the task without running it
+        """
+        overload = self._overload
+        executor = self._executor_for(task)
+        if executor is not None:
+            # a run handed over now also waits behind the runs already in the pool's queue
+            workers = executor._max_workers
+            lag += max(0, self._in_flight - workers + 1) * self._run_time / workers
+        overload._observe(lag, self._clock.time())
+        if overload.admit(task, lag):
+            return True
+        overload.skipped += 1
+        task._skipped = True
+        log.debug("Skipping run of task %s, it is %.3fs late", task, lag)
+        return False
+
+    def _throttle(self, task, now):
+        """Takes a token for a due task from its tag's rate limit. Must be called with self._condition held
+
+        Args:
+            task: occasionally.task.Task that is due, with a tag
+
+            now: float clock time
+
+        Returns:
+            float clock time to push the task back to, when its token will be free. None if it can run now: there
+            is no rate limit for its tag, a token is free, or it was pushed back already and its token is free now
+        """
+        if task._deferred:
+            task._deferred = False
+            return None
+        bucket = self._rate_limits.get(task._tag)
+        if bucket is None:
+            return None
+        delay = bucket._reserve(now)
+        if delay <= 0:
+            return None
+        task._deferred = True
+        return now + delay
+
+    def _open_breaker(self, task, now):
+        """Checks the circuit breaker of a due task's tag. Must be called with self._condition held
+
+        Args:
+            task: occasionally.task.Task that is due, with a tag
+
+            now: float clock time
+
+        Returns:
+            occasionally.retry.CircuitBreaker that the caller should hold the task back with (see
+            CircuitBreaker._hold), None if the task can run: there is no breaker for its tag, it is closed, or it
+            lets this run through as a trial
+        """
+        breaker = self._breakers.get(task._tag)
+        if breaker is None or breaker._allow(now):
+            return None
+        log.debug("Holding back task %s, the circuit breaker for %r is %s", task, task._tag, breaker.state)
+        return breaker
+
+    def _settle(self, task):
+        """Records the outcome of a task's run on the circuit breaker of its tag, and queues the tasks it releases.
+        Must be called with self._condition held
+
+        Args:
+            task: occasionally.task.Task with a tag, that just ran
+
+        Returns:
+        """
+        breaker = self._breakers.get(task._tag)
+        if breaker is None:
+            return
+        released = breaker._record(task._failures > 0, self._clock.time())
+        if released:
+            self._requeue([held for held in released if not self._park(held)])
+
+    def _stretch(self, task, now):
+        """Lets the overload policy push back the next invoke of a task that was just rescheduled
+
+        Args:
+            task: occasionally.task.Task
+
+            now: float clock time the task was rescheduled from
+
+        Returns:
+        """
+        delay = task._next_invoke - now
+        if delay > 0:
+            task._next_invoke = now + self._overload.stretch(task, delay)
+
+    def _requeue(self, tasks):
+        """Puts tasks foreground took out of the queue (or the inbox) back in it. Tasks that don't fit within
+        max_size are dropped with a warning, the ones picked by the overload policy if there is one. Must be called
+        with self._condition held
+
+        Args:
+            tasks: list of occasionally.task.Task
+
+        Returns:
+        """
+        excess = len(tasks) - (self._max_size - len(self)) if self._max_size > 0 else 0
+        if excess > 0:
+            if self._overload is None:
+                dropped = tasks[-excess:]
+            else:
+                dropped = self._overload.evict(self._elements(), tasks, excess)
+                self._overload.shed += len(dropped)
+            dropped_ids = set(id(task) for task in dropped)
+            kept = [task for task in tasks if id(task) not in dropped_ids]
+            if len(tasks) - len(kept) < len(dropped):
+                # some of the tasks to drop are in the queue
+                self.remove_where(lambda task: id(task) in dropped_ids)
+            tasks = kept
+            for task in dropped:
+                log.warning("Dropping task %s, the queue is full at max_size %d", task, self._max_size)
+                self._forget(task)
+        try:
+            self.enqueue_many(tasks)
+        except QueueFullException:
+            # the policy picked fewer tasks than asked for
+            log.error("Dropping %d tasks, the queue is full at max_size %d", len(tasks), self._max_size)
+            for task in tasks:
+                self._forget(task)
+
+    def _forget(self, task):
+        """Drops task from the registry, once it has been cancelled or has hit its call limit
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+        """
+        if task._task_id is not None and self._registry.get(task._task_id) is task:
+            with self._registry_lock:
+                if self._registry.get(task._task_id) is task:
+                    del self._registry[task._task_id]
+            self._paused.pop(task._task_id, None)
+
+    def _unqueue(self, task):
+        """Takes task out of the queue, or out of the ready heap in fair mode. Must be called with
+        self._condition held
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+            bool, False if the task was not in either
+        """
+        if self._indexed:
+            if self._backend.remove(task):
+                return True
+        elif self.remove_where(lambda queued: queued is task):
+            return True
+        return bool(self._ready and self._remove_ready(lambda ready: ready is task))
+
+    def _move(self, task, set_next_invoke):
+        """Changes the next invoke of a queued task and moves it to its new place in the queue. Must be called
+        with self._condition held
+
+        Args:
+            task: occasionally.task.Task
+
+            set_next_invoke: function that sets task._next_invoke, only called if the task is queued
+
+        Returns:
+            bool, False if the task was not queued
+        """
+        if self._indexed and task in self._backend:
+            set_next_invoke()
+            task._deferred = False
+            self._backend.update(task)
+            return True
+        if not self._unqueue(task):
+            return False
+        set_next_invoke()
+        task._deferred = False
+        self.enqueue(task)
+        return True
+
+    def _park(self, task):
+        """Sets task aside if it has been paused, or belongs to a shard this node does not hold. Must be called
+        with self._condition held
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+            bool, whether the task was set aside
+        """
+        if self._paused and task._task_id in self._paused:
+            self._paused[task._task_id] = task
+            return True
+        if self._cluster is None:
+            return False
+        shard = self._cluster.shard_of(task.task_id)
+        if shard in self._cluster.owned:
+            return False
+        self._parked.setdefault(shard, list()).append(task)
+        return True
+
+    def _on_shards_changed(self, gained, lost):
+        """Called by the cluster when this node gains or loses shards. Moves the tasks of lost shards out of the
+        queue and the tasks of gained shards into it
+
+        Args:
+            gained: set of shards this node now holds
+
+            lost: set of shards this node no longer holds
+
+        Returns:
+        """
+        cluster = self._cluster
+        with self._condition:
+            if lost:
+                moved = self.remove_where(lambda task: cluster.shard_of(task.task_id) in lost)
+                moved.extend(self._remove_ready(lambda task: cluster.shard_of(task.task_id) in lost))
+                for task in moved:
+                    self._parked.setdefault(cluster.shard_of(task.task_id), list()).append(task)
+            if gained:
+                self._requeue([task for shard in gained for task in self._parked.pop(shard, ())])
+            self._condition.notify()
+
+    def _make_executor(self):
+        # imported here so INLINE_EXECUTION works without concurrent.futures (python 2.7)
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        if self._execution == PROCESS_EXECUTION:
+            return ProcessPoolExecutor(max_workers=self._workers)
+        return ThreadPoolExecutor(max_workers=self._workers)
+
+    def _executor_for(self, task):
+        """Returns the pool task runs in, the isolation pool for isolated tasks, None to run it inline
+
+        Args:
+            task: occasionally.task.Task
+
+        Returns:
+            concurrent.futures.Executor, occasionally.worker_pool.IsolatedPool or None
+        """
+        if task._isolated and self._isolation_executor is not None:
+            return self._isolation_executor
+        return self._executor
+
+    def _dispatch(self, task, reschedule=True, latency=None):
+        """Hands task's call_function to the pool. Must be called with self._condition held
+
+        Args:
+            task: occasionally.task.Task to run
+
+            reschedule: bool, False for next_task and exception_handler tasks, which only run when chained
+
+            latency: float seconds between task's _next_invoke and now, given to record the run in metrics
+
+        Returns:
+        """
+        if task._max_concurrency > 0 and task._running >= task._max_concurrency:
+            log.warning("Skipping run of task %s, %d runs are already in progress", task, task._running)
+            if reschedule:
+                self._reschedule(task)
+            return
+        task._running += 1
+        self._in_flight += 1
+        executor = self._executor_for(task)
+        timed = self._overload is not None or self._fair
+        if timed:
+            future = executor.submit(_call_timed, task._call_function, task._call_args, task._call_kwargs)
+        else:
+            future = executor.submit(task._call_function, *task._call_args, **task._call_kwargs)
+        if reschedule and self._reschedule_on == RESCHEDULE_ON_DISPATCH:
+            self._reschedule(task)
+            reschedule = False
+        future.add_done_callback(functools.partial(self._on_complete, task, reschedule, dispatched=_perf_counter(),
+                                                   latency=latency, timed=timed))
+
+    def _on_complete(self, task, reschedule, future, dispatched=None, latency=None, timed=False):
+        """Called by the pool when a dispatched call finishes. Records the outcome on task, dispatches
+        its exception_handler and next_task, and reschedules it if it was not rescheduled on dispatch
+
+        Args:
+            task: occasionally.task.Task that was dispatched
+
+            reschedule: bool, whether task should be rescheduled now
+
+            future: concurrent.futures.Future for the call
+
+            dispatched: float _perf_counter() at dispatch
+
+            latency: see _dispatch, metrics are only recorded if it is given
+
+            timed: bool, whether the call was wrapped in _call_timed, which returns its duration. Given with an
+            overload policy or fair
+
+        Returns:
+        """
+        with self._condition:
+            task._running -= 1
+            self._in_flight -= 1
+            exception = future.exception()
+            if timed and exception is None:
+                if self._overload is not None:
+                    self._run_time += self._overload._smoothing * (future.result() - self._run_time)
+                if self._fair:
+                    task._virtual_time += future.result() / task._weight
+            if exception is None:
+                log.debug("Successfully completed task %s", task)
             else:
-                time.sleep(self._sleep_interval)
-            log.info("The scheduler ran out of tasks and is returning from foreground")
+                log.error("Task %s hit exception:", task,
+                          exc_info=(type(exception), exception, getattr(exception, "__traceback__", None)))
+            if latency is not None and self._metrics is not None:
+                duration = _perf_counter() - dispatched
+                self._metrics.user_time += duration
+                self._metrics.record(task, latency, duration, exception is not None)
+            # chained tasks that can't be dispatched because the pool has been shut down, run once the lock is
+            # released so they don't hold up foreground and producers
+            inline = list()
+            try:
+                for chained in task._complete_call(exception is not None):
+                    if chained._max_calls_hit():
+                        # as Task.invoke does for chained tasks run inline
+                        log.error("Chained task %s of %s has hit its maximum call count", chained, task)
+                    elif self._executor_for(chained) is None:
+                        inline.append(chained)
+                    else:
+                        self._dispatch(chained, reschedule=False)
+            finally:
+                # whatever happens to the chained tasks, the task itself stays on the schedule
+                if self._breakers is not None and task._tag is not None:
+                    self._settle(task)
+                if reschedule:
+                    self._reschedule(task)
+                self._condition.notify()
+        for chained in inline:
+            try:
+                chained.invoke()
+            except MaxCallException:
+                log.error("Chained task %s of %s has hit its maximum call count", chained, task)
@@ -0,0 +1,171 @@
+"""Builds a Scheduler and its tasks from a JSON task spec, for python -m occasionally
+
+A spec is a JSON object with the scheduler's options, and a list of tasks. Each task names its call_function as
+"module:function" and has exactly one schedule: after_seconds, every_seconds, cron (with an optional tz, a time zone
+name) or daily_at ("HH:MM", with optional weekdays and tz). The other keys are occasionally.task.Task and
+occasionally.scheduler.Scheduler keyword arguments, with JSON objects for the ones that take an object:
+
+    {
+        "scheduler": {
+            "execution": "thread", "workers": 4, "spread": 60,
+            "state_store": "/var/lib/myapp/schedule",
+            "rate_limits": {"db": {"rate": 50, "burst": 10}},
+            "circuit_breakers": {"db": {"failure_threshold": 5, "reset_timeout": 30}}
+        },
+        "tasks": [
+            {"call": "myapp.jobs:clean_db", "after_seconds": 300, "task_id": "clean_db", "tag": "db",
+             "retry": {"max_attempts": 5, "base_delay": 10}},
+            {"call": "myapp.jobs:send_report", "args": ["sales"], "cron": "0 9 * * mon-fri", "tz": "Europe/Paris"},
+            {"call": "myapp.jobs:backup", "daily_at": "02:30", "just_x_times": 1}
+        ]
+    }
+"""
+import importlib
+import json
+
+# Task keyword arguments a spec can give as they are
+_TASK_OPTIONS = ("schedule_immediately", "just_x_times", "max_concurrency", "task_id", "priority", "weight",
+                 "isolated", "spread", "jitter", "tag")
+
+_SCHEDULES = ("after_seconds", "every_seconds", "cron", "daily_at")
+
+# schedule -> the task keys that only apply to it
+_SCHEDULE_OPTIONS = {"after_seconds": (), "every_seconds": (), "cron": ("tz",), "daily_at": ("tz", "weekdays")}
+
+# Scheduler keyword arguments a spec can give as they are
+_SCHEDULER_OPTIONS = ("max_size", "sleep_interval", "backend", "tick", "execution", "workers", "reschedule_on",
+                      "coalesce", "producers", "fair", "spread", "jitter")
+
+
+def resolve(name):
+    """Imports the object a "module:attribute" name refers to, e.g. "myapp.jobs:clean_db" or
+    "myapp.jobs:Jobs.clean_db"
+
+    Args:
+        name: str
+
+    Raises:
+        ValueError if name has no ":", ImportError or AttributeError if it can't be found
+
+    Returns:
+        The object
+    """
+    module_name, _, path = name.partition(":")
+    if not module_name or not path:
+        raise ValueError("Expected a \"module:function\" name, got %r" % (name,))
+    value = importlib.import_module(module_name)
+    for attribute in path.split("."):
+        value = getattr(value, attribute)
+    return value
+
+
+def load(path):
+    """Reads a JSON task spec and builds its Scheduler, see from_dict
+
+    Args:
+        path: str path of the spec file
+
+    Raises:
+        ValueError if the spec is not valid JSON or not a valid spec
+
+    Returns:
+        occasionally.scheduler.Scheduler with the spec's tasks added
+    """
+    with open(path, "r") as f:
+        return from_dict(json.load(f))
+
+
+def from_dict(spec):
+    """Builds a Scheduler from a task spec, see the module docstring
+
+    Args:
+        spec: dict with an optional "scheduler" dict and a "tasks" list
+
+    Raises:
+        ValueError if the spec has unknown keys, or a task does not have exactly one schedule
+
+    Returns:
+        occasionally.scheduler.Scheduler with the spec's tasks added
+    """
+    from .scheduler import Scheduler
+    _check_keys("spec", spec, ("scheduler", "tasks"))
+    scheduler = Scheduler(**_scheduler_options(spec.get("scheduler", dict())))
+    scheduler.add_tasks([_task(task_spec) for task_spec in spec.get("tasks", ())])
+    return scheduler
+
+
+def _scheduler_options(options):
+    """Turns the spec's scheduler dict into Scheduler keyword arguments"""
+    _check_keys("scheduler", options,
+                _SCHEDULER_OPTIONS + ("state_store", "rate_limits", "circuit_breakers", "isolation"))
+    kwargs = dict((key, value) for key, value in options.items() if key in _SCHEDULER_OPTIONS)
+    if "state_store" in options:
+        from .state_store import StateStore
+        kwargs["state_store"] = StateStore(options["state_store"])
+    if "rate_limits" in options:
+        from .rate_limit import TokenBucket
+        kwargs["rate_limits"] = dict((tag, TokenBucket(**bucket)) for tag, bucket in options["rate_limits"].items())
+    if "circuit_breakers" in options:
+        from .retry import CircuitBreaker
+        kwargs["circuit_breakers"] = dict((tag, CircuitBreaker(**breaker))
+                                          for tag, breaker in options["circuit_breakers"].items())
+    if "isolation" in options:
+        from .worker_pool import IsolatedPool
+        kwargs["isolation"] = IsolatedPool(**options["isolation"])
+    return kwargs
+
+
+def _task(task_spec):
+    """Builds a Task from one of the spec's tasks"""
+    from .task import Task
+    _check_keys("task", task_spec, ("call", "args", "kwargs", "retry", "tz", "weekdays") + _SCHEDULES + _TASK_OPTIONS)
+    if "call" not in task_spec:
+        raise ValueError("Task spec %r has no call" % (task_spec,))
+    kwargs = dict((key, value) for key, value in task_spec.items() if key in _TASK_OPTIONS)
+    if "retry" in task_spec:
+        from .retry import RetryPolicy
+        kwargs["retry"] = RetryPolicy(**task_spec["retry"])
+    return Task(resolve(task_spec["call"]), _frequency(task_spec), call_args=task_spec.get("args", ()),
+                call_kwargs=task_spec.get("kwargs"), **kwargs)
+
+
+def _frequency(task_spec):
+    """Returns the frequency function of one of the spec's tasks"""
+    from . import time_helpers
+    schedules = [key for key in _SCHEDULES if key in task_spec]
+    if len(schedules) != 1:
+        raise ValueError("Task spec for %s needs exactly one of %s, got %s"
+                         % (task_spec["call"], ", ".join(_SCHEDULES), schedules or "none"))
+    schedule = schedules[0]
+    unused = sorted(key for key in ("tz", "weekdays") if key in task_spec and key not in _SCHEDULE_OPTIONS[schedule])
+    if unused:
+        raise ValueError("Task spec for %s has %s, which %s does not use" % (task_spec["call"], ", ".join(unused),
+                                                                            schedule))
+    value = task_spec[schedule]
+    if schedule == "after_seconds":
+        return time_helpers.after_x_seconds(value)
+    if schedule == "every_seconds":
+        return time_helpers.every_x_seconds(value)
+    tz = _time_zone(task_spec["tz"]) if "tz" in task_spec else None
+    if schedule == "cron":
+        return time_helpers.on_cron(value, tz)
+    hour, _, minute = value.partition(":")
+    return time_helpers.daily_at(int(hour), int(minute or 0), task_spec.get("weekdays"), tz)
+
+
+def _time_zone(name):
+    # zoneinfo needs python 3.9+, and is only imported for specs that name a time zone
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        return ZoneInfo(name)
+    except ZoneInfoNotFoundError:
+        # a KeyError, which callers of load don't expect for a bad spec
+        raise ValueError("Unknown time zone %r" % (name,))
+
+
+def _check_keys(what, spec, allowed):
+    if not isinstance(spec, dict):
+        raise ValueError("Expected a JSON object for the %s, got %r" % (what, spec))
+    unknown = sorted(set(spec) - set(allowed))
+    if unknown:
+        raise ValueError("Unknown %s keys %s" % (what, ", ".join(unknown)))
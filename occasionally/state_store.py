@@ -0,0 +1,268 @@
+import array
+import gc
+import os
+import pickle
+import struct
+import threading
+import zlib
+from collections import deque
+from .log import log
+
+# every journal batch and the snapshot are prefixed with the payload's length and crc32
+_HEADER = struct.Struct(">II")
+
+
+class StateStore(object):
+    """Persists the state of occasionally.task.Task objects (next invoke time and call counters) so a Scheduler
+    can pick up where it left off after a restart. Only tasks with a task_id are persisted.
+
+    State is kept in two files:
+        <path>.journal: an append-only log of batches of task states. Scheduler.foreground only appends to an
+        in-memory buffer, a background thread writes the buffer to the journal every flush_interval seconds.
+
+        <path>.snapshot: a compact, columnar copy of every task's latest state. Once the journal holds
+        compact_every states, the journal is folded into a new snapshot (written to a temporary file and
+        atomically renamed) and truncated.
+
+    Every record is checksummed, so a batch that was only partially written when the process crashed is ignored,
+    and state is only ever lost back to the last flush.
+    """
+
+    def __init__(self, path, flush_interval=1.0, compact_every=1000000, fsync=True):
+        """Creates a new StateStore and loads any state saved at path
+
+        Args:
+            path: str path prefix of the journal and snapshot files
+
+            flush_interval: number of seconds between writes of buffered states to the journal
+
+            compact_every: int number of journaled states after which the journal is folded into the snapshot
+
+            fsync: bool, whether to fsync the journal after every write and the snapshot before renaming it
+
+        Returns:
+            A new StateStore
+        """
+        self._path = path
+        self._journal_path = path + ".journal"
+        self._snapshot_path = path + ".snapshot"
+        self._flush_interval = flush_interval
+        self._compact_every = compact_every
+        self._fsync = fsync
+        # states recorded by the scheduler, waiting to be written. deque append and popleft are thread safe
+        self._pending = deque()
+        # serializes flushes between the background thread, flush and close
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        self._ids = list()
+        self._next_invokes = array.array("d")
+        self._successful_calls = array.array("q")
+        self._unsuccessful_calls = array.array("q")
+        self._index = dict()
+        # states newer than the snapshot, task_id -> (next_invoke, successful_calls, unsuccessful_calls)
+        self._journaled = dict()
+        self._journaled_count = 0
+        self._load()
+        self._journal = open(self._journal_path, "ab")
+
+    def __repr__(self):
+        return "StateStore(%r, flush_interval=%r, compact_every=%r)" % (self._path, self._flush_interval,
+                                                                       self._compact_every)
+
+    def __len__(self):
+        return len(self._index) + sum(1 for task_id in self._journaled if task_id not in self._index)
+
+    def get(self, task_id):
+        """Gets the saved state of a task
+
+        Args:
+            task_id: the task's task_id
+
+        Returns:
+            (next_invoke, successful_calls, unsuccessful_calls) tuple, or None if nothing is saved for task_id
+        """
+        state = self._journaled.get(task_id)
+        if state is not None:
+            return state
+        index = self._index.get(task_id)
+        if index is None:
+            return None
+        next_invoke = self._next_invokes[index]
+        # None is stored as nan, the only float that is not equal to itself
+        if next_invoke != next_invoke:
+            next_invoke = None
+        return next_invoke, self._successful_calls[index], self._unsuccessful_calls[index]
+
+    def record(self, task):
+        """Buffers the current state of task to be written by the background flusher. Cheap enough to call
+        from Scheduler.foreground for every invocation.
+
+        Args:
+            task: occasionally.task.Task, ignored if it has no task_id
+
+        Returns:
+        """
+        if task._task_id is None:
+            return
+        self._pending.append((task._task_id, task._next_invoke, task._successful_calls, task._unsuccessful_calls))
+        if self._flusher is None:
+            self._start_flusher()
+
+    def flush(self):
+        """Writes buffered states to the journal now, and compacts if the journal has grown past compact_every
+
+        Args:
+
+        Returns:
+        """
+        with self._lock:
+            if self._journal.closed:
+                return
+            pending = self._pending
+            batch = [pending.popleft() for _ in range(len(pending))]
+            if batch:
+                self._write_record(self._journal, batch)
+                self._apply(batch)
+            if self._journaled_count >= self._compact_every:
+                self._compact()
+
+    def compact(self):
+        """Writes buffered states, then folds the journal into a new snapshot and truncates the journal
+
+        Args:
+
+        Returns:
+        """
+        self.flush()
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        """Flushes buffered states and stops the background flusher
+
+        Args:
+
+        Returns:
+        """
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        with self._lock:
+            self._journal.close()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, name="occasionally-state-flusher")
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while not self._closed.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("StateStore %r failed to flush", self)
+
+    def _write_record(self, f, payload):
+        data = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        f.write(_HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff))
+        f.write(data)
+        f.flush()
+        if self._fsync:
+            os.fsync(f.fileno())
+
+    def _apply(self, batch):
+        for task_id, next_invoke, successful_calls, unsuccessful_calls in batch:
+            self._journaled[task_id] = (next_invoke, successful_calls, unsuccessful_calls)
+        self._journaled_count += len(batch)
+
+    def _compact(self):
+        """Folds the journaled states into the columns, writes them as the new snapshot and truncates the journal.
+        Must be called with self._lock held
+
+        Args:
+
+        Returns:
+        """
+        for task_id, (next_invoke, successful_calls, unsuccessful_calls) in self._journaled.items():
+            index = self._index.get(task_id)
+            if index is None:
+                self._index[task_id] = len(self._ids)
+                self._ids.append(task_id)
+                self._next_invokes.append(next_invoke if next_invoke is not None else float("nan"))
+                self._successful_calls.append(successful_calls)
+                self._unsuccessful_calls.append(unsuccessful_calls)
+            else:
+                self._next_invokes[index] = next_invoke if next_invoke is not None else float("nan")
+                self._successful_calls[index] = successful_calls
+                self._unsuccessful_calls[index] = unsuccessful_calls
+        temporary_path = self._snapshot_path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            self._write_record(f, (self._ids, self._next_invokes, self._successful_calls, self._unsuccessful_calls))
+        # atomic on POSIX, and on Windows with os.replace
+        getattr(os, "replace", os.rename)(temporary_path, self._snapshot_path)
+        # a crash before the journal is truncated only means the journal is replayed over the new snapshot again
+        self._journal.close()
+        self._journal = open(self._journal_path, "wb")
+        self._journaled = dict()
+        self._journaled_count = 0
+        log.debug("StateStore %r compacted %d task states", self, len(self._ids))
+
+    def _load(self):
+        """Loads the snapshot, then replays the journal over it. Anything after the first truncated or corrupt
+        journal record is dropped.
+
+        Args:
+
+        Returns:
+        """
+        # unpickling creates millions of objects that can't be part of a cycle, don't let the gc chase them
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if os.path.exists(self._snapshot_path):
+                with open(self._snapshot_path, "rb") as f:
+                    records = list(self._read_records(f))
+                if records:
+                    self._ids, self._next_invokes, self._successful_calls, self._unsuccessful_calls = records[0][0]
+                    self._index = dict(zip(self._ids, range(len(self._ids))))
+                else:
+                    log.error("StateStore snapshot %s is corrupt, ignoring it", self._snapshot_path)
+            if os.path.exists(self._journal_path):
+                with open(self._journal_path, "r+b") as f:
+                    valid_length = 0
+                    for batch, valid_length in self._read_records(f):
+                        self._apply(batch)
+                    # so new batches are not appended after a partially written one
+                    f.truncate(valid_length)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    @staticmethod
+    def _read_records(f):
+        """Reads checksummed records until the end of f or the first bad record
+
+        Args:
+            f: file opened in binary mode
+
+        Returns:
+            An iterator of (payload, offset just past the record) tuples
+        """
+        offset = 0
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, crc = _HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length or zlib.crc32(data) & 0xffffffff != crc:
+                log.warning("Ignoring truncated or corrupt record at offset %d of %s", offset, f.name)
+                return
+            offset += _HEADER.size + length
+            yield pickle.loads(data), offset
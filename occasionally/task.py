@@ -1,5 +1,15 @@
+import random
 import time
-from log import log
+import zlib
+from .log import log
+
+try:
+    from types import MappingProxyType
+    # shared by every task without call_kwargs, read only so sharing it is safe
+    _NO_KWARGS = MappingProxyType(dict())
+except ImportError:
+    # python 2.7, nothing in the package mutates call_kwargs
+    _NO_KWARGS = dict()
 
 
 class MaxCallException(Exception):
@@ -20,20 +30,85 @@ def soonest_task_comparator(task1, task2):
         return task2
     return task1 if task1._next_invoke < task2._next_invoke else task2
 
-class Task():
+def soonest_task_key(task):
+    """Sort key equivalent of soonest_task_comparator, for the key engine of PriorityQueue
+
+    Args:
+        task: Task
+
+    Raises:
+        ComparatorException if the task does not have _next_invoke set
+
+    Returns:
+        The time the task should next be invoked
+    """
+    if task._next_invoke is None:
+        raise ComparatorException("task %s does not have _next_invoke set" % task)
+    return task._next_invoke
+
+def _phase_fraction(task):
+    """Returns a fraction in [0, 1) that is the same for the same task_id in every process. Tasks without a task_id
+    get a random one, nothing else about a task (the repr of its call_args can hold memory addresses) is the same
+    from process to process
+
+    Args:
+        task: Task
+
+    Returns:
+        float
+    """
+    if task._task_id is None:
+        return random.random()
+    return (zlib.crc32(repr(task._task_id).encode("utf-8")) & 0xffffffff) / 4294967296.0
+
+def batch_capable(batch_function):
+    """Decorator for a call_function that can also handle many calls at once. When several tasks with the
+    decorated call_function are due together, a Scheduler with coalesce=True calls batch_function once with a list
+    of their call_args tuples instead of calling call_function once per task. Tasks with call_kwargs are still
+    called one at a time. If batch_function raises, every task in the batch counts the call as unsuccessful
+
+        def clean_tenants(args_list):
+            db.execute("DELETE FROM temp_users WHERE tenant IN %s", [args[0] for args in args_list])
+
+        @batch_capable(clean_tenants)
+        def clean_tenant(tenant):
+            db.execute("DELETE FROM temp_users WHERE tenant = %s", tenant)
+
+    Args:
+        batch_function: a function that takes a list of call_args tuples
+
+    Returns:
+        A decorator that returns the call_function it is given, with batch_function attached
+    """
+    def decorate(call_function):
+        call_function.batch_function = batch_function
+        return call_function
+    return decorate
+
+class Task(object):
+    # no per-task __dict__, which matters when millions of tasks are scheduled
+    __slots__ = ("_call_function", "_frequency_function", "_call_args", "_call_kwargs", "_next_task",
+                 "_exception_handler", "_call_next_task_on_exception", "_schedule_immediately", "_max_calls",
+                 "_successful_calls", "_unsuccessful_calls", "_next_invoke", "_max_concurrency", "_running",
+                 "_cancelled", "_task_id", "_next_fire", "_priority", "_weight", "_virtual_time", "_isolated",
+                 "_phase", "_jitter", "_tag", "_deferred", "_queue_index", "_retry", "_failures", "_skipped")
 
-    def __init__(self, call_function, frequency_function, call_args=list(), call_kwargs=dict(), next_task=None, exception_handler=None, call_next_task_on_exception=False, schedule_immediately=False, just_x_times=-1):
-        # type: (func, func, list, dict, Task, Task) -> Task
+    def __init__(self, call_function, frequency_function, call_args=(), call_kwargs=None, next_task=None, exception_handler=None, call_next_task_on_exception=False, schedule_immediately=False, just_x_times=-1, max_concurrency=0,
+                 task_id=None, priority=0, weight=1.0, isolated=False,
+                 spread=None, jitter=None, tag=None, retry=None):
+        # type: (func, func, tuple, dict, Task, Task) -> Task
         """Creates a new task object. Made to be passed to a Scheduler object.
 
         Args:
             call_function: a function to be called every frequency_function sections.
 
-            frequency_function: a function that when called, returns the frequency seconds for the given task.
+            frequency_function: a function that when called, returns the frequency seconds for the given task. If it
+            has a next_fire method (see occasionally.cron), the task runs at the times next_fire returns instead.
 
-            call_args: a list of args to be passed to call_function.
+            call_args: a tuple (or other iterable, which is copied into a tuple) of args to be passed to call_function.
 
-            call_kwargs: a dict of keyword args to be passed to the call function.
+            call_kwargs: a dict of keyword args to be passed to the call function. It is not copied, so should not be
+            modified afterwards.
 
             next_task: A Task object to be called if this task's invocation is successful. Defaults to None.
 
@@ -46,12 +121,53 @@ class Task():
             until one frequency_function cycle
 
             just_x_times: An int indicating the number of times to run a task
+
+            max_concurrency: An int limiting how many runs of the task can be in progress at once when a Scheduler
+            hands tasks to a pool. 1 prevents overlapping runs, 0 means no limit. A run that would exceed the limit
+            is skipped.
+
+            task_id: A stable, hashable id for the task, e.g. a str. Required for the task's state to be saved by an
+            occasionally.state_store.StateStore, and must be the same across restarts.
+
+            priority: An int, higher is more important. A Scheduler created with fair=True runs due tasks with a
+            higher priority first, and one with an occasionally.overload.ShedLowestPriority policy skips the runs of
+            the lowest priority tasks first when it falls behind.
+
+            weight: A number more than 0. With a Scheduler created with fair=True, due tasks of the same priority
+            share the scheduler's time in proportion to their weights.
+
+            isolated: A bool. If True, a Scheduler runs call_function in its isolation pool (see
+            occasionally.worker_pool.IsolatedPool), in a separate process, so call_function, call_args and
+            call_kwargs must be picklable.
+
+            spread: A number of seconds to spread the task's runs over, so that tasks created together with the same
+            frequency_function don't all run at the same moment. The task's runs are shifted by a phase between 0 and
+            spread, worked out from task_id so it is the same in every process. Tasks without a task_id get a random
+            phase, so they are spread out within a process but not consistently across processes. The phase is added to the first run (including a schedule_immediately one)
+            of interval tasks, and to every run of calendar schedules. None uses the Scheduler's spread.
+
+            jitter: A number of seconds. Every run is delayed by a random amount between 0 and jitter. None uses the
+            Scheduler's jitter.
+
+            tag: A hashable resource tag, e.g. "db". A Scheduler created with a rate limit for the tag (see
+            occasionally.rate_limit.TokenBucket) holds back runs of the task that would exceed it, and one with a
+            circuit breaker for the tag (see occasionally.retry.CircuitBreaker) stops running the task while the
+            breaker is open.
+
+            retry: An occasionally.retry.RetryPolicy. After a failed run, the task runs again after the policy's
+            backoff delay instead of after frequency_function, up to the policy's max_attempts runs in a row.
+
+        Raises:
+            ValueError if weight is not more than 0
         """
+        if weight <= 0:
+            raise ValueError("Task weight must be more than 0, got %r" % (weight,))
 
         self._call_function = call_function
         self._frequency_function = frequency_function
-        self._call_args = call_args
-        self._call_kwargs = call_kwargs
+        self._next_fire = getattr(frequency_function, "next_fire", None)
+        self._call_args = tuple(call_args)
+        self._call_kwargs = call_kwargs if call_kwargs else _NO_KWARGS
         self._next_task = next_task
         self._exception_handler = exception_handler
         self._call_next_task_on_exception = call_next_task_on_exception
@@ -60,9 +176,36 @@ class Task():
         self._successful_calls = 0
         self._unsuccessful_calls = 0
         self._next_invoke = None
+        self._max_concurrency = max_concurrency
+        # runs handed to a pool by a Scheduler that have not completed yet
+        self._running = 0
+        self._cancelled = False
+        self._task_id = task_id
+        self._priority = priority
+        self._weight = weight
+        # virtual time of a Scheduler created with fair=True: where the task's last run started, plus its duration
+        # divided by weight once it has finished
+        self._virtual_time = 0.0
+        self._isolated = isolated
+        # seconds added to the first run (every run for calendar schedules), None until spread is known
+        self._phase = None if spread is None else spread * _phase_fraction(self)
+        self._jitter = jitter
+        self._tag = tag
+        # whether the run now due already waited for a token from its tag's rate limit
+        self._deferred = False
+        # whether a Scheduler's overload policy skipped a run of the task, after which a schedule_immediately task
+        # that never ran waits for its frequency instead of coming due again right away
+        self._skipped = False
+        # index in the heap of an occasionally.indexed_queue.IndexedPriorityQueue the task is queued in
+        self._queue_index = None
+        self._retry = retry
+        # failed runs in a row
+        self._failures = 0
 
     def __str__(self):
-        return "#<Task: call_function=%s, frequency_function=%s>" % (self._call_function.__name__, self._frequency_function.__name__)
+        # schedules from occasionally.cron are objects without a __name__
+        return "#<Task: call_function=%s, frequency_function=%s>" % (
+            self._call_function.__name__, getattr(self._frequency_function, "__name__", self._frequency_function))
 
     def invoke(self):
         """Invokes the call_function with its call_args and call_kwargs
@@ -77,42 +220,155 @@ class Task():
 
         if self._max_calls_hit():
             raise MaxCallException("Task %s has hit its maximum call count" % self)
-        hit_exception = False
-        try:
-            rv = self._call_function(*self._call_args, **self._call_kwargs)
-            log.debug("Successfully completed task %s", self)
-            self._successful_calls += 1
-        except Exception:
-            hit_exception = True
-            log.exception("Task %s hit exception:", self)
-            if self._exception_handler:
-                try:
-                    self._exception_handler.invoke()
-                except:
-                    log.exception("Exception handler task %s hit exception:", self._exception_handler)
+        # chained tasks are run from this loop instead of recursively, so a long next_task chain can't overflow
+        # the stack. Each entry is (task, whether it runs as part of an exception handler)
+        pending = [(self, False)]
+        while pending:
+            task, handling = pending.pop()
+            if task is not self and task._max_calls_hit():
+                if handling:
+                    # errors in an exception handler are logged, not raised
+                    log.error("Exception handler task %s has hit its maximum call count", task)
+                    continue
+                raise MaxCallException("Task %s has hit its maximum call count" % task)
+            hit_exception = False
+            try:
+                task._call_function(*task._call_args, **task._call_kwargs)
+                log.debug("Successfully completed task %s", task)
+                task._successful_calls += 1
+                if task._failures:
+                    task._failures = 0
+            except Exception:
+                hit_exception = True
+                log.exception("Task %s hit exception:", task)
+                task._unsuccessful_calls += 1
+                task._failures += 1
+            # if there is a next task, and this task was successful or doesn't care about exception, execute next
+            # task. It is pushed first so the exception handler, and anything it chains, runs before it
+            if task._next_task and (not hit_exception or task._call_next_task_on_exception):
+                log.debug("Task %s invoking next_task %s", task, task._next_task)
+                pending.append((task._next_task, handling))
+            if hit_exception and task._exception_handler:
+                pending.append((task._exception_handler, True))
+
+    def _complete_call(self, hit_exception):
+        """Records the outcome of a call_function call that ran outside of invoke (e.g. in a Scheduler's pool)
+
+        Args:
+            hit_exception: bool, whether call_function raised
+
+        Returns:
+            A list of the Tasks that should run next: the exception_handler and/or the next_task
+        """
+        chained = list()
+        if hit_exception:
             self._unsuccessful_calls += 1
-        # if there is a next task, and this task was successful or doesn't care about exception, execute next task
+            self._failures += 1
+            if self._exception_handler:
+                chained.append(self._exception_handler)
+        else:
+            self._successful_calls += 1
+            self._failures = 0
         if self._next_task and (not hit_exception or self._call_next_task_on_exception):
             log.debug("Task %s invoking next_task %s", self, self._next_task)
-            self._next_task.invoke()
+            chained.append(self._next_task)
+        return chained
 
-    def set_next_invoke(self):
+    def set_next_invoke(self, now=None, wall=None):
         """Sets the next time for the task on self._next_invoke
 
         Args:
+            now: float time to schedule from, None reads time.time(). Lets a Scheduler reschedule a batch of
+            tasks with one clock read, on the timeline of its occasionally.clock.Clock
+
+            wall: float time.time() at now, which calendar schedules are worked out on. None if now is wall clock
+            time already
 
         Returns:
         """
 
         if self._max_calls_hit():
             raise MaxCallException("Task %s has hit its maximum number of calls" % self)
-        if self.times_called == 0 and self._successful_calls:
-            self._next_invoke = time.time()
+        if now is None:
+            now = time.time()
+        if self._retry is not None and self._failures:
+            # the attempt within the current round of retries, 0 once max_attempts runs in a row have failed
+            attempt = self._failures % self._retry.max_attempts
+            if attempt:
+                self._next_invoke = now + self._retry.delay(attempt)
+                return
+        first = self.times_called + self._running == 0
+        if first and self._schedule_immediately and not self._skipped:
+            next_invoke = now
+        elif self._next_fire is not None:
+            # a calendar schedule, see occasionally.cron
+            if wall is None:
+                next_invoke = self._next_fire(now)
+            else:
+                next_invoke = now + (self._next_fire(wall) - wall)
+            # every run is on the schedule's grid, so the phase is added every time
+            first = True
         else:
-            self._next_invoke = time.time() + self._frequency_function()
+            next_invoke = now + self._frequency_function()
+        if first and self._phase:
+            next_invoke += self._phase
+        if self._jitter:
+            next_invoke += random.random() * self._jitter
+        self._next_invoke = next_invoke
+
+    def _restore_state(self, state):
+        """Restores the state saved by an occasionally.state_store.StateStore
+
+        Args:
+            state: (next_invoke, successful_calls, unsuccessful_calls) tuple
+
+        Returns:
+        """
+        self._next_invoke, self._successful_calls, self._unsuccessful_calls = state
 
     def _max_calls_hit(self):
-        return self._max_calls > 0 and self.times_called >= self._max_calls
+        # runs still in progress in a pool will count towards the limit once they complete
+        return self._max_calls > 0 and self.times_called + self._running >= self._max_calls
+
+    @property
+    def task_id(self):
+        return self._task_id
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @property
+    def isolated(self):
+        return self._isolated
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @property
+    def jitter(self):
+        return self._jitter
+
+    @property
+    def tag(self):
+        return self._tag
+
+    @property
+    def retry(self):
+        return self._retry
+
+    @property
+    def failures(self):
+        return self._failures
+
+    @property
+    def cancelled(self):
+        return self._cancelled
 
     @property
     def times_called(self):
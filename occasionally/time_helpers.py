@@ -1,4 +1,14 @@
 # A module for some helpers for task frequency functions
+from collections import OrderedDict
+
+# every task created with the same interval shares one frequency function instead of holding its own closure. Only
+# the most recently used intervals are kept, so programs that make many distinct ones don't keep them all alive
+_INTERN_SIZE = 256
+_interned = OrderedDict()
+
+
+def _intern(unit, value, frequency_function):
+    return _intern_schedule(unit, value, lambda: frequency_function)
 
 
 def after_x_seconds(seconds):
@@ -8,9 +18,9 @@ def after_x_seconds(seconds):
         seconds: int describing number of seconds to call tasks after
 
     Returns:
-        function that returns seconds (no modification)
+        function that returns seconds (no modification). Calls with the same seconds return the same function
     """
-    return lambda: seconds
+    return _intern("seconds", seconds, lambda: seconds)
 
 
 def after_x_mintes(minutes):
@@ -20,9 +30,9 @@ def after_x_mintes(minutes):
         minutes: int describing number of minutes to call tasks after
 
     Returns:
-        function that returns seconds to call tasks after
+        function that returns seconds to call tasks after. Calls with the same minutes return the same function
     """
-    return lambda: minutes * 60
+    return _intern("minutes", minutes, lambda: minutes * 60)
 
 
 def after_x_hours(hours):
@@ -32,7 +42,81 @@ def after_x_hours(hours):
         hours: int describing number of hours to call tasks after
 
     Returns:
-        function that returns seconds to call tasks after
+        function that returns seconds to call tasks after. Calls with the same hours return the same function
+    """
+
+    return _intern("hours", hours, lambda: hours * 3600)
+
+
+def every_x_seconds(seconds, anchor=0.0):
+    """Runs tasks every seconds, at fixed times that do not drift with how long each run takes
+
+    Args:
+        seconds: number of seconds between runs
+
+        anchor: float seconds since the epoch of any time the task should run at. See
+        occasionally.cron.AnchoredInterval
+
+    Returns:
+        occasionally.cron.AnchoredInterval. Calls with the same seconds and anchor return the same schedule
     """
+    # cron needs python 3.6+, so it is only imported when a calendar schedule is used
+    from .cron import AnchoredInterval
+    return _intern_schedule("every", (seconds, anchor), lambda: AnchoredInterval(seconds, anchor))
+
+
+def on_cron(expression, tz=None):
+    """Runs tasks on a cron schedule, e.g. on_cron("*/15 9-17 * * mon-fri")
+
+    Args:
+        expression: str 5 field cron expression or macro such as "@daily". See occasionally.cron.CronSchedule
+
+        tz: datetime.tzinfo to match times in, None for the local time zone
+
+    Returns:
+        occasionally.cron.CronSchedule. Calls with the same expression and tz return the same schedule, which is
+        only parsed once
+    """
+    from .cron import CronSchedule
+    return _intern_schedule("cron", (expression, tz), lambda: CronSchedule(expression, tz))
+
+
+def daily_at(hour, minute=0, weekdays=None, tz=None):
+    """Runs tasks once a day at hour:minute wall clock time
+
+    Args:
+        hour: int 0-23
+
+        minute: int 0-59
+
+        weekdays: iterable of ints (0 is Sunday) or names ("mon") of the days to run on, None for every day
+
+        tz: datetime.tzinfo to match times in, None for the local time zone
+
+    Returns:
+        occasionally.cron.CronSchedule
+    """
+    days = "*" if weekdays is None else ",".join(str(day) for day in weekdays)
+    return on_cron("%d %d * * %s" % (minute, hour, days), tz)
+
 
-    return lambda: hours * 3600
+def _intern_schedule(unit, value, make_schedule):
+    # type is part of the key so e.g. after_x_seconds(5.0) does not return after_x_seconds(5)'s function
+    key = (unit, type(value), value)
+    try:
+        # parsing is the expensive part, so look the schedule up before making one. Popping and reinserting it
+        # marks it as the most recently used
+        schedule = _interned.pop(key, None)
+    except TypeError:
+        # unhashable values still make a schedule, it just isn't shared
+        return make_schedule()
+    if schedule is None:
+        schedule = make_schedule()
+    # no lock: a race at worst makes two schedules for one key, and sharing them is only an optimization
+    _interned[key] = schedule
+    while len(_interned) > _INTERN_SIZE:
+        try:
+            _interned.popitem(last=False)
+        except KeyError:
+            break
+    return schedule
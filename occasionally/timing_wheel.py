@@ -0,0 +1,317 @@
+import heapq
+import itertools
+from .priority_queue import QueueEmptyException, QueueFullException
+from .log import log
+
+
+class TimingWheel(object):
+    """A hierarchical timing wheel. Has the same peek/enqueue/dequeue interface as
+    occasionally.priority_queue.PriorityQueue (key engine), but inserting is O(1) for anything due
+    within the span of the wheels.
+
+    Time is split into ticks of tick seconds. With the default slots of (60, 60, 24) and a tick of 1 second
+    there is a seconds wheel (60 slots of 1 tick), a minutes wheel (60 slots of 60 ticks) and an hours wheel
+    (24 slots of 3600 ticks). Anything further out than the hours wheel goes into an overflow heap. As the
+    wheel's position moves forward, buckets of a coarser wheel are cascaded into the finer wheels below them,
+    and the bucket of the current tick is moved into a small ready heap.
+
+    The ready heap only holds elements due at or before the wheel's position, and every element still in the
+    wheels is due after it, so peek and dequeue always return the element with the lowest key.
+    """
+
+    def __init__(self, key, tick=1.0, max_size=0, slots=(60, 60, 24)):
+        """Creates a new TimingWheel
+
+        Args:
+            key: a function that maps an element to the time (in seconds) it is due
+
+            tick: number of seconds covered by one slot of the finest wheel
+
+            max_size: the maximum number of elements. See occasionally.priority_queue.PriorityQueue. 0 indicates
+            no max size
+
+            slots: a tuple with the number of slots in each wheel, finest first
+
+        Raises:
+            ValueError if tick is not positive or slots is empty
+
+        Returns:
+            A new TimingWheel
+        """
+        if tick <= 0:
+            raise ValueError("tick must be positive, got %r" % tick)
+        if not slots:
+            raise ValueError("TimingWheel requires at least one wheel")
+        self._key = key
+        self._tick = float(tick)
+        self._max_size = max_size
+        self._slots = tuple(slots)
+        # number of ticks covered by one slot of each wheel
+        self._units = list()
+        unit = 1
+        for slot_count in self._slots:
+            self._units.append(unit)
+            unit *= slot_count
+        self._wheels = [[list() for _ in range(slot_count)] for slot_count in self._slots]
+        self._counts = [0] * len(self._slots)
+        self._overflow = list()
+        self._ready = list()
+        self._counter = itertools.count()
+        self._size = 0
+        # the wheel's position, in ticks. Set by the first enqueue
+        self._now = None
+
+    def __repr__(self):
+        return "TimingWheel(%s, tick=%r, max_size=%r, slots=%r)" % (self._key.__name__, self._tick,
+                                                                     self._max_size, self._slots)
+
+    def __str__(self):
+        return "#<TimingWheel: max_size=%s tick=%s key_function=%s>" % (self._max_size, self._tick, self._key.__name__)
+
+    def __len__(self):
+        return self._size
+
+    def peek(self):
+        """get the element with the lowest key, and if no items exist, raises QueueEmptyException
+
+        Args:
+
+        Raises:
+            QueueEmptyException
+
+        Returns:
+            The element with the lowest key
+        """
+        if self._size == 0:
+            raise QueueEmptyException("%s is empty" % self)
+        if not self._ready:
+            self._advance()
+        return self._ready[0][-1]
+
+    def enqueue(self, item):
+        """Inserts a new item into the bucket for its key
+
+        Args:
+            item: Any object that adheres to self._key
+
+        Raises:
+            QueueFullException if the wheel is at max_size
+
+        Returns:
+        """
+        if 0 < self._max_size <= self._size:
+            log.error("Excluding inserting %s into TimingWheel due to max_size being reached", item)
+            raise QueueFullException("%s is full" % self)
+        key = self._key(item)
+        entry = (key, next(self._counter), item)
+        if self._now is None:
+            self._now = self._tick_of(key)
+        self._place(entry)
+        self._size += 1
+
+    def enqueue_many(self, items):
+        """Inserts several items at once. If the items would not all fit within max_size, none are inserted
+
+        Args:
+            items: iterable of objects that adhere to self._key
+
+        Raises:
+            QueueFullException
+
+        Returns:
+        """
+        items = list(items)
+        if self._max_size > 0 and self._size + len(items) > self._max_size:
+            log.error("Excluding inserting %d items into TimingWheel due to max_size being reached", len(items))
+            raise QueueFullException("%s is full" % self)
+        for item in items:
+            self.enqueue(item)
+
+    def remove_where(self, predicate):
+        """Removes every element for which predicate returns True
+
+        Args:
+            predicate: a function that takes an element and returns a bool
+
+        Returns:
+            A list of the removed elements, in no particular order
+        """
+        removed = list()
+
+        def keep(entry):
+            if predicate(entry[-1]):
+                removed.append(entry[-1])
+                return False
+            return True
+
+        for level, wheel in enumerate(self._wheels):
+            for slot, bucket in enumerate(wheel):
+                kept = [entry for entry in bucket if keep(entry)]
+                self._counts[level] -= len(bucket) - len(kept)
+                wheel[slot] = kept
+        self._ready[:] = [entry for entry in self._ready if keep(entry)]
+        heapq.heapify(self._ready)
+        self._overflow[:] = [pair for pair in self._overflow if keep(pair[1])]
+        heapq.heapify(self._overflow)
+        self._size -= len(removed)
+        return removed
+
+    def sorted_view(self):
+        """Iterates over the elements from lowest key to highest without modifying the wheel
+
+        Args:
+
+        Returns:
+            An iterator of elements in key order
+        """
+        return (entry[-1] for entry in sorted(self._entries()))
+
+    def set_max_size(self, new_size):
+        """Sets a new max size for the wheel. If there are more elements than new_size, the elements with the
+        highest keys are purged
+
+        Args:
+            new_size: int for max new size of the wheel. 0 indicates no max size
+
+        Returns:
+        """
+        self._max_size = new_size
+        if new_size > 0 and self._size > new_size:
+            kept = heapq.nsmallest(new_size, self._entries())
+            self._wheels = [[list() for _ in range(slot_count)] for slot_count in self._slots]
+            self._counts = [0] * len(self._slots)
+            self._overflow = list()
+            self._ready = list()
+            for entry in kept:
+                self._place(entry)
+            self._size = len(kept)
+
+    def _entries(self):
+        """Iterates over the (key, insertion_order, item) entries in the wheel, in no particular order"""
+        for entry in self._ready:
+            yield entry
+        for wheel in self._wheels:
+            for bucket in wheel:
+                for entry in bucket:
+                    yield entry
+        for _, entry in self._overflow:
+            yield entry
+
+    def _elements(self):
+        """Iterates over the elements in the wheel, in no particular order"""
+        return (entry[-1] for entry in self._entries())
+
+    def dequeue(self):
+        """Removes and returns the element with the lowest key. If no elements are in the wheel,
+        raises QueueEmptyException
+
+        Args:
+
+        Raises:
+            QueueEmptyException
+
+        Returns:
+            Type of what has been fed to enqueue (any)
+        """
+        if self._size == 0:
+            raise QueueEmptyException("%s is empty" % self)
+        if not self._ready:
+            self._advance()
+        self._size -= 1
+        return heapq.heappop(self._ready)[-1]
+
+    def dequeue_up_to(self, key):
+        """Removes and returns every element whose key is less than or equal to key
+
+        Args:
+            key: a key as returned by self._key
+
+        Returns:
+            A list of the removed elements, lowest key first
+        """
+        due = list()
+        ready = self._ready
+        while self._size:
+            if not ready:
+                self._advance()
+                ready = self._ready
+            if ready[0][0] > key:
+                break
+            due.append(heapq.heappop(ready)[-1])
+            self._size -= 1
+        return due
+
+    def _tick_of(self, key):
+        return int(key // self._tick)
+
+    def _place(self, entry):
+        """Puts entry in the ready heap, the finest wheel that spans it, or the overflow heap
+
+        Args:
+            entry: (key, insertion_order, item) tuple
+
+        Returns:
+        """
+        tick = int(entry[0] // self._tick)
+        now = self._now
+        if tick <= now:
+            heapq.heappush(self._ready, entry)
+            return
+        level = 0
+        for unit, slot_count in zip(self._units, self._slots):
+            if tick // unit - now // unit < slot_count:
+                self._wheels[level][(tick // unit) % slot_count].append(entry)
+                self._counts[level] += 1
+                return
+            level += 1
+        heapq.heappush(self._overflow, (tick, entry))
+
+    def _advance(self):
+        """Moves the wheel's position forward until the ready heap has elements. Skips straight to the next
+        boundary of the finest non-empty wheel instead of stepping over empty ticks. Must only be called
+        when the wheel is not empty.
+
+        Args:
+
+        Returns:
+        """
+        last_unit = self._units[-1]
+        while not self._ready:
+            for level, count in enumerate(self._counts):
+                if count:
+                    unit = self._units[level]
+                    self._now = (self._now // unit + 1) * unit
+                    break
+            else:
+                # only the overflow heap has elements, jump to the start of the coarsest slot of the earliest one
+                self._now = (self._overflow[0][0] // last_unit) * last_unit
+            self._on_boundary()
+
+    def _on_boundary(self):
+        """Cascades coarser wheels whose slot starts at the current position, then moves the finest wheel's
+        current bucket into the ready heap
+
+        Args:
+
+        Returns:
+        """
+        now = self._now
+        coarsest = len(self._slots) - 1
+        for level in range(coarsest, -1, -1):
+            unit = self._units[level]
+            if now % unit:
+                continue
+            if level == coarsest:
+                overflow = self._overflow
+                while overflow and overflow[0][0] // unit - now // unit < self._slots[level]:
+                    self._place(heapq.heappop(overflow)[1])
+            self._cascade(level, (now // unit) % self._slots[level])
+
+    def _cascade(self, level, slot):
+        bucket = self._wheels[level][slot]
+        if not bucket:
+            return
+        self._wheels[level][slot] = list()
+        self._counts[level] -= len(bucket)
+        for entry in bucket:
+            self._place(entry)
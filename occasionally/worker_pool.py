@@ -0,0 +1,415 @@
+"""A pool of pre-forked worker processes for running call_functions in isolation from the scheduler's process
+
+Calls that leak memory or hold the GIL for long stretches are better run in a separate process. IsolatedPool keeps
+worker processes running, hands each call to an idle worker over a pipe, and replaces workers once they have made
+max_tasks calls or grown past max_rss_mb, or when a call runs longer than timeout (the worker is killed). A spare
+worker is always forked ahead of time, so replacing a worker never delays a call.
+
+    pool = IsolatedPool(workers=4, max_tasks=1000, max_rss_mb=512, timeout=60)
+    scheduler = Scheduler(isolation=pool)
+    scheduler.add_task(Task(render_reports, after_x_mintes(5), isolated=True))
+
+Only a small id per call_function crosses the pipe, along with the pickled args and kwargs; each worker is sent the
+call_function itself (pickled by reference, so it must be importable, e.g. defined at module level) the first time
+it is asked to call it. Workers are forked from a clean server process where the platform supports it
+(multiprocessing's forkserver), so they don't inherit the scheduler's memory or threads.
+"""
+import itertools
+import os
+import pickle
+import sys
+import threading
+import traceback
+from collections import deque
+from .log import log
+
+try:
+    from queue import Queue
+except ImportError:
+    # python 2.7
+    from Queue import Queue
+
+
+class WorkerTimeoutException(Exception):
+    """Set on the future of a call that ran longer than the pool's timeout. The worker running it was killed"""
+
+
+class WorkerDiedException(Exception):
+    """Set on the future of a call whose worker exited before returning a result, e.g. because it crashed"""
+
+
+class WorkerRemoteException(Exception):
+    """Set on the future of a call whose result or exception could not be unpickled in the parent process, e.g. an
+    exception whose __init__ takes other arguments than its args. text is the worker's traceback, if it raised"""
+
+    def __init__(self, message, text=None):
+        super(WorkerRemoteException, self).__init__(message)
+        self.text = text
+
+
+class _RemoteTraceback(Exception):
+    """Carries the traceback of an exception raised in a worker, as the __cause__ of the exception"""
+
+    def __init__(self, text):
+        super(_RemoteTraceback, self).__init__(text)
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+def _rss_bytes():
+    """Returns the resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        # not linux, the peak is the closest thing to the current size
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _worker_main(conn):
+    """The loop of a worker process: receives (function id, function or None, args, kwargs) calls and sends back
+    (succeeded, pickled result or exception, traceback text, rss) until it is sent an empty message or the pipe
+    closes. The result is pickled on its own, so the parent can still read the rest if it can't unpickle it.
+    A function sent with args None is only loaded. One sent with a call is acknowledged with an empty message once
+    it is loaded, so that importing its module does not count towards the call's timeout"""
+    functions = dict()
+    while True:
+        try:
+            message = conn.recv_bytes()
+        except EOFError:
+            return
+        if not message:
+            return
+        function_id, function, args, kwargs = pickle.loads(message)
+        if function is not None:
+            functions[function_id] = function
+            if args is None:
+                continue
+            conn.send_bytes(b"")
+        try:
+            reply = (True, functions[function_id](*args, **kwargs), None)
+        except BaseException as e:
+            reply = (False, e, traceback.format_exc())
+        succeeded, value, text = reply
+        try:
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            error = TypeError("Could not pickle the %s of %r: %s" % ("result" if succeeded else "exception",
+                                                                     function_id, e))
+            succeeded, payload = False, pickle.dumps(error, pickle.HIGHEST_PROTOCOL)
+        conn.send_bytes(pickle.dumps((succeeded, payload, text, _rss_bytes()), pickle.HIGHEST_PROTOCOL))
+
+
+class _Worker(object):
+    __slots__ = ("process", "conn", "calls", "known")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.calls = 0
+        # ids of the functions this worker has been sent
+        self.known = set()
+
+    def stop(self, kill=False):
+        if kill:
+            getattr(self.process, "kill", self.process.terminate)()
+        else:
+            try:
+                self.conn.send_bytes(b"")
+            except (IOError, OSError):
+                pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class IsolatedPool(object):
+    """A concurrent.futures.Executor style pool of pre-forked worker processes, see the module docstring. Can be
+    given to a Scheduler as isolation, or used on its own with submit. Call start ahead of time to fork the workers
+    off the firing path; submit starts the pool if it has not been started"""
+
+    def __init__(self, workers=2, max_tasks=None, max_rss_mb=None, timeout=None, preload=()):
+        """Creates a new IsolatedPool
+
+        Args:
+            workers: int number of calls that run at once, each in its own worker process
+
+            max_tasks: int number of calls after which a worker is replaced, None never replaces workers for this
+
+            max_rss_mb: number of megabytes of resident memory after which a worker is replaced once its call
+            returns, None never replaces workers for this
+
+            timeout: float seconds a call may run for before its worker is killed and WorkerTimeoutException is set
+            on its future. None lets calls run for as long as they take
+
+            preload: iterable of module names the forkserver imports once, so that forked workers don't have to
+
+        Raises:
+            ValueError if workers is less than 1
+
+        Returns:
+            A new IsolatedPool
+        """
+        if workers < 1:
+            raise ValueError("An IsolatedPool needs at least 1 worker, got %r" % (workers,))
+        # named like the attribute of concurrent.futures executors, which Scheduler overload policies read
+        self._max_workers = workers
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb is not None else None
+        self._timeout = timeout
+        self._preload = list(preload)
+        # guards everything below, and is notified when a call is submitted or the pool shuts down
+        self._condition = threading.Condition()
+        self._pending = deque()
+        self._threads = list()
+        # threads forking replacement spares
+        self._forking = list()
+        # forked workers not serving calls yet
+        self._spares = Queue()
+        self._function_ids = dict()
+        self._function_counter = itertools.count()
+        self._running = False
+        self._shutdown = False
+        self._context = None
+        # number of workers replaced, because of max_tasks or max_rss_mb, a timeout or a crash
+        self.recycled = 0
+
+    def __repr__(self):
+        return "IsolatedPool(workers=%d, max_tasks=%r, timeout=%r)" % (
+            self._max_workers, self._max_tasks, self._timeout)
+
+    def start(self):
+        """Forks the workers and a spare, unless the pool is already running
+
+        Args:
+
+        Returns:
+        """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._shutdown = False
+        import multiprocessing
+        if self._context is None:
+            methods = multiprocessing.get_all_start_methods()
+            self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if self._preload and "forkserver" in methods:
+                self._context.set_forkserver_preload(self._preload)
+        for _ in range(self._max_workers + 1):
+            self._spares.put(self._fork())
+        for slot in range(self._max_workers):
+            thread = threading.Thread(target=self._serve, name="IsolatedPool-%d" % slot)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, function, *args, **kwargs):
+        """Schedules function(*args, **kwargs) to run in a worker
+
+        Args:
+            function: picklable function, e.g. defined at module level
+
+            args, kwargs: picklable arguments
+
+        Raises:
+            RuntimeError if the pool has been shut down
+
+        Returns:
+            concurrent.futures.Future
+        """
+        from concurrent.futures import Future
+        if not self._running:
+            self.start()
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit to an IsolatedPool that has been shut down")
+            self._pending.append((future, function, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def shutdown(self, wait=True):
+        """Stops the workers once the calls already submitted have run. The pool can be started again afterwards
+
+        Args:
+            wait: bool, whether to wait for the submitted calls to run and the workers to exit
+
+        Returns:
+        """
+        with self._condition:
+            if not self._running:
+                return
+            self._shutdown = True
+            self._condition.notify_all()
+            threads, self._threads = self._threads, list()
+        if not wait:
+            return
+        for thread in threads + self._forking:
+            thread.join()
+        self._forking = list()
+        while not self._spares.empty():
+            self._spares.get().stop()
+        with self._condition:
+            self._running = False
+
+    def _fork(self):
+        """Starts a worker process
+
+        Args:
+
+        Returns:
+            _Worker
+        """
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _fork_spare(self):
+        """Forks a spare worker and loads the functions the pool has been asked to call into it, so the first calls
+        it is given don't have to
+
+        Args:
+
+        Returns:
+        """
+        worker = self._fork()
+        for function, function_id in list(self._function_ids.items()):
+            try:
+                worker.conn.send_bytes(pickle.dumps((function_id, function, None, None), pickle.HIGHEST_PROTOCOL))
+            except (IOError, OSError):
+                break
+            worker.known.add(function_id)
+        self._spares.put(worker)
+
+    def _died(self, worker, future, function):
+        """Sets WorkerDiedException on future and replaces worker, which exited during a call
+
+        Args:
+            worker: _Worker that exited
+
+            future: concurrent.futures.Future of the call
+
+            function: call_function of the call
+
+        Returns:
+            _Worker replacing worker
+        """
+        worker.process.join(1)
+        future.set_exception(WorkerDiedException("Worker %s exited with code %r during a call to %s" % (
+            worker.process.pid, worker.process.exitcode, getattr(function, "__name__", function))))
+        return self._replace(worker, kill=True)
+
+    def _replace(self, worker, kill=False):
+        """Stops worker and takes a spare in its place, forking a new spare in the background
+
+        Args:
+            worker: _Worker to stop
+
+            kill: bool, kill the worker instead of asking it to exit
+
+        Returns:
+            _Worker
+        """
+        worker.stop(kill=kill)
+        self.recycled += 1
+        thread = threading.Thread(target=self._fork_spare)
+        thread.daemon = True
+        thread.start()
+        with self._condition:
+            self._forking = [forking for forking in self._forking if forking.is_alive()]
+            self._forking.append(thread)
+        return self._spares.get()
+
+    def _serve(self):
+        """The loop of a slot thread: runs pending calls on its worker one at a time, until the pool shuts down and
+        nothing is pending"""
+        worker = self._spares.get()
+        while True:
+            with self._condition:
+                while not self._pending and not self._shutdown:
+                    self._condition.wait()
+                if not self._pending:
+                    break
+                future, function, args, kwargs = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            worker = self._call(worker, future, function, args, kwargs)
+        worker.stop()
+
+    def _call(self, worker, future, function, args, kwargs):
+        """Runs one call on worker and sets its outcome on future
+
+        Args:
+            worker: _Worker
+
+            future: concurrent.futures.Future of the call
+
+            function, args, kwargs: the call
+
+        Returns:
+            _Worker to run the next call on, a replacement if worker had to be stopped
+        """
+        function_id = self._function_ids.get(function)
+        if function_id is None:
+            function_id = self._function_ids.setdefault(function, next(self._function_counter))
+        try:
+            message = pickle.dumps((function_id, function if function_id not in worker.known else None, args,
+                                    kwargs), pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            future.set_exception(e)
+            return worker
+        try:
+            worker.conn.send_bytes(message)
+        except (IOError, OSError):
+            # the worker died while it was idle, a fresh one has not been sent anything yet
+            log.warning("IsolatedPool worker %s exited while idle, replacing it", worker.process.pid)
+            worker = self._replace(worker, kill=True)
+            return self._call(worker, future, function, args, kwargs)
+        if function_id not in worker.known:
+            worker.known.add(function_id)
+            try:
+                worker.conn.recv_bytes()
+            except (EOFError, IOError, OSError):
+                return self._died(worker, future, function)
+        if not worker.conn.poll(self._timeout):
+            log.error("Call to %s timed out after %.3fs, killing worker %s", getattr(function, "__name__", function),
+                      self._timeout, worker.process.pid)
+            future.set_exception(WorkerTimeoutException("Call to %s timed out after %rs" % (
+                getattr(function, "__name__", function), self._timeout)))
+            return self._replace(worker, kill=True)
+        try:
+            succeeded, payload, text, rss = pickle.loads(worker.conn.recv_bytes())
+        except (EOFError, IOError, OSError):
+            return self._died(worker, future, function)
+        worker.calls += 1
+        try:
+            value = pickle.loads(payload)
+        except Exception as e:
+            # anything raised here would kill the slot thread and leave the future pending
+            log.error("Could not unpickle the %s of a call to %s: %r", "result" if succeeded else "exception",
+                      getattr(function, "__name__", function), e)
+            succeeded, value = False, WorkerRemoteException("Could not unpickle the %s of a call to %s: %r" % (
+                "result" if succeeded else "exception", getattr(function, "__name__", function), e), text)
+        if succeeded:
+            future.set_result(value)
+        else:
+            if text is not None:
+                value.__cause__ = _RemoteTraceback(text)
+            future.set_exception(value)
+        if self._max_tasks is not None and worker.calls >= self._max_tasks:
+            return self._replace(worker)
+        if self._max_rss is not None and rss > self._max_rss:
+            log.info("IsolatedPool worker %s has grown to %.1fMB, replacing it", worker.process.pid,
+                     rss / 1048576.0)
+            return self._replace(worker)
+        return worker
@@ -0,0 +1,248 @@
+"""Workflows: DAGs of steps, where a step runs once all of the steps it depends on have succeeded"""
+from .task import Task
+from .log import log
+
+try:
+    from queue import Queue
+except ImportError:
+    # python 2.7
+    from Queue import Queue
+
+
+class WorkflowException(Exception):
+    """Raised by Workflow.run when steps failed. Steps downstream of a failed step are skipped
+
+    Attributes:
+        failures: dict of step name -> the exception it raised
+
+        skipped: list of the names of steps that did not run because a step they depend on failed
+
+        results: dict of step name -> return value, for the steps that succeeded
+    """
+
+    def __init__(self, failures, skipped, results):
+        super(WorkflowException, self).__init__("Workflow steps failed: %s (%d downstream steps skipped)" % (
+            ", ".join(sorted(str(name) for name in failures)), len(skipped)))
+        self.failures = failures
+        self.skipped = skipped
+        self.results = results
+
+
+class _Step(object):
+    __slots__ = ("name", "function", "args", "kwargs", "depends_on")
+
+    def __init__(self, name, function, args, kwargs, depends_on):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.depends_on = depends_on
+
+
+class Workflow(object):
+    """A directed acyclic graph of steps. Each step is a function that runs once every step it depends on has
+    succeeded, and is passed their return values. Steps that don't depend on each other run in parallel when
+    run is given a pool.
+
+        workflow = Workflow()
+        workflow.add_step("users", fetch_users)
+        workflow.add_step("orders", fetch_orders)
+        # called as join(users_result, orders_result)
+        workflow.add_step("report", join, depends_on=("users", "orders"))
+        workflow.add_step("email", send_report, depends_on=("report",))
+        workflow.add_step("archive", archive_report, depends_on=("report",))
+        results = workflow.run(workers=4)
+
+    The topological order and the edges are worked out once, the first time the workflow runs after a change, so
+    running the same workflow again (e.g. from a scheduled Task, see as_task) only walks precomputed lists.
+    """
+
+    def __init__(self):
+        self._steps = list()
+        self._index = dict()
+        # (order, upstream, downstream, indegree) lists, computed by _compile
+        self._compiled = None
+
+    def __repr__(self):
+        return "Workflow(%d steps)" % len(self._steps)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def add_step(self, name, function, depends_on=(), args=(), kwargs=None):
+        """Adds a step. Steps can be added in any order, as long as every dependency exists by the time the
+        workflow runs
+
+        Args:
+            name: hashable name of the step, unique within the workflow
+
+            function: called as function(*args, *upstream_results, **kwargs), where upstream_results are the
+            return values of the depends_on steps, in the same order
+
+            depends_on: iterable of the names of the steps that must succeed before this one runs
+
+            args: tuple of positional args passed before the upstream results
+
+            kwargs: dict of keyword args
+
+        Raises:
+            ValueError if a step with this name already exists
+
+        Returns:
+            name, so it can be passed to depends_on
+        """
+        if name in self._index:
+            raise ValueError("Workflow already has a step named %r" % (name,))
+        self._index[name] = len(self._steps)
+        self._steps.append(_Step(name, function, tuple(args), kwargs or dict(), tuple(depends_on)))
+        self._compiled = None
+        return name
+
+    def _compile(self):
+        """Resolves dependencies into indexes and computes a topological order with Kahn's algorithm
+
+        Raises:
+            ValueError if a step depends on a step that does not exist, or the steps form a cycle
+
+        Returns:
+            (order, upstream, downstream, indegree) tuple of lists, indexed by step index
+        """
+        if self._compiled is not None:
+            return self._compiled
+        count = len(self._steps)
+        upstream = list()
+        downstream = [list() for _ in range(count)]
+        for index, step in enumerate(self._steps):
+            try:
+                dependencies = [self._index[name] for name in step.depends_on]
+            except KeyError as e:
+                raise ValueError("Step %r depends on unknown step %r" % (step.name, e.args[0]))
+            upstream.append(dependencies)
+            for dependency in dependencies:
+                downstream[dependency].append(index)
+        indegree = [len(dependencies) for dependencies in upstream]
+        remaining = list(indegree)
+        order = [index for index in range(count) if remaining[index] == 0]
+        # order doubles as the queue of Kahn's algorithm
+        position = 0
+        while position < len(order):
+            for child in downstream[order[position]]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    order.append(child)
+            position += 1
+        if len(order) < count:
+            in_cycle = sorted(str(self._steps[index].name) for index in range(count) if remaining[index] > 0)
+            raise ValueError("Workflow steps form a cycle: %s" % ", ".join(in_cycle))
+        self._compiled = (order, upstream, downstream, indegree)
+        return self._compiled
+
+    def run(self, executor=None, workers=None):
+        """Runs every step once, each after the steps it depends on
+
+        Args:
+            executor: concurrent.futures.Executor to run steps in. Steps whose dependencies are done are all
+            submitted at once, so independent branches run in parallel
+
+            workers: int. If given and executor is not, a ThreadPoolExecutor with this many threads is created
+            for the run. Without either, steps run one after the other in the calling thread, in topological order
+
+        Raises:
+            ValueError if the steps form a cycle or depend on unknown steps
+
+            WorkflowException if any step raised
+
+        Returns:
+            dict of step name -> return value
+        """
+        order, upstream, downstream, indegree = self._compile()
+        if executor is None and workers is not None:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return self.run(executor=pool)
+        results = [None] * len(self._steps)
+        succeeded = [False] * len(self._steps)
+        failures = dict()
+        if executor is None:
+            for index in order:
+                if all(succeeded[dependency] for dependency in upstream[index]):
+                    self._run_step(index, upstream[index], results, succeeded, failures)
+        else:
+            self._run_parallel(executor, upstream, downstream, indegree, results, succeeded, failures)
+        named = dict((step.name, results[index]) for index, step in enumerate(self._steps) if succeeded[index])
+        if failures:
+            skipped = [step.name for step in self._steps if step.name not in named and step.name not in failures]
+            raise WorkflowException(failures, skipped, named)
+        return named
+
+    def _run_step(self, index, dependencies, results, succeeded, failures):
+        step = self._steps[index]
+        try:
+            results[index] = step.function(*(step.args + tuple(results[dependency] for dependency in dependencies)),
+                                           **step.kwargs)
+            succeeded[index] = True
+        except Exception as e:
+            log.exception("Workflow step %r hit exception:", step.name)
+            failures[step.name] = e
+
+    def _run_parallel(self, executor, upstream, downstream, indegree, results, succeeded, failures):
+        """Submits every step whose dependencies have succeeded to executor, and submits its downstream steps as
+        it completes. Steps downstream of a failed step are never submitted
+
+        Args:
+            executor: concurrent.futures.Executor
+
+            upstream, downstream, indegree: see _compile
+
+            results, succeeded, failures: filled in as steps complete
+
+        Returns:
+        """
+        steps = self._steps
+        remaining = list(indegree)
+        # completion callbacks run in the pool's threads, they only hand the future back to this thread
+        completed = Queue()
+
+        def submit(index):
+            step = steps[index]
+            args = step.args + tuple(results[dependency] for dependency in upstream[index])
+            future = executor.submit(step.function, *args, **step.kwargs)
+            future.add_done_callback(lambda future: completed.put((index, future)))
+
+        outstanding = 0
+        for index, count in enumerate(indegree):
+            if count == 0:
+                submit(index)
+                outstanding += 1
+        while outstanding:
+            index, future = completed.get()
+            outstanding -= 1
+            exception = future.exception()
+            if exception is not None:
+                log.error("Workflow step %r hit exception:", steps[index].name,
+                          exc_info=(type(exception), exception, getattr(exception, "__traceback__", None)))
+                failures[steps[index].name] = exception
+                continue
+            results[index] = future.result()
+            succeeded[index] = True
+            for child in downstream[index]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    submit(child)
+                    outstanding += 1
+
+    def as_task(self, frequency_function, executor=None, workers=None, **task_kwargs):
+        """Makes an occasionally.task.Task that runs the whole workflow every frequency_function seconds
+
+        Args:
+            frequency_function: see occasionally.task.Task
+
+            executor, workers: see run
+
+            task_kwargs: other keyword args for occasionally.task.Task, e.g. task_id or just_x_times
+
+        Returns:
+            occasionally.task.Task
+        """
+        return Task(self.run, frequency_function, call_kwargs={"executor": executor, "workers": workers},
+                    **task_kwargs)
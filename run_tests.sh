@@ -12,5 +12,5 @@ rm -rf build dist occasionally.egg-info
 
 python setup.py  bdist_wheel
 pip uninstall --yes occasionally
-pip install dist/occasionally-$version-py2-none-any.whl
+pip install dist/occasionally-$version-py2.py3-none-any.whl
 pytest -v -m "not slow"
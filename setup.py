@@ -5,14 +5,15 @@ def readme():
         return f.read()
 
 setup(name="occasionally",
-        version="v0.0.2",
-        # description="A task scheduling system implemented using only stdlib.",
+        version="0.0.2",
+        description="A task scheduling system implemented using only stdlib.",
         long_description=readme(),
         long_description_content_type='text/markdown',
         classifiers=[
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
         'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
         'Intended Audience :: Developers'
         ],
         url="https://github.com/dleonard203/occasionally",
@@ -20,5 +21,8 @@ setup(name="occasionally",
         keywords="task scheduler",
         license="MIT",
         packages=["occasionally"],
+        entry_points={"console_scripts": ["occasionally = occasionally.__main__:main"]},
+        # one wheel for python 2 and 3, the package has no compiled code
+        options={"bdist_wheel": {"universal": True}},
         zip_safe=True
-)
\ No newline at end of file
+)
@@ -32,3 +32,19 @@ def empty_func():
 @pytest.fixture
 def empty():
     yield empty_func
+
+@pytest.fixture
+def priority_key_min_queue():
+    yield PriorityQueue(key=lambda x: x)
+
+@pytest.fixture
+def priority_key_max_queue():
+    yield PriorityQueue(key=lambda x: -x)
+
+@pytest.fixture
+def small_key_queue():
+    yield PriorityQueue(key=lambda x: x, max_size=2)
+
+@pytest.fixture
+def wheel_scheduler():
+    yield Scheduler(backend="wheel", tick=0.05)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+import pytest
+from occasionally.async_scheduler import AsyncScheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+async def record_lateness(lateness, holder):
+    await asyncio.sleep(0)
+    lateness.append(time.time() - holder[0]._next_invoke)
+
+
+def latency_task(lateness, interval, times, function=record_lateness):
+    holder = list()
+    task = Task(function, after_x_seconds(interval), call_args=(lateness, holder), just_x_times=times)
+    holder.append(task)
+    return task
+
+
+async def raise_value_error():
+    raise ValueError("Error")
+
+
+def test_runs_coroutines_on_time():
+    scheduler = AsyncScheduler()
+    lateness = list()
+    scheduler.add_task(latency_task(lateness, 0.05, 3))
+    scheduler.add_task(latency_task(lateness, 0.12, 2))
+    asyncio.run(scheduler.run())
+    assert len(lateness) == 5
+    assert max(lateness) < 0.05
+
+
+def test_runs_sync_functions_in_executor():
+    scheduler = AsyncScheduler()
+    calls = list()
+    t = Task(time.sleep, after_x_seconds(0.01), call_args=(0.2,), just_x_times=1)
+    fast = Task(calls.append, after_x_seconds(0.05), call_args=(1,), just_x_times=2)
+    scheduler.add_task(t)
+    scheduler.add_task(fast)
+    start = time.time()
+    asyncio.run(scheduler.run())
+    # the blocking sleep does not hold up the loop
+    assert calls == [1, 1]
+    assert t.times_called == 1
+    assert time.time() - start < 0.5
+
+
+def test_many_in_flight():
+    scheduler = AsyncScheduler()
+    done = list()
+
+    async def slow(i):
+        await asyncio.sleep(0.2)
+        done.append(i)
+
+    for i in range(2000):
+        scheduler.add_task(Task(slow, after_x_seconds(0.01), call_args=(i,), just_x_times=1))
+    start = time.time()
+    asyncio.run(scheduler.run())
+    assert len(done) == 2000
+    # all of them sleep concurrently
+    assert time.time() - start < 1.5
+
+
+def test_chaining():
+    scheduler = AsyncScheduler()
+    handled = dict()
+
+    async def mark(name):
+        handled[name] = True
+
+    handler = Task(mark, None, call_args=("handler",))
+    following = Task(handled.__setitem__, None, call_args=("next", True))
+    t = Task(raise_value_error, after_x_seconds(0.01), exception_handler=handler, next_task=following,
+             call_next_task_on_exception=True, just_x_times=1)
+    scheduler.add_task(t)
+    asyncio.run(scheduler.run())
+    assert handled == {"handler": True, "next": True}
+    assert t._unsuccessful_calls == 1
+    assert handler._successful_calls == 1
+
+
+def test_add_task_and_stop_wake_run(empty):
+    scheduler = AsyncScheduler()
+    lateness = list()
+    scheduler.add_task(Task(empty, after_x_seconds(3600)))
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, scheduler.add_task, latency_task(lateness, 0.05, 1))
+        loop.call_later(0.3, scheduler.stop)
+        await scheduler.run()
+
+    start = time.time()
+    asyncio.run(main())
+    assert time.time() - start < 1
+    assert len(lateness) == 1
+    assert lateness[0] < 0.05
+
+
+def test_unknown_reschedule_on():
+    with pytest.raises(ValueError):
+        AsyncScheduler(reschedule_on="never")
@@ -0,0 +1,44 @@
+import threading
+import time
+from occasionally.clock import VirtualClock
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds, on_cron
+
+
+def test_virtual_clock_simulates_a_day():
+    clock = VirtualClock(now=1000000.0)
+    scheduler = Scheduler(clock=clock)
+    runs = list()
+    scheduler.add_task(Task(lambda: runs.append(clock.time()), after_x_seconds(3600), just_x_times=24))
+    started = time.time()
+    scheduler.foreground()
+    assert time.time() - started < 1
+    assert runs == [1000000.0 + 3600 * hour for hour in range(1, 25)]
+
+
+def test_virtual_clock_calendar_schedule():
+    # 00:30 UTC
+    clock = VirtualClock(now=1800.0)
+    scheduler = Scheduler(clock=clock)
+    runs = list()
+    scheduler.add_task(Task(lambda: runs.append(clock.wall()), on_cron("0 */6 * * *"), just_x_times=4))
+    scheduler.foreground()
+    assert runs == [6 * 3600.0, 12 * 3600.0, 18 * 3600.0, 24 * 3600.0]
+
+
+def test_wall_clock_step_does_not_stall_interval_tasks(monkeypatch):
+    scheduler = Scheduler()
+    runs = list()
+    scheduler.add_task(Task(lambda: runs.append(1), after_x_seconds(0.05), just_x_times=2))
+    real_time = time.time
+    # an NTP step back by an hour after the task was scheduled
+    monkeypatch.setattr(time, "time", lambda: real_time() - 3600)
+    thread = threading.Thread(target=scheduler.foreground)
+    thread.start()
+    thread.join(2)
+    stalled = thread.is_alive()
+    scheduler.stop()
+    thread.join(1)
+    assert not stalled
+    assert runs == [1, 1]
@@ -0,0 +1,142 @@
+import threading
+import time
+import pytest
+from occasionally.cluster import Cluster, HashRing, SQLiteLeaseBackend
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def test_hash_ring_moves_few_keys():
+    keys = ["task-%d" % i for i in range(2000)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in keys if before.owner(key) != after.owner(key)]
+    # only keys taken by the new node move, about a quarter of them
+    assert all(after.owner(key) == "d" for key in moved)
+    assert 0.1 < len(moved) / float(len(keys)) < 0.4
+    assert HashRing([]).owner("x") is None
+
+
+def test_sqlite_leases(tmp_path):
+    backend = SQLiteLeaseBackend(str(tmp_path / "leases.db"))
+    assert backend.heartbeat("a", 10) == ["a"]
+    assert backend.heartbeat("b", 10) == ["a", "b"]
+    assert backend.acquire("a", ["s1", "s2"], 10) == {"s1", "s2"}
+    # held by a
+    assert backend.acquire("b", ["s2", "s3"], 10) == {"s3"}
+    backend.release("a", ["s2"])
+    assert backend.acquire("b", ["s2"], 10) == {"s2", "s3"}
+    # an expired lease can be taken over
+    assert backend.acquire("a", ["s4"], -1) == {"s1"}
+    assert backend.acquire("b", ["s4"], 10) == {"s2", "s3", "s4"}
+    backend.leave("b")
+    assert backend.heartbeat("a", 10) == ["a"]
+    assert backend.acquire("a", ["s3"], 10) == {"s1", "s3"}
+
+
+def test_sqlite_lock_timeout_follows_ttl(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "leases.db")
+    backend = SQLiteLeaseBackend(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.time()
+        with pytest.raises(sqlite3.OperationalError):
+            backend.heartbeat("a", 0.4)
+        # gave up after a quarter of the ttl, well before the leases could expire
+        assert time.time() - started < 0.3
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert backend.heartbeat("a", 0.4) == ["a"]
+
+
+class SlowBackend(SQLiteLeaseBackend):
+    delay = 0.0
+
+    def acquire(self, node_id, names, ttl):
+        time.sleep(self.delay)
+        return super(SlowBackend, self).acquire(node_id, names, ttl)
+
+
+def test_cluster_drops_shards_after_late_refresh(tmp_path):
+    backend = SlowBackend(str(tmp_path / "leases.db"))
+    cluster = Cluster(backend, node_id="first", shards=8, ttl=0.3)
+    cluster.refresh()
+    held = cluster.owned
+    assert len(held) == 8
+    backend.delay = 0.4
+    changes = list()
+    cluster.refresh(lambda gained, lost: changes.append((gained, lost)))
+    # the leases expired while acquire was blocked, and the ones it took expired before it returned
+    assert changes == [(frozenset(), held)]
+    assert cluster.owned == frozenset()
+    backend.delay = 0.0
+    cluster.refresh(lambda gained, lost: changes.append((gained, lost)))
+    assert changes[1:] == [(held, frozenset())]
+
+
+def test_cluster_splits_shards_and_fails_over(tmp_path):
+    path = str(tmp_path / "leases.db")
+    first = Cluster(SQLiteLeaseBackend(path), node_id="first", shards=64, ttl=0.5)
+    second = Cluster(SQLiteLeaseBackend(path), node_id="second", shards=64, ttl=0.5)
+    first.refresh()
+    assert len(first.owned) == 64
+    second.refresh()
+    # first still holds the shards the ring moved to second
+    assert len(second.owned) < 64 - len(first.owned) or not second.owned
+    first.refresh()
+    second.refresh()
+    assert not first.owned & second.owned
+    assert len(first.owned | second.owned) == 64
+    assert 0 < len(second.owned) < 64
+    # second stops renewing, first takes its shards once its membership and leases expire
+    time.sleep(0.3)
+    first.refresh()
+    time.sleep(0.3)
+    changes = list()
+    first.refresh(lambda gained, lost: changes.append((gained, lost)))
+    assert len(first.owned) == 64
+    assert changes == [(second.owned, frozenset())]
+
+
+def node(path, node_id, runs):
+    scheduler = Scheduler(cluster=Cluster(SQLiteLeaseBackend(path), node_id=node_id, shards=32, ttl=0.3))
+
+    def record(task_id):
+        runs.append((node_id, task_id, time.time()))
+
+    scheduler.add_tasks([Task(record, after_x_seconds(0.05), call_args=(i,), task_id=i) for i in range(40)])
+    return scheduler
+
+
+def test_scheduler_runs_each_task_on_one_node(tmp_path):
+    path = str(tmp_path / "leases.db")
+    runs = list()
+    schedulers = [node(path, "first", runs), node(path, "second", runs)]
+    # settle the ring before running anything
+    for _ in range(2):
+        for scheduler in schedulers:
+            scheduler._cluster.refresh(scheduler._on_shards_changed)
+    threads = [threading.Thread(target=scheduler.foreground) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    schedulers[1].stop()
+    threads[1].join(2)
+    stopped = time.time()
+    time.sleep(0.5)
+    schedulers[0].stop()
+    threads[0].join(2)
+    owners = dict()
+    for node_id, task_id, ran in runs:
+        if ran < stopped:
+            owners.setdefault(task_id, set()).add(node_id)
+    # every task ran, each on only one node, and both nodes ran tasks
+    assert sorted(owners) == list(range(40))
+    assert all(len(nodes) == 1 for nodes in owners.values())
+    assert set().union(*owners.values()) == {"first", "second"}
+    # once second left, first ran all of the tasks
+    assert set(task_id for node_id, task_id, ran in runs if ran > stopped + 0.3) == set(range(40))
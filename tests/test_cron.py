@@ -0,0 +1,122 @@
+import datetime
+import random
+import pytest
+from occasionally.cron import CronSchedule, AnchoredInterval, _parse_field, _FIELDS
+from occasionally.task import Task
+from occasionally.time_helpers import every_x_seconds, on_cron, daily_at
+
+UTC = datetime.timezone.utc
+
+
+def timestamp(*args, **kwargs):
+    return datetime.datetime(*args, tzinfo=kwargs.get("tz", UTC)).timestamp()
+
+
+def brute_force_next_fire(schedule, after):
+    # steps minute by minute, like a naive implementation would
+    fields = schedule._expression.split()
+    masks = [_parse_field(text, *limits) for text, limits in zip(fields, _FIELDS)]
+    # 7 is also sunday
+    masks[4] |= masks[4] >> 7
+    wall = datetime.datetime.fromtimestamp(after, UTC).replace(second=0, microsecond=0)
+    while True:
+        wall += datetime.timedelta(minutes=1)
+        values = (wall.minute, wall.hour, wall.day, wall.month, (wall.weekday() + 1) % 7)
+        matches = [mask >> value & 1 for mask, value in zip(masks, values)]
+        if not fields[2].startswith("*") and not fields[4].startswith("*"):
+            day_matches = matches[2] or matches[4]
+        else:
+            day_matches = matches[2] and matches[4]
+        if matches[0] and matches[1] and matches[3] and day_matches:
+            return wall.timestamp()
+
+
+@pytest.mark.parametrize("expression, after, expected", [
+    ("*/15 * * * *", timestamp(2024, 5, 1, 10, 7, 30), timestamp(2024, 5, 1, 10, 15)),
+    ("*/15 * * * *", timestamp(2024, 5, 1, 10, 15), timestamp(2024, 5, 1, 10, 30)),
+    # friday afternoon to monday morning
+    ("0 9 * * mon-fri", timestamp(2024, 5, 3, 10), timestamp(2024, 5, 6, 9)),
+    ("@yearly", timestamp(2024, 5, 1), timestamp(2025, 1, 1)),
+    ("0 0 29 2 *", timestamp(2021, 1, 1), timestamp(2024, 2, 29)),
+    # day of month or day of week: the 13th, or any friday
+    ("0 0 13 * fri", timestamp(2024, 9, 1), timestamp(2024, 9, 6)),
+    ("59 23 31 dec *", timestamp(2024, 1, 1), timestamp(2024, 12, 31, 23, 59)),
+    ("0 0 * * 7", timestamp(2024, 5, 1), timestamp(2024, 5, 5)),
+    # a * field with a step still restricts: every other day of the week, thursday to saturday
+    ("0 0 * * */2", timestamp(2024, 5, 2, 1), timestamp(2024, 5, 4)),
+    # the 1st, 12th or 23rd, and a monday
+    ("0 0 */11 * 1", timestamp(2024, 5, 1), timestamp(2024, 7, 1)),
+])
+def test_next_fire(expression, after, expected):
+    assert CronSchedule(expression, tz=UTC).next_fire(after) == expected
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "0 0 30 2 *", "*/0 * * * *", "5-1 * * * *",
+                                        "0 0 * foo *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_matches_brute_force():
+    rng = random.Random(11)
+    expressions = ["*/7 */5 * * *", "0 12 1,15 * *", "30 6 * * sat,sun", "15 4-6 10-20 */2 1-3", "0 0 31 * *",
+                   "5/20 * * jun-aug *", "0 22 * * 5", "0 0 * * */2", "0 0 */11 * 1", "30 1 */3 * mon-fri"]
+    for expression in expressions:
+        schedule = CronSchedule(expression, tz=UTC)
+        after = timestamp(2024, 1, 1)
+        for _ in range(10):
+            after += rng.uniform(0, 5 * 86400)
+            assert schedule.next_fire(after) == brute_force_next_fire(schedule, after), (expression, after)
+
+
+def test_dst():
+    zoneinfo = pytest.importorskip("zoneinfo")
+    try:
+        new_york = zoneinfo.ZoneInfo("America/New_York")
+    except zoneinfo.ZoneInfoNotFoundError:
+        pytest.skip("no time zone database")
+    # 2:30 does not exist on 2024-03-10, it runs at 3:30 daylight time instead
+    schedule = CronSchedule("30 2 * * *", tz=new_york)
+    fire = schedule.next_fire(timestamp(2024, 3, 10, tz=new_york))
+    assert fire == timestamp(2024, 3, 10, 3, 30, tz=new_york)
+    assert schedule.next_fire(fire) == timestamp(2024, 3, 11, 2, 30, tz=new_york)
+    # 9:00 stays at 9:00 local time across the change
+    schedule = CronSchedule("0 9 * * *", tz=new_york)
+    assert schedule.next_fire(timestamp(2024, 3, 9, 9, tz=new_york)) - timestamp(2024, 3, 9, 9, tz=new_york) == 23 * 3600
+    # 1:30 happens twice on 2024-11-03, a fixed time runs once
+    schedule = CronSchedule("30 1 * * *", tz=new_york)
+    fire = schedule.next_fire(timestamp(2024, 11, 3, tz=new_york))
+    assert schedule.next_fire(fire) == timestamp(2024, 11, 4, 1, 30, tz=new_york)
+    # but an hourly schedule runs in both passes of the repeated hour
+    schedule = CronSchedule("30 * * * *", tz=new_york)
+    first = schedule.next_fire(timestamp(2024, 11, 3, 1, tz=new_york))
+    second = schedule.next_fire(first)
+    assert second - first == 3600
+    assert schedule.next_fire(second) - second == 3600
+
+
+def test_anchored_interval():
+    schedule = AnchoredInterval(10, anchor=3)
+    assert schedule.next_fire(3) == 13
+    assert schedule.next_fire(12.5) == 13
+    assert schedule.next_fire(1000) == 1003
+    with pytest.raises(ValueError):
+        AnchoredInterval(0)
+
+
+def test_task_does_not_drift(empty):
+    task = Task(empty, every_x_seconds(10))
+    for _ in range(3):
+        task.invoke()
+        task.set_next_invoke()
+        # always on the 10 second grid, however long the run took
+        assert task._next_invoke % 10 == 0
+
+
+def test_schedules_are_interned():
+    assert on_cron("@hourly") is on_cron("@hourly")
+    assert daily_at(9, 30, weekdays=["mon"]) is on_cron("30 9 * * mon")
+    assert every_x_seconds(5) is every_x_seconds(5)
+    assert every_x_seconds(5) is not every_x_seconds(5, anchor=1)
+    assert 0 < on_cron("* * * * *")() <= 60
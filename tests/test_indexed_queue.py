@@ -0,0 +1,71 @@
+import random
+import pytest
+from occasionally.indexed_queue import IndexedPriorityQueue
+from occasionally.priority_queue import QueueEmptyException, QueueFullException
+
+
+class Item(object):
+    __slots__ = ("key", "_queue_index")
+
+    def __init__(self, key):
+        self.key = key
+        self._queue_index = None
+
+
+def item_key(item):
+    return item.key
+
+
+def check(queue):
+    heap = queue._heap
+    for index, entry in enumerate(heap):
+        assert entry[-1]._queue_index == index
+        if index:
+            assert not entry < heap[(index - 1) // 2]
+
+
+def test_matches_reference_under_random_operations():
+    rng = random.Random(1)
+    queue = IndexedPriorityQueue(item_key)
+    reference = set()
+    for _ in range(5000):
+        action = rng.random()
+        if not reference or action < 0.4:
+            item = Item(rng.randrange(1000))
+            queue.enqueue(item)
+            reference.add(item)
+        elif action < 0.6:
+            item = queue.dequeue()
+            assert item.key == min(queued.key for queued in reference)
+            reference.remove(item)
+        elif action < 0.8:
+            item = rng.choice(list(reference))
+            item.key = rng.randrange(1000)
+            assert queue.update(item)
+        else:
+            item = rng.choice(list(reference))
+            assert queue.remove(item)
+            assert item not in queue
+            reference.remove(item)
+        check(queue)
+    assert len(queue) == len(reference)
+    assert [item.key for item in queue.sorted_view()] == sorted(item.key for item in reference)
+
+
+def test_bulk_operations():
+    queue = IndexedPriorityQueue(item_key, max_size=10)
+    items = [Item(key) for key in (5, 3, 8, 1, 9, 2)]
+    queue.enqueue_many(items)
+    check(queue)
+    assert [item.key for item in queue.dequeue_up_to(3)] == [1, 2, 3]
+    assert queue.remove_where(lambda item: item.key > 8)[0].key == 9
+    check(queue)
+    assert [item.key for item in queue.sorted_view()] == [5, 8]
+    assert not queue.remove(items[3])
+    queue.set_max_size(1)
+    assert [item.key for item in queue.sorted_view()] == [5]
+    with pytest.raises(QueueFullException):
+        queue.enqueue(Item(0))
+    queue.dequeue()
+    with pytest.raises(QueueEmptyException):
+        queue.peek()
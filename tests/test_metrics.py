@@ -0,0 +1,122 @@
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+import pytest
+from occasionally.metrics import Histogram, Metrics, PER_TASK_ID
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def raise_exception():
+    raise Exception("Error")
+
+
+def test_histogram():
+    h = Histogram(bounds=(1, 2, 4))
+    assert h.quantile(0.5) is None
+    for value in (0.5, 1, 1.5, 3, 3, 10):
+        h.observe(value)
+    snapshot = h.snapshot()
+    assert snapshot["count"] == 6
+    assert snapshot["sum"] == 19
+    # cumulative, values equal to a bound fall in that bound's bucket
+    assert snapshot["buckets"] == [(1, 2), (2, 3), (4, 5), (float("inf"), 6)]
+    assert h.quantile(0.5) == 2
+    assert h.quantile(1) == float("inf")
+
+
+@pytest.mark.parametrize("execution", ["inline", "thread"])
+def test_scheduler_metrics(execution, empty):
+    metrics = Metrics(per_task=PER_TASK_ID, sample_every=1)
+    scheduler = Scheduler(metrics=metrics, execution=execution)
+    # both run immediately, so the first two runs are back to back and time in the queue is measured
+    scheduler.add_task(Task(empty, after_x_seconds(0.01), just_x_times=3, task_id="ok", schedule_immediately=True))
+    scheduler.add_task(Task(raise_exception, after_x_seconds(0.01), just_x_times=2, schedule_immediately=True))
+    scheduler.foreground()
+    snapshot = metrics.snapshot()
+    assert snapshot["totals"]["successes"] == 3
+    assert snapshot["totals"]["failures"] == 2
+    assert snapshot["totals"]["invoke_latency"]["count"] == 5
+    assert snapshot["totals"]["invoke_latency"]["p99"] < 0.05
+    assert snapshot["tasks"]["ok"]["successes"] == 3
+    # grouped by call_function name without a task_id
+    assert snapshot["tasks"]["raise_exception"]["failures"] == 2
+    assert snapshot["queue_depth"] == 0
+    assert snapshot["heap_time"] > 0
+    assert snapshot["user_time"] > 0
+
+
+def test_metrics_per_function(empty):
+    metrics = Metrics(sample_every=1)
+    scheduler = Scheduler(metrics=metrics)
+    scheduler.add_tasks([Task(empty, after_x_seconds(0), just_x_times=2, task_id=i) for i in range(100)])
+    scheduler.foreground()
+    # grouped by call_function name, not one per task_id
+    assert list(metrics.snapshot()["tasks"]) == ["empty_func"]
+    assert metrics.snapshot()["tasks"]["empty_func"]["successes"] == 200
+    with pytest.raises(ValueError):
+        Metrics(per_task="tenant")
+
+
+def test_sampled_metrics(empty):
+    metrics = Metrics(sample_every=4)
+    scheduler = Scheduler(metrics=metrics)
+    scheduler.add_task(Task(empty, after_x_seconds(0), just_x_times=10))
+    scheduler.foreground()
+    snapshot = metrics.snapshot()
+    assert snapshot["totals"]["successes"] == 10
+    # runs 1, 5 and 9 are timed
+    assert snapshot["totals"]["call_duration"]["count"] == 3
+    assert snapshot["tasks"]["empty_func"]["successes"] == 3
+    # from the end of runs 4 and 8 to the start of runs 5 and 9
+    assert snapshot["heap_time"] > 0
+    assert Metrics().sample_every == 16
+    metrics = Metrics(sample_every=4)
+    scheduler = Scheduler(metrics=metrics)
+    scheduler.add_task(Task(raise_exception, after_x_seconds(0), just_x_times=7))
+    scheduler.foreground()
+    # the runs after the last timed one are counted when foreground returns
+    assert metrics.snapshot()["totals"]["failures"] == 7
+
+
+def test_counts_while_snapshotting(empty):
+    import threading
+    metrics = Metrics(sample_every=4)
+    scheduler = Scheduler(metrics=metrics)
+    scheduler.add_task(Task(empty, after_x_seconds(0), just_x_times=20000))
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            metrics.snapshot()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        scheduler.foreground()
+    finally:
+        done.set()
+        reader.join()
+    assert metrics.snapshot()["totals"]["successes"] == 20000
+
+
+def test_prometheus_text_served(empty):
+    metrics = Metrics(per_task=PER_TASK_ID)
+    scheduler = Scheduler(metrics=metrics)
+    scheduler.add_task(Task(empty, after_x_seconds(0.01), just_x_times=1, task_id='quo"te'))
+    scheduler.foreground()
+    scheduler.add_task(Task(empty, after_x_seconds(3600)))
+    server = metrics.serve()
+    try:
+        text = urlopen("http://%s:%d/metrics" % server.server_address).read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert text == metrics.prometheus_text()
+    assert "# TYPE occasionally_invoke_latency_seconds histogram" in text
+    assert 'occasionally_calls_total{outcome="success"} 1' in text
+    assert 'occasionally_calls_total{task="quo\\"te",outcome="success"} 1' in text
+    assert 'occasionally_call_duration_seconds_bucket{task="quo\\"te",le="+Inf"} 1' in text
+    assert "occasionally_call_duration_seconds_count 1" in text
+    assert "occasionally_queue_depth 1" in text
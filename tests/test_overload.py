@@ -0,0 +1,111 @@
+import threading
+import time
+from occasionally.overload import (CoalesceMissedRuns, ShedLowestPriority, SkipMissedRuns,
+                                   StretchFrequencies)
+from occasionally.scheduler import Scheduler, INBOX_PRODUCERS, THREAD_EXECUTION, RESCHEDULE_ON_DISPATCH
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def test_skip_missed_runs():
+    overload = SkipMissedRuns(max_lag=0.1)
+    scheduler = Scheduler(overload=overload)
+    runs = list()
+    # holds up foreground for longer than max_lag, so the next run of the other task is skipped
+    scheduler.add_task(Task(time.sleep, after_x_seconds(0), call_args=(0.3,), schedule_immediately=True,
+                            just_x_times=1))
+    scheduler.add_task(Task(lambda: runs.append(time.time()), after_x_seconds(0.05), just_x_times=3))
+    started = time.time()
+    scheduler.foreground()
+    assert overload.skipped == 1
+    assert len(runs) == 3
+    # the skipped run was rescheduled from when the slow task finished, not worked through
+    assert runs[0] - started > 0.3
+
+
+def shed_levels(overload, lag):
+    overload.lag = lag
+    overload._adjusted_at = 0
+    overload._observe(lag, time.time())
+    return overload.shedding_below
+
+
+def test_shed_lowest_priority_levels():
+    overload = ShedLowestPriority(max_lag=1.0, smoothing=1.0)
+    tasks = [Task(len, None, priority=priority) for priority in (0, 1, 2)]
+    assert all(overload.admit(task, 0) for task in tasks)
+    assert shed_levels(overload, 5.0) == 1
+    assert [overload.admit(task, 0) for task in tasks] == [False, True, True]
+    assert shed_levels(overload, 5.0) == 2
+    # the highest priority is never shed
+    assert shed_levels(overload, 5.0) == 2
+    assert shed_levels(overload, 0.7) == 2
+    assert shed_levels(overload, 0.1) == 1
+    assert shed_levels(overload, 0.1) is None
+
+
+def test_shed_task_waits_for_its_frequency():
+    overload = ShedLowestPriority(max_lag=100.0)
+    scheduler = Scheduler(overload=overload)
+    low = Task(len, after_x_seconds(60), call_args=("",), priority=0, schedule_immediately=True)
+    high = Task(len, after_x_seconds(60), call_args=("",), priority=1)
+    scheduler.add_tasks([low, high])
+    assert overload.admit(high, 0) and overload.admit(low, 0)
+    overload._shed_level = 1
+    overload._adjusted_at = scheduler.clock.time()
+    with scheduler._condition:
+        assert scheduler.dequeue() is low
+        assert not scheduler._admit(low, 0.0)
+        scheduler._reschedule(low)
+    # the skipped immediate run is not due again right away, which would shed it again on every pass
+    assert low._next_invoke >= scheduler.clock.time() + 59
+    assert scheduler.peek() is high
+    assert low.times_called == 0
+
+
+def test_full_queue_drops_instead_of_raising():
+    frequency = after_x_seconds(3600)
+    overload = ShedLowestPriority()
+    for policy, kept in ((None, [0, 2]), (overload, [2, 1])):
+        scheduler = Scheduler(max_size=2, producers=INBOX_PRODUCERS, overload=policy)
+        scheduler.add_tasks([Task(len, frequency, priority=priority) for priority in (0, 2, 1)])
+        # what foreground does before running anything
+        with scheduler._condition:
+            scheduler._drain_inbox()
+        assert sorted(task.priority for task in scheduler.sorted_view()) == sorted(kept)
+    assert overload.shed == 1
+
+
+def test_stretch_frequencies():
+    overload = StretchFrequencies(max_lag=1.0, smoothing=1.0, step=2.0, max_stretch=3.0)
+    assert overload.stretch(None, 10) == 10
+    for factor in (2.0, 3.0, 3.0):
+        overload._adjusted_at = 0
+        overload._observe(5.0, time.time())
+        assert overload.factor == factor
+    scheduler = Scheduler(overload=overload)
+    task = Task(len, after_x_seconds(10), call_args=("",))
+    scheduler.add_task(task)
+    with scheduler._condition:
+        scheduler._reschedule(scheduler.dequeue())
+    assert 29 < task._next_invoke - time.time() <= 30
+
+
+def test_coalesce_missed_runs_in_pool():
+    overload = CoalesceMissedRuns(max_lag=0.05, smoothing=1.0)
+    scheduler = Scheduler(execution=THREAD_EXECUTION, workers=1, reschedule_on=RESCHEDULE_ON_DISPATCH,
+                          overload=overload)
+    runs = list()
+
+    def slow():
+        runs.append(time.time())
+        time.sleep(0.05)
+
+    # handed to the pool five times as often as the pool can run it
+    scheduler.add_task(Task(slow, after_x_seconds(0.01)))
+    timer = threading.Timer(1.0, scheduler.stop)
+    timer.start()
+    scheduler.foreground(run_forever=True)
+    assert overload.skipped > 0
+    # without the policy ~100 runs would have piled up in the pool, taking ~5s to work through
+    assert len(runs) < 50
@@ -44,3 +44,125 @@ def test_queue_full_insert_error_raises(small_max_queue):
     # sort empties the queue
     sort_results = small_max_queue.queue_sort()
     assert sort_results == [1, 1]
+
+
+def test_priority_key_min_queue(priority_key_min_queue):
+    for val in (5, 1, -500, -200, 7):
+        priority_key_min_queue.enqueue(val)
+    assert priority_key_min_queue.peek() == -500
+    assert len(priority_key_min_queue) == 5
+    assert priority_key_min_queue.dequeue() == -500
+    assert priority_key_min_queue.queue_sort() == [-200, 1, 5, 7]
+    assert len(priority_key_min_queue) == 0
+
+
+def test_priority_key_max_queue(priority_key_max_queue):
+    for val in (10, 30, 20):
+        priority_key_max_queue.enqueue(val)
+    assert [priority_key_max_queue.dequeue() for _ in range(3)] == [30, 20, 10]
+
+
+def test_key_engine_ties_are_fifo():
+    q = occasionally.priority_queue.PriorityQueue(key=lambda x: x[0])
+    # dicts are not orderable, so the elements themselves must never be compared
+    first, second, third = (1, {"n": 1}), (1, {"n": 2}), (0, {"n": 3})
+    for item in (first, second, third):
+        q.enqueue(item)
+    assert q.dequeue() is third
+    assert q.dequeue() is first
+    assert q.dequeue() is second
+
+
+def test_key_engine_matches_comparator_engine(priority_min_queue, priority_key_min_queue):
+    values = [(i * 7919) % 1009 for i in range(500)]
+    for val in values:
+        priority_min_queue.enqueue(val)
+        priority_key_min_queue.enqueue(val)
+    assert priority_key_min_queue.queue_sort() == priority_min_queue.queue_sort() == sorted(values)
+
+
+def test_key_engine_errors(small_key_queue):
+    with pytest.raises(occasionally.priority_queue.QueueEmptyException):
+        small_key_queue.dequeue()
+    with pytest.raises(occasionally.priority_queue.QueueEmptyException):
+        small_key_queue.peek()
+    small_key_queue.enqueue(1)
+    small_key_queue.enqueue(1)
+    with pytest.raises(occasionally.priority_queue.QueueFullException):
+        small_key_queue.enqueue(1)
+
+
+def test_engine_selection_requires_exactly_one():
+    with pytest.raises(ValueError):
+        occasionally.priority_queue.PriorityQueue()
+    with pytest.raises(ValueError):
+        occasionally.priority_queue.PriorityQueue(lambda x, y: x, key=lambda x: x)
+
+
+def test_enqueue_many(priority_min_queue, priority_key_min_queue):
+    values = [(i * 7919) % 1009 for i in range(500)]
+    for q in (priority_min_queue, priority_key_min_queue):
+        q.enqueue(3)
+        q.enqueue_many(values)
+        # fewer items than already queued are pushed one by one
+        q.enqueue_many([0, -1])
+        assert q.queue_sort() == sorted(values + [3, 0, -1])
+
+
+def test_enqueue_many_full(small_key_queue, small_max_queue):
+    for q in (small_key_queue, small_max_queue):
+        q.enqueue(1)
+        with pytest.raises(occasionally.priority_queue.QueueFullException):
+            q.enqueue_many([2, 3])
+        # nothing was inserted
+        assert q.queue_sort() == [1]
+
+
+def test_remove_where(priority_min_queue, priority_key_min_queue):
+    for q in (priority_min_queue, priority_key_min_queue):
+        q.enqueue_many(range(20))
+        removed = q.remove_where(lambda x: x % 3 == 0)
+        assert sorted(removed) == [0, 3, 6, 9, 12, 15, 18]
+        assert q.queue_sort() == [x for x in range(20) if x % 3]
+
+
+def test_dequeue_up_to(priority_key_min_queue, priority_min_queue):
+    q = priority_key_min_queue
+    values = [(i * 37) % 101 for i in range(100)]
+    q.enqueue_many(values)
+    # a few due elements are popped, many are split off in one pass
+    assert q.dequeue_up_to(2) == [0, 1, 2]
+    assert q.dequeue_up_to(60) == list(range(3, 61))
+    assert q.dequeue_up_to(-1) == []
+    assert list(q.sorted_view()) == sorted(v for v in values if v > 60)
+    assert q.dequeue() == 61
+    with pytest.raises(ValueError):
+        priority_min_queue.dequeue_up_to(1)
+
+
+def test_sorted_view_does_not_modify(priority_max_queue, priority_key_min_queue):
+    values = [4, 0, 9, 2, 7]
+    for q, expected in ((priority_max_queue, [9, 7, 4, 2, 0]), (priority_key_min_queue, [0, 2, 4, 7, 9])):
+        q.enqueue_many(values)
+        view = q.sorted_view()
+        assert next(view) == expected[0]
+        # mutating the queue does not affect a view that was already taken
+        q.dequeue()
+        assert list(view) == expected[1:]
+        assert len(q) == 4
+        assert list(q.sorted_view()) == expected[1:]
+
+
+def test_set_max_size_trims_lowest_priority(priority_max_queue, priority_key_min_queue):
+    values = [(i * 37) % 101 for i in range(100)]
+    for q, expected in ((priority_max_queue, sorted(values, reverse=True)), (priority_key_min_queue, sorted(values))):
+        q.enqueue_many(values)
+        # growing the max size keeps everything
+        q.set_max_size(1000)
+        assert len(q) == 100
+        q.set_max_size(10)
+        assert list(q.sorted_view()) == expected[:10]
+        with pytest.raises(occasionally.priority_queue.QueueFullException):
+            q.enqueue(0)
+        # dequeue still works on the trimmed heap
+        assert q.dequeue() == expected[0]
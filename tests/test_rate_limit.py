@@ -0,0 +1,46 @@
+import pytest
+from occasionally.clock import VirtualClock
+from occasionally.rate_limit import TokenBucket
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds, every_x_seconds
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert [bucket._reserve(0.0) for _ in range(4)] == [0.0, 0.0, pytest.approx(0.1), pytest.approx(0.2)]
+    assert bucket.deferred == 2
+    # pays off the debt, then fills up to burst
+    assert bucket._reserve(1.0) == 0.0
+    assert bucket._tokens == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+@pytest.mark.parametrize("options", [dict(), dict(coalesce=True), dict(fair=True)])
+def test_rate_limit_spreads_aligned_tasks(options):
+    clock = VirtualClock(now=0.0)
+    runs = list()
+    scheduler = Scheduler(clock=clock, rate_limits={"db": TokenBucket(rate=10)}, **options)
+    scheduler.add_tasks([Task(lambda: runs.append(clock.now), after_x_seconds(60), schedule_immediately=True,
+                              just_x_times=1, tag="db") for _ in range(20)])
+    untagged = list()
+    scheduler.add_task(Task(lambda: untagged.append(clock.now), after_x_seconds(60), schedule_immediately=True,
+                            just_x_times=1))
+    scheduler.foreground()
+    assert runs == [pytest.approx(i * 0.1) for i in range(20)]
+    assert untagged == [0.0]
+
+
+def test_scheduler_spread():
+    clock = VirtualClock(now=0.0)
+    runs = list()
+    scheduler = Scheduler(clock=clock, spread=60)
+    scheduler.add_tasks([Task(lambda: runs.append(clock.now), every_x_seconds(60), task_id=i, just_x_times=2)
+                         for i in range(50)])
+    scheduler.foreground()
+    first, second = sorted(runs[:50]), sorted(runs[50:])
+    assert 60 <= first[0] and first[-1] < 120
+    assert len(set(first)) == 50
+    # calendar runs stay on the grid, shifted by the same phase
+    assert second == [run + 60 for run in first]
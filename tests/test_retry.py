@@ -0,0 +1,97 @@
+import pytest
+from occasionally.clock import VirtualClock
+from occasionally.retry import RetryPolicy, CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+def test_retry_backoff():
+    clock = VirtualClock(now=0.0)
+    runs = list()
+
+    def flaky():
+        runs.append(clock.now)
+        if len(runs) <= 4:
+            raise RuntimeError("unavailable")
+
+    retry = RetryPolicy(max_attempts=3, base_delay=1, multiplier=2, jitter=0)
+    scheduler = Scheduler(clock=clock)
+    task = Task(flaky, after_x_seconds(100), retry=retry, just_x_times=6)
+    scheduler.add_task(task)
+    scheduler.foreground()
+    # 3 attempts 1s and 2s apart, then the frequency, then a new round of attempts until one succeeds
+    assert runs == [100, 101, 103, 203, 204, 304]
+    assert task.failures == 0
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=1)
+
+
+def test_retry_jitter():
+    retry = RetryPolicy(base_delay=10, multiplier=3, max_delay=60)
+    assert all(5 <= retry.delay(1) <= 10 for _ in range(50))
+    assert all(30 <= retry.delay(3) <= 60 for _ in range(50))
+
+
+def test_circuit_breaker(empty):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    first, second, third = [Task(empty, after_x_seconds(60)) for _ in range(3)]
+    assert breaker._record(True, 0.0) == () and breaker.state == CLOSED
+    breaker._record(True, 1.0)
+    assert breaker.state == OPEN and breaker.retry_at == 11.0
+    assert not breaker._allow(5.0)
+    # the first task held back comes due again for the trial, the others wait
+    assert breaker._hold(first) is first and first._next_invoke == 11.0
+    assert breaker._hold(second) is None and breaker._hold(third) is None
+    assert breaker._allow(11.0) and breaker.state == HALF_OPEN
+    # the trial failed, a held task is queued for the next one
+    assert breaker._record(True, 11.0) == [third] and third._next_invoke == 21.0
+    assert breaker.state == OPEN and breaker.trips == 2
+    assert breaker._hold(first) is None
+    assert breaker._allow(21.0)
+    assert breaker._record(False, 21.0) == [second, first]
+    assert breaker.state == CLOSED and breaker.retry_at is None
+
+
+@pytest.mark.parametrize("options", [dict(), dict(fair=True)])
+def test_circuit_breaker_holds_tasks(options):
+    clock = VirtualClock(now=0.0)
+    calls = list()
+    state = dict(up=False)
+
+    def query(i):
+        calls.append((i, clock.now))
+        if not state["up"]:
+            raise RuntimeError("database is down")
+
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    scheduler = Scheduler(clock=clock, circuit_breakers={"db": breaker}, **options)
+    scheduler.add_tasks([Task(query, after_x_seconds(10), call_args=(i,), tag="db", just_x_times=2)
+                         for i in range(10)])
+    untagged = list()
+    scheduler.add_task(Task(lambda: untagged.append(clock.now), after_x_seconds(10), just_x_times=2))
+    scheduler.add_task(Task(lambda: state.update(up=True), after_x_seconds(45), just_x_times=1))
+    scheduler.foreground()
+    # 3 failures open the breaker, the trial at 40 fails, the one at 70 succeeds and releases the others
+    assert [at for _, at in calls[:5]] == [10, 10, 10, 40, 70]
+    assert breaker.state == CLOSED and breaker.trips == 2
+    assert sorted(i for i, _ in calls) == sorted(list(range(10)) * 2)
+    assert untagged == [10, 20]
+
+
+def test_circuit_breaker_coalesce():
+    clock = VirtualClock(now=0.0)
+    calls = list()
+
+    def query():
+        calls.append(clock.now)
+        raise RuntimeError("database is down")
+
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    scheduler = Scheduler(clock=clock, coalesce=True, circuit_breakers={"db": breaker})
+    scheduler.add_tasks([Task(query, after_x_seconds(10), tag="db", just_x_times=3) for _ in range(10)])
+    scheduler.add_task(Task(scheduler.stop, after_x_seconds(90), just_x_times=1))
+    scheduler.foreground()
+    # the tasks due together run together, then only the trials run
+    assert calls == [10] * 10 + [40, 70]
+    assert breaker.state == OPEN
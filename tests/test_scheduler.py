@@ -1,7 +1,9 @@
+import threading
 import time
 import pytest
-from occasionally.scheduler import Scheduler
-from occasionally.task import Task
+from occasionally.priority_queue import QueueFullException
+from occasionally.scheduler import Scheduler, LOCKED_PRODUCERS, INBOX_PRODUCERS
+from occasionally.task import Task, batch_capable
 from occasionally.time_helpers import after_x_seconds
 
 
@@ -44,5 +46,539 @@ def test_scheduler_foreground_frequency(scheduler):
     for index in range(4):
         this = mutable_obj[index]
         nxt = mutable_obj[index + 1]
-        # task called once per second with .5 seconds sleep and .1 execution time leighway
-        assert nxt - this < 1.6
\ No newline at end of file
+        # task called once per second with .1 execution time leighway
+        assert nxt - this < 1.1
+
+def test_wheel_scheduler_foreground(wheel_scheduler, empty):
+    t1 = Task(empty, after_x_seconds(0.1), just_x_times=2)
+    t2 = Task(empty, after_x_seconds(0.2), just_x_times=2)
+    wheel_scheduler.add_task(t1)
+    wheel_scheduler.add_task(t2)
+    assert len(wheel_scheduler) == 2
+    assert wheel_scheduler.peek() is t1
+    wheel_scheduler.foreground()
+    assert t1.times_called == 2
+    assert t2.times_called == 2
+    assert len(wheel_scheduler) == 0
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Scheduler(backend="list")
+
+
+def record_lateness(lateness, get_task):
+    # how long after its scheduled time the task actually fired
+    lateness.append(time.time() - get_task()._next_invoke)
+
+
+def latency_task(lateness, interval, times):
+    holder = list()
+    task = Task(record_lateness, after_x_seconds(interval), call_args=(lateness, lambda: holder[0]),
+                just_x_times=times)
+    holder.append(task)
+    return task
+
+
+def run_in_thread(scheduler, **kwargs):
+    thread = threading.Thread(target=scheduler.foreground, kwargs=kwargs)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def test_foreground_latency(scheduler):
+    lateness = list()
+    scheduler.add_task(latency_task(lateness, 0.15, 3))
+    scheduler.add_task(latency_task(lateness, 0.07, 3))
+    scheduler.foreground()
+    assert len(lateness) == 6
+    # the scheduler waits until each task is due instead of polling, so tasks fire well under a poll interval late
+    assert max(lateness) < 0.05
+    assert min(lateness) >= 0
+
+
+def test_add_task_wakes_foreground(scheduler, empty):
+    lateness = list()
+    scheduler.add_task(Task(empty, after_x_seconds(3600)))
+    thread = run_in_thread(scheduler)
+    time.sleep(0.05)
+    # the scheduler is waiting an hour for the first task, adding a sooner one must wake it up
+    scheduler.add_task(latency_task(lateness, 0.1, 1))
+    time.sleep(0.3)
+    scheduler.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert len(lateness) == 1
+    assert lateness[0] < 0.05
+
+
+def test_stop_wakes_foreground(scheduler, empty):
+    scheduler.add_task(Task(empty, after_x_seconds(3600)))
+    thread = run_in_thread(scheduler)
+    time.sleep(0.05)
+    start = time.time()
+    scheduler.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert time.time() - start < 0.5
+
+
+def test_run_forever_waits_for_tasks(scheduler):
+    lateness = list()
+    thread = run_in_thread(scheduler, run_forever=True)
+    time.sleep(0.05)
+    # queue is empty, but foreground keeps running
+    assert thread.is_alive()
+    scheduler.add_task(latency_task(lateness, 0.05, 2))
+    time.sleep(0.3)
+    assert len(lateness) == 2
+    assert thread.is_alive()
+    scheduler.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_stop_before_foreground(scheduler, empty):
+    scheduler.add_task(Task(empty, after_x_seconds(3600)))
+    scheduler.stop()
+    # returns immediately, and the stop is consumed
+    scheduler.foreground()
+    assert not scheduler._stopped
+
+
+def sleep_then_append(seconds, l):
+    time.sleep(seconds)
+    l.append(time.time())
+
+
+def raise_value_error():
+    raise ValueError("Error")
+
+
+def test_thread_pool_slow_task_does_not_block(empty):
+    scheduler = Scheduler(execution="thread", workers=4)
+    lateness = list()
+    slow_calls = list()
+    scheduler.add_task(Task(sleep_then_append, after_x_seconds(0.01), call_args=(0.4, slow_calls), just_x_times=1))
+    scheduler.add_task(latency_task(lateness, 0.05, 4))
+    scheduler.foreground()
+    assert len(slow_calls) == 1
+    assert len(lateness) == 4
+    # with inline execution the fast task would be ~0.4 seconds late
+    assert max(lateness) < 0.1
+
+
+def test_thread_pool_no_overlapping_runs():
+    scheduler = Scheduler(execution="thread", workers=4, reschedule_on="dispatch")
+    calls = list()
+    t = Task(sleep_then_append, after_x_seconds(0.02), call_args=(0.15, calls), max_concurrency=1)
+    scheduler.add_task(t)
+    thread = run_in_thread(scheduler)
+    time.sleep(0.5)
+    scheduler.stop()
+    thread.join(1)
+    # at most one run at a time, so no more than ~0.5 / 0.15 runs despite being due every 0.02 seconds
+    assert 1 <= len(calls) <= 4
+    for index in range(len(calls) - 1):
+        assert calls[index + 1] - calls[index] >= 0.14
+
+
+def test_reschedule_on_dispatch_respects_just_x_times():
+    scheduler = Scheduler(execution="thread", workers=4, reschedule_on="dispatch")
+    calls = list()
+    t = Task(sleep_then_append, after_x_seconds(0.01), call_args=(0.1, calls), just_x_times=3)
+    scheduler.add_task(t)
+    scheduler.foreground()
+    assert len(calls) == 3
+    assert t.times_called == 3
+    assert t._running == 0
+
+
+def test_thread_pool_chaining(empty):
+    scheduler = Scheduler(execution="thread")
+    handled = dict()
+    handler = Task(handled.__setitem__, None, call_args=("handler", True))
+    following = Task(handled.__setitem__, None, call_args=("next", True))
+    t = Task(raise_value_error, after_x_seconds(0.01), exception_handler=handler, next_task=following,
+             call_next_task_on_exception=True, just_x_times=1)
+    scheduler.add_task(t)
+    scheduler.foreground()
+    assert handled == {"handler": True, "next": True}
+    assert t._unsuccessful_calls == 1
+    assert handler._successful_calls == 1
+    assert following._successful_calls == 1
+
+
+def test_chained_after_pool_shutdown(empty):
+    from concurrent.futures import Future
+    scheduler = Scheduler(execution="thread")
+    locked = list()
+    handler = Task(lambda: locked.append(scheduler._condition._is_owned()), None)
+    spent = Task(empty, None, just_x_times=1)
+    spent.invoke()
+    t = Task(raise_value_error, after_x_seconds(60), exception_handler=handler, next_task=spent,
+             call_next_task_on_exception=True)
+    scheduler.add_task(t)
+    scheduler.dequeue()
+    future = Future()
+    future.set_exception(ValueError("failed"))
+    # the pool has been shut down, so the chained tasks run on this thread
+    scheduler._in_flight = t._running = 1
+    scheduler._on_complete(t, True, future)
+    assert locked == [False]
+    # next_task hit its call limit, the task is still rescheduled
+    assert scheduler.peek() is t
+
+
+@pytest.mark.parametrize("execution", ["thread", "process"])
+def test_chained_call_limit_in_pool(execution, empty):
+    following = Task(empty, None, just_x_times=1)
+    handler = Task(empty, None, just_x_times=1)
+    ok = Task(empty, after_x_seconds(0.01), just_x_times=3, next_task=following)
+    failing = Task(raise_value_error, after_x_seconds(0.01), just_x_times=3, exception_handler=handler)
+    scheduler = Scheduler(execution=execution, workers=2)
+    scheduler.add_tasks([ok, failing])
+    scheduler.foreground()
+    assert ok.times_called == 3 and failing.times_called == 3
+    # like Task.invoke, chained tasks don't run past their just_x_times
+    assert following.times_called == 1
+    assert handler.times_called == 1
+
+
+def test_process_pool(empty):
+    scheduler = Scheduler(execution="process", workers=2)
+    ok = Task(empty, after_x_seconds(0.01), just_x_times=2)
+    failing = Task(raise_value_error, after_x_seconds(0.01), just_x_times=2)
+    scheduler.add_task(ok)
+    scheduler.add_task(failing)
+    scheduler.foreground()
+    assert ok._successful_calls == 2
+    assert failing._unsuccessful_calls == 2
+
+
+def test_unknown_execution():
+    with pytest.raises(ValueError):
+        Scheduler(execution="greenlet")
+    with pytest.raises(ValueError):
+        Scheduler(execution="thread", reschedule_on="never")
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel"])
+def test_add_tasks(backend, empty):
+    scheduler = Scheduler(backend=backend, tick=0.05)
+    tasks = [Task(empty, after_x_seconds(0.01 * (i % 5 + 1)), just_x_times=2) for i in range(50)]
+    scheduler.add_tasks(tasks)
+    assert len(scheduler) == 50
+    assert scheduler.peek()._next_invoke == min(t._next_invoke for t in tasks)
+    scheduler.foreground()
+    assert all(t.times_called == 2 for t in tasks)
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel"])
+def test_cancel(backend, empty):
+    scheduler = Scheduler(backend=backend, tick=0.05)
+    tasks = [Task(empty, after_x_seconds(0.05), just_x_times=2) for _ in range(6)]
+    scheduler.add_tasks(tasks)
+    assert scheduler.cancel(tasks[0])
+    assert not scheduler.cancel(tasks[0])
+    # cancelling lazily leaves the task in the queue
+    assert len(scheduler) == 6
+    scheduler.cancel(tasks[1])
+    scheduler.cancel(tasks[2])
+    scheduler.cancel(tasks[3])
+    # once most of the queue is cancelled it is compacted
+    assert len(scheduler) < 6
+    scheduler.foreground()
+    assert [t.times_called for t in tasks] == [0, 0, 0, 0, 2, 2]
+    with pytest.raises(ValueError):
+        scheduler.add_task(tasks[0])
+
+
+def test_cancel_where(scheduler, empty):
+    tasks = [Task(empty, after_x_seconds(0.02), call_args=(), just_x_times=1) for _ in range(10)]
+    scheduler.add_tasks(tasks)
+    cancelled = scheduler.cancel_where(lambda t: tasks.index(t) % 2 == 0)
+    assert len(cancelled) == 5
+    assert len(scheduler) == 5
+    assert all(t.cancelled for t in cancelled)
+    scheduler.foreground()
+    assert [t.times_called for t in tasks] == [0, 1] * 5
+
+
+def test_cancel_wakes_foreground(scheduler, empty):
+    t1 = Task(empty, after_x_seconds(3600))
+    t2 = Task(empty, after_x_seconds(0.1), just_x_times=1)
+    scheduler.add_task(t1)
+    scheduler.add_task(t2)
+    thread = run_in_thread(scheduler)
+    time.sleep(0.05)
+    # the only task left is cancelled, so foreground runs out of tasks and returns
+    scheduler.cancel(t1)
+    thread.join(1)
+    assert not thread.is_alive()
+    assert t2.times_called == 1
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel"])
+def test_sorted_view_and_set_max_size(backend, empty):
+    scheduler = Scheduler(backend=backend)
+    tasks = [Task(empty, after_x_seconds(60 * (5 - i))) for i in range(5)]
+    scheduler.add_tasks(tasks)
+    assert list(scheduler.sorted_view()) == tasks[::-1]
+    assert len(scheduler) == 5
+    scheduler.set_max_size(2)
+    assert list(scheduler.sorted_view()) == [tasks[4], tasks[3]]
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel"])
+def test_coalesce_batches(backend, empty):
+    batches = list()
+    calls = list()
+
+    @batch_capable(batches.append)
+    def per_tenant(tenant):
+        calls.append(tenant)
+
+    scheduler = Scheduler(backend=backend, tick=0.05, coalesce=True)
+    tasks = [Task(per_tenant, after_x_seconds(0.05), call_args=(tenant,), just_x_times=2, schedule_immediately=True)
+             for tenant in range(20)]
+    tasks.append(Task(per_tenant, after_x_seconds(0.05), call_kwargs={"tenant": "kwargs"}, just_x_times=2,
+                      schedule_immediately=True))
+    other = Task(empty, after_x_seconds(0.05), just_x_times=2, schedule_immediately=True)
+    scheduler.add_tasks(tasks + [other])
+    scheduler.foreground()
+    # every run of the positional tasks went through the batch function, all 20 at once
+    assert sorted(args[0] for batch in batches for args in batch) == sorted(list(range(20)) * 2)
+    assert all(len(batch) == 20 for batch in batches)
+    assert calls == ["kwargs", "kwargs"]
+    assert all(t.times_called == 2 for t in tasks + [other])
+
+
+def test_coalesce_batch_failure():
+    handled = list()
+
+    def fail(args_list):
+        raise ValueError("batch")
+
+    @batch_capable(fail)
+    def per_tenant(tenant):
+        pass
+
+    scheduler = Scheduler(coalesce=True)
+    handler = Task(handled.append, None, call_args=("handled",))
+    tasks = [Task(per_tenant, after_x_seconds(0), call_args=(i,), just_x_times=1, exception_handler=handler)
+             for i in range(3)]
+    cancelled = Task(per_tenant, after_x_seconds(0), call_args=(3,), just_x_times=1)
+    scheduler.add_tasks(tasks + [cancelled])
+    scheduler.cancel(cancelled)
+    scheduler.foreground()
+    assert [t._unsuccessful_calls for t in tasks] == [1, 1, 1]
+    assert handled == ["handled"] * 3
+    assert cancelled.times_called == 0
+
+
+@pytest.mark.parametrize("producers", ["lock", "inbox"])
+def test_concurrent_producers(producers):
+    scheduler = Scheduler(producers=producers)
+    runs = list()
+    start = threading.Barrier(17)
+
+    def produce(producer):
+        start.wait()
+        for i in range(200):
+            scheduler.add_task(Task(runs.append, after_x_seconds((i % 5) / 100.0), call_args=((producer, i),),
+                                    just_x_times=1))
+        scheduler.add_tasks([Task(runs.append, after_x_seconds(0), call_args=((producer, i),), just_x_times=1)
+                             for i in range(200, 300)])
+
+    foreground = threading.Thread(target=scheduler.foreground, kwargs={"run_forever": True})
+    foreground.start()
+    producers = [threading.Thread(target=produce, args=(producer,)) for producer in range(16)]
+    for thread in producers:
+        thread.start()
+    start.wait()
+    for thread in producers:
+        thread.join()
+    deadline = time.time() + 10
+    while len(runs) < 16 * 300 and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    foreground.join(1)
+    # every task ran exactly once, so no task was lost or duplicated by a corrupted heap
+    assert sorted(runs) == [(producer, i) for producer in range(16) for i in range(300)]
+    assert len(scheduler) == 0
+
+
+def test_inbox_wakes_foreground(empty):
+    scheduler = Scheduler(producers="inbox")
+    scheduler.add_task(Task(empty, after_x_seconds(3600)))
+    ran = threading.Event()
+    thread = run_in_thread(scheduler)
+    time.sleep(0.05)
+    added = time.time()
+    scheduler.add_task(Task(ran.set, after_x_seconds(0), just_x_times=1))
+    assert ran.wait(1)
+    assert time.time() - added < 0.5
+    # a task due later than foreground is waiting for does not wake it up, it stays in the inbox for now
+    scheduler.add_task(Task(empty, after_x_seconds(7200)))
+    time.sleep(0.05)
+    assert len(scheduler._inbox) == 1
+    scheduler.stop()
+    thread.join(1)
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel"])
+def test_fair_runs_higher_priority_first(backend, empty):
+    scheduler = Scheduler(backend=backend, fair=True)
+    runs = list()
+    scheduler.add_tasks([Task(runs.append, after_x_seconds(0), call_args=("cheap",), schedule_immediately=True,
+                              just_x_times=1) for _ in range(50)])
+    # due last, runs first
+    scheduler.add_task(Task(runs.append, after_x_seconds(0), call_args=("critical",), schedule_immediately=True,
+                            just_x_times=1, priority=10))
+    scheduler.foreground()
+    assert runs[0] == "critical"
+    assert len(runs) == 51
+
+
+def test_fair_shares_time_by_weight():
+    scheduler = Scheduler(fair=True)
+    runs = {"light": 0, "heavy": 0}
+
+    def work(name):
+        runs[name] += 1
+        time.sleep(0.001)
+        if sum(runs.values()) == 200:
+            scheduler.stop()
+
+    scheduler.add_task(Task(work, after_x_seconds(0), call_args=("light",)))
+    scheduler.add_task(Task(work, after_x_seconds(0), call_args=("heavy",), weight=3))
+    scheduler.foreground()
+    assert 2.3 < runs["heavy"] / float(runs["light"]) < 3.7
+
+
+def test_fair_validation(empty):
+    with pytest.raises(ValueError):
+        Scheduler(fair=True, coalesce=True)
+    with pytest.raises(ValueError):
+        Task(empty, after_x_seconds(1), weight=0)
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel", "indexed"])
+def test_registry(backend, empty):
+    scheduler = Scheduler(backend=backend, tick=0.05)
+    tasks = [Task(empty, after_x_seconds(60), task_id=i) for i in range(5)]
+    scheduler.add_tasks(tasks)
+    assert scheduler.get_task(3) is tasks[3]
+    with pytest.raises(ValueError):
+        scheduler.add_task(Task(empty, after_x_seconds(60), task_id=3))
+    now = scheduler.clock.time()
+    assert scheduler.run_now(3)
+    assert scheduler.peek() is tasks[3]
+    assert scheduler.reschedule(3, now + 120)
+    assert list(scheduler.sorted_view())[-1] is tasks[3]
+    assert scheduler.update_frequency(1, after_x_seconds(1))
+    assert scheduler.peek() is tasks[1]
+    assert scheduler.pause(1) and not scheduler.pause(1)
+    assert tasks[1] not in list(scheduler.sorted_view())
+    # paused tasks can't be moved
+    assert not scheduler.run_now(1)
+    assert scheduler.resume(1) and not scheduler.resume(1)
+    assert scheduler.peek() is tasks[1]
+    assert scheduler.remove(1) and not scheduler.remove(1)
+    assert scheduler.get_task(1) is None
+    assert tasks[1] not in [task for task in scheduler.sorted_view() if not task.cancelled]
+    assert not scheduler.reschedule(99, now)
+
+
+@pytest.mark.parametrize("producers", [LOCKED_PRODUCERS, INBOX_PRODUCERS])
+def test_registry_failed_batch(producers, empty):
+    scheduler = Scheduler(producers=producers)
+    tasks = [Task(empty, after_x_seconds(60), task_id=i) for i in range(3)]
+    cancelled = Task(empty, after_x_seconds(60), task_id="cancelled")
+    cancelled._cancelled = True
+    with pytest.raises(ValueError):
+        scheduler.add_tasks(tasks + [cancelled])
+    # nothing from the failed batch was registered
+    assert scheduler.get_task(0) is None
+    with pytest.raises(ValueError):
+        scheduler.add_tasks([Task(empty, after_x_seconds(60), task_id=4), Task(empty, after_x_seconds(60), task_id=4)])
+    assert scheduler.get_task(4) is None
+    scheduler.add_tasks(tasks)
+    assert [scheduler.get_task(i) for i in range(3)] == tasks
+
+
+@pytest.mark.parametrize("backend", ["heap", "wheel", "indexed"])
+def test_registry_forgets_dropped_tasks(backend, empty):
+    scheduler = Scheduler(backend=backend, tick=0.05)
+    tasks = [Task(empty, after_x_seconds(60 * (5 - i)), task_id=i) for i in range(5)]
+    scheduler.add_tasks(tasks)
+    scheduler.set_max_size(2)
+    # the three latest were trimmed
+    assert [scheduler.get_task(i) for i in range(5)] == [None, None, None, tasks[3], tasks[4]]
+    with pytest.raises(QueueFullException):
+        scheduler.add_task(Task(empty, after_x_seconds(60), task_id=0))
+    assert scheduler.get_task(0) is None
+    scheduler.set_max_size(0)
+    again = Task(empty, after_x_seconds(60), task_id=0)
+    scheduler.add_task(again)
+    assert scheduler.get_task(0) is again
+    # dropped when the inbox is drained into a full queue
+    scheduler = Scheduler(backend=backend, tick=0.05, max_size=2, producers=INBOX_PRODUCERS)
+    scheduler.add_tasks([Task(empty, after_x_seconds(60), task_id=i) for i in range(3)])
+    with scheduler._condition:
+        scheduler._drain_inbox()
+    assert scheduler.get_task(2) is None
+    scheduler.set_max_size(0)
+    scheduler.add_task(Task(empty, after_x_seconds(60), task_id=2))
+
+
+def test_inbox_adds_without_scheduler_lock(empty):
+    scheduler = Scheduler(producers=INBOX_PRODUCERS)
+    held, release, added = threading.Event(), threading.Event(), threading.Event()
+
+    def hold():
+        with scheduler._condition:
+            held.set()
+            release.wait(5)
+
+    def add():
+        scheduler.add_task(Task(empty, after_x_seconds(60)))
+        scheduler.add_tasks([Task(empty, after_x_seconds(60), task_id=i) for i in range(3)])
+        added.set()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(5)
+    threading.Thread(target=add).start()
+    try:
+        # producers don't wait for foreground (or anything else) holding the scheduler's lock
+        assert added.wait(1)
+    finally:
+        release.set()
+        holder.join()
+    assert scheduler.get_task(2) is not None
+
+
+def test_registry_while_running(empty):
+    scheduler = Scheduler()
+    runs = list()
+
+    def run():
+        runs.append(time.time())
+        if len(runs) == 1:
+            # paused while it runs, it is set aside once it finishes
+            assert scheduler.pause("t")
+            assert not scheduler.run_now("t")
+
+    task = Task(run, after_x_seconds(0.01), task_id="t", schedule_immediately=True)
+    scheduler.add_task(task)
+    scheduler.add_task(Task(scheduler.stop, after_x_seconds(0.2), just_x_times=1))
+    scheduler.foreground(run_forever=True)
+    assert len(runs) == 1
+    assert scheduler._paused == {"t": task}
+    scheduler.resume("t")
+    scheduler.add_task(Task(scheduler.stop, after_x_seconds(0.1), just_x_times=1))
+    scheduler.foreground(run_forever=True)
+    assert len(runs) > 3
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+import occasionally
+from occasionally.__main__ import main
+from occasionally.retry import RetryPolicy
+from occasionally.spec import from_dict, resolve
+
+calls = list()
+
+
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+def test_lazy_exports():
+    code = ("import sys, occasionally; assert 'occasionally.scheduler' not in sys.modules; "
+            "assert 'logging' not in sys.modules; occasionally.Scheduler; "
+            "assert 'occasionally.scheduler' in sys.modules")
+    subprocess.check_call([sys.executable, "-c", code],
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(occasionally.__file__))))
+    from occasionally.scheduler import Scheduler
+    assert occasionally.Scheduler is Scheduler
+    assert "Task" in dir(occasionally)
+    with pytest.raises(AttributeError):
+        occasionally.NotAThing
+
+
+def test_from_dict():
+    scheduler = from_dict({
+        "scheduler": {"spread": 60, "circuit_breakers": {"db": {"failure_threshold": 2}}},
+        "tasks": [
+            {"call": "test_spec:record", "args": [1], "after_seconds": 300, "task_id": "a", "tag": "db",
+             "retry": {"max_attempts": 4}},
+            {"call": "test_spec:record", "kwargs": {"b": 2}, "daily_at": "09:30", "weekdays": ["mon"]},
+        ],
+    })
+    first, second = sorted(scheduler.sorted_view(), key=lambda task: task.task_id is None)
+    assert first.task_id == "a" and first.tag == "db" and isinstance(first.retry, RetryPolicy)
+    assert first.phase is not None and first._call_args == (1,)
+    assert second._frequency_function.next_fire is not None
+    assert resolve("os.path:join") is __import__("os").path.join
+    with pytest.raises(ValueError):
+        from_dict({"tasks": [{"call": "test_spec:record", "after_seconds": 1, "cron": "* * * * *"}]})
+    with pytest.raises(ValueError):
+        from_dict({"tasks": [{"call": "test_spec:record", "after_seconds": 1, "frequency": 1}]})
+    # tz and weekdays only apply to the schedules that use them
+    for task_spec in ({"after_seconds": 1, "tz": "UTC"}, {"every_seconds": 1, "weekdays": ["mon"]},
+                      {"cron": "0 9 * * *", "weekdays": ["mon"]}):
+        task_spec["call"] = "test_spec:record"
+        with pytest.raises(ValueError):
+            from_dict({"tasks": [task_spec]})
+
+
+def test_main(tmpdir, capsys):
+    spec = tmpdir.join("schedule.json")
+    spec.write(json.dumps({"tasks": [
+        {"call": "test_spec:record", "args": ["x"], "after_seconds": 0.01, "schedule_immediately": True,
+         "just_x_times": 3, "task_id": "x"},
+    ]}))
+    del calls[:]
+    assert main([str(spec), "--check"]) == 0
+    assert "x" in capsys.readouterr().out and calls == []
+    assert main([str(spec)]) == 0
+    assert calls == [(("x",), {})] * 3
+    assert main([str(tmpdir.join("missing.json"))]) == 2
+
+
+def test_main_unknown_time_zone(tmpdir, capsys):
+    spec = tmpdir.join("schedule.json")
+    spec.write(json.dumps({"tasks": [
+        {"call": "test_spec:record", "cron": "0 9 * * *", "tz": "Mars/Olympus_Mons"},
+    ]}))
+    assert main([str(spec), "--check"]) == 2
+    assert "Unknown time zone 'Mars/Olympus_Mons'" in capsys.readouterr().err
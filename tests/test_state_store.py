@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+import pytest
+from occasionally.scheduler import Scheduler
+from occasionally.state_store import StateStore
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+
+
+@pytest.fixture
+def path(tmp_path):
+    yield str(tmp_path / "state")
+
+
+def make_task(task_id, next_invoke, successful=0, unsuccessful=0):
+    t = Task(None, None, task_id=task_id)
+    t._next_invoke = next_invoke
+    t._successful_calls = successful
+    t._unsuccessful_calls = unsuccessful
+    return t
+
+
+def test_journal_round_trip(path):
+    store = StateStore(path, fsync=False)
+    store.record(make_task("a", 1.5, 1, 0))
+    store.record(make_task("b", 2.5, 0, 1))
+    store.record(make_task("a", 3.5, 2, 0))
+    # tasks without an id are not persisted
+    store.record(make_task(None, 4.5))
+    store.close()
+    store = StateStore(path)
+    assert len(store) == 2
+    assert store.get("a") == (3.5, 2, 0)
+    assert store.get("b") == (2.5, 0, 1)
+    assert store.get("c") is None
+    store.close()
+
+
+def test_compaction(path):
+    store = StateStore(path, compact_every=3, fsync=False)
+    for i in range(10):
+        store.record(make_task(i % 4, float(i), i, 0))
+        store.flush()
+    store.record(make_task("none", None))
+    store.compact()
+    assert os.path.getsize(path + ".journal") == 0
+    store.close()
+    store = StateStore(path)
+    assert [store.get(i) for i in range(4)] == [(8.0, 8, 0), (9.0, 9, 0), (6.0, 6, 0), (7.0, 7, 0)]
+    assert store.get("none") == (None, 0, 0)
+    store.close()
+
+
+def test_truncated_journal_is_ignored(path):
+    store = StateStore(path, fsync=False)
+    store.record(make_task("a", 1.0, 1, 0))
+    store.flush()
+    store.record(make_task("a", 2.0, 2, 0))
+    store.close()
+    # simulate a crash in the middle of writing the last batch
+    with open(path + ".journal", "r+b") as f:
+        f.truncate(os.path.getsize(path + ".journal") - 3)
+    store = StateStore(path)
+    assert store.get("a") == (1.0, 1, 0)
+    # new batches are appended after the last good one
+    store.record(make_task("a", 3.0, 3, 0))
+    store.close()
+    assert StateStore(path).get("a") == (3.0, 3, 0)
+
+
+def test_background_flusher(path):
+    store = StateStore(path, flush_interval=0.05, fsync=False)
+    store.record(make_task("a", 1.0, 1, 0))
+    time.sleep(0.3)
+    # written without calling flush or close
+    assert StateStore(path).get("a") == (1.0, 1, 0)
+    store.close()
+
+
+def test_scheduler_warm_restart(path, empty):
+    store = StateStore(path, fsync=False)
+    scheduler = Scheduler(state_store=store)
+    limited = Task(empty, after_x_seconds(0.01), just_x_times=3, task_id="limited")
+    hourly = Task(empty, after_x_seconds(3600), schedule_immediately=True, just_x_times=2, task_id="hourly")
+    scheduler.add_tasks([limited, hourly])
+    thread_scheduler_until(scheduler, lambda: limited.times_called == 3 and hourly.times_called == 1)
+    store.close()
+
+    # restart with fresh task objects
+    store = StateStore(path)
+    scheduler = Scheduler(state_store=store)
+    limited = Task(empty, after_x_seconds(0.01), just_x_times=3, task_id="limited")
+    hourly = Task(empty, after_x_seconds(3600), schedule_immediately=True, just_x_times=2, task_id="hourly")
+    scheduler.add_tasks([limited, hourly])
+    # limited already ran its 3 times, hourly is not due again for an hour rather than running immediately
+    assert len(scheduler) == 1
+    assert hourly.times_called == 1
+    assert hourly._next_invoke > time.time() + 3000
+    store.close()
+
+
+def thread_scheduler_until(scheduler, condition):
+    thread = threading.Thread(target=scheduler.foreground)
+    thread.start()
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    thread.join()
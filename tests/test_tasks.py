@@ -1,6 +1,8 @@
 import time
 import pytest
 from occasionally.task import Task, MaxCallException
+from occasionally import time_helpers
+from occasionally.time_helpers import after_x_seconds, after_x_mintes, after_x_hours
 
 def mutate_dict(d, k, v):
     # dict[key] = value. lambda's can't have assignments in them
@@ -50,3 +52,87 @@ def test_max_invoke(empty):
         t.set_next_invoke()
     with pytest.raises(MaxCallException):
         t.invoke()
+
+def test_schedule_immediately(empty):
+    t = Task(empty, lambda: 5, schedule_immediately=True)
+    now = time.time()
+    t.set_next_invoke()
+    assert abs(t._next_invoke - now) < 1
+    t.invoke()
+    # only the first invoke is immediate
+    t.set_next_invoke()
+    assert abs(t._next_invoke - now - 5) < 1
+
+def test_compact_task(empty):
+    t = Task(mutate_dict, after_x_seconds(5), call_args=[dict(), "k", "v"])
+    assert not hasattr(t, "__dict__")
+    # args are stored as a tuple
+    assert isinstance(t._call_args, tuple)
+    t.invoke()
+    assert t._successful_calls == 1
+    # tasks without kwargs share one read only empty mapping
+    assert t._call_kwargs is Task(empty, after_x_seconds(5))._call_kwargs
+
+def test_interned_frequency_functions():
+    assert after_x_seconds(5) is after_x_seconds(5)
+    assert after_x_seconds(5) is not after_x_seconds(5.0)
+    assert after_x_mintes(2) is after_x_mintes(2)
+    assert after_x_mintes(2)() == 120
+    assert after_x_hours(1) is not after_x_mintes(1)
+    assert after_x_hours(1)() == 3600
+
+def test_interned_frequency_functions_bounded():
+    first = after_x_seconds(5)
+    for seconds in range(1000, 1000 + time_helpers._INTERN_SIZE * 2):
+        after_x_seconds(seconds)
+    assert len(time_helpers._interned) == time_helpers._INTERN_SIZE
+    # evicted, but still works
+    assert after_x_seconds(5) is not first
+    assert after_x_seconds(5)() == 5
+    # recently used values stay interned
+    for seconds in range(time_helpers._INTERN_SIZE):
+        after_x_seconds(5)
+        after_x_seconds(seconds)
+    assert after_x_seconds(5) is after_x_seconds(5)
+
+def test_unhashable_frequency_value():
+    seconds = [5]
+    function = after_x_seconds(seconds)
+    assert function() == [5]
+    assert function is not after_x_seconds(seconds)
+
+def test_spread_phase(empty):
+    tasks = [Task(empty, after_x_seconds(60), task_id="tenant-%d" % i, spread=60) for i in range(100)]
+    # the same in every process, and different for different tasks
+    assert tasks[0].phase == Task(empty, after_x_seconds(60), task_id="tenant-0", spread=60).phase
+    assert all(0 <= task.phase < 60 for task in tasks)
+    assert len(set(task.phase for task in tasks)) == 100
+    task = tasks[0]
+    task.set_next_invoke(1000.0)
+    assert task._next_invoke == 1060.0 + task.phase
+    task.invoke()
+    # interval tasks keep their phase from the first run on
+    task.set_next_invoke(2000.0)
+    assert task._next_invoke == 2060.0
+    # without a task_id the phase is random, spread out within this process only
+    phases = set(Task(empty, after_x_seconds(60), call_args=(object(),), spread=60).phase for _ in range(100))
+    assert len(phases) == 100 and all(0 <= phase < 60 for phase in phases)
+
+def test_spread_phase_across_processes(empty):
+    import os
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("from occasionally.task import Task; "
+            "print(repr(Task(len, None, call_args=(object(),), task_id='tenant-0', spread=60).phase))")
+    phases = set(subprocess.check_output([sys.executable, "-c", code], cwd=root).strip() for _ in range(2))
+    assert phases == {repr(Task(empty, None, task_id="tenant-0", spread=60).phase).encode("ascii")}
+
+def test_jitter(empty):
+    t = Task(empty, after_x_seconds(10), jitter=2)
+    delays = set()
+    for _ in range(50):
+        t.set_next_invoke(0.0)
+        delays.add(t._next_invoke)
+    assert all(10 <= delay <= 12 for delay in delays)
+    assert len(delays) > 1
@@ -0,0 +1,89 @@
+import heapq
+import random
+import pytest
+from occasionally.priority_queue import QueueEmptyException, QueueFullException
+from occasionally.timing_wheel import TimingWheel
+
+
+def identity(x):
+    return x
+
+
+@pytest.mark.parametrize("slots", [(60, 60, 24), (4,), (3, 5), (2, 2, 2)])
+@pytest.mark.parametrize("tick", [1.0, 0.25, 7])
+def test_matches_heap_order(slots, tick):
+    rng = random.Random(1)
+    wheel = TimingWheel(identity, tick=tick, slots=slots)
+    reference = list()
+    for _ in range(5000):
+        if not reference or rng.random() < 0.55:
+            # mix of items due in the current tick, within each wheel, in the overflow heap, and already overdue
+            base = reference[0] if reference else 0
+            val = base + rng.choice([rng.random() * 5, rng.random() * 500, rng.random() * 1e5, rng.random() * 1e6,
+                                     -rng.random() * 10])
+            wheel.enqueue(val)
+            heapq.heappush(reference, val)
+        else:
+            assert wheel.peek() == reference[0]
+            assert wheel.dequeue() == heapq.heappop(reference)
+    assert len(wheel) == len(reference)
+    while reference:
+        assert wheel.dequeue() == heapq.heappop(reference)
+
+
+def test_cascades_from_overflow():
+    wheel = TimingWheel(identity)
+    for val in (10 * 86400.0, 3600.5, 61.0, 0.0):
+        wheel.enqueue(val)
+    assert [wheel.dequeue() for _ in range(4)] == [0.0, 61.0, 3600.5, 10 * 86400.0]
+
+
+def test_errors():
+    wheel = TimingWheel(identity, max_size=1)
+    with pytest.raises(QueueEmptyException):
+        wheel.peek()
+    with pytest.raises(QueueEmptyException):
+        wheel.dequeue()
+    wheel.enqueue(1)
+    with pytest.raises(QueueFullException):
+        wheel.enqueue(2)
+    with pytest.raises(ValueError):
+        TimingWheel(identity, tick=0)
+
+
+def test_enqueue_many_and_remove_where():
+    wheel = TimingWheel(identity, slots=(4, 4))
+    values = [0.5, 2.0, 7.0, 20.0, 100.0, 3.0]
+    wheel.enqueue_many(values)
+    # move some of them into the ready heap
+    assert wheel.dequeue() == 0.5
+    removed = wheel.remove_where(lambda x: x in (2.0, 20.0, 100.0))
+    assert sorted(removed) == [2.0, 20.0, 100.0]
+    assert len(wheel) == 2
+    assert sorted(wheel._elements()) == [3.0, 7.0]
+    assert [wheel.dequeue(), wheel.dequeue()] == [3.0, 7.0]
+    with pytest.raises(QueueFullException):
+        TimingWheel(identity, max_size=1).enqueue_many([1, 2])
+
+
+def test_sorted_view_and_set_max_size():
+    wheel = TimingWheel(identity, slots=(4, 4))
+    values = [90.0, 0.5, 7.0, 3.0, 20.0, 2.0]
+    wheel.enqueue_many(values)
+    assert wheel.dequeue() == 0.5
+    assert list(wheel.sorted_view()) == [2.0, 3.0, 7.0, 20.0, 90.0]
+    assert len(wheel) == 5
+    wheel.set_max_size(3)
+    assert len(wheel) == 3
+    assert [wheel.dequeue() for _ in range(3)] == [2.0, 3.0, 7.0]
+
+
+def test_dequeue_up_to():
+    wheel = TimingWheel(identity, slots=(4, 4))
+    values = [90.0, 0.5, 7.0, 3.0, 20.0, 2.0, 3.5]
+    wheel.enqueue_many(values)
+    assert wheel.dequeue_up_to(3.5) == [0.5, 2.0, 3.0, 3.5]
+    assert wheel.dequeue_up_to(3.9) == []
+    assert wheel.dequeue_up_to(50) == [7.0, 20.0]
+    assert len(wheel) == 1
+    assert wheel.dequeue() == 90.0
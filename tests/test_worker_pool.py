@@ -0,0 +1,122 @@
+import os
+import time
+import pytest
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+from occasionally.worker_pool import IsolatedPool, WorkerDiedException, WorkerTimeoutException, WorkerRemoteException
+
+# called in the workers, so they have to be importable
+_leaked = list()
+
+
+def add(x, y=0):
+    return x + y
+
+
+def fail():
+    raise KeyError("missing")
+
+
+class TwoArgumentError(Exception):
+    # pickles as TwoArgumentError(message), which can't be unpickled
+    def __init__(self, message, code):
+        super(TwoArgumentError, self).__init__(message)
+        self.code = code
+
+
+def fail_unpicklable():
+    raise TwoArgumentError("missing", 3)
+
+
+def crash():
+    os._exit(3)
+
+
+def leak(megabytes):
+    _leaked.append(bytearray(megabytes * 1024 * 1024))
+    return os.getpid()
+
+
+def record_pid(path):
+    with open(path, "a") as f:
+        f.write("%d\n" % os.getpid())
+
+
+@pytest.fixture
+def pool():
+    pool = IsolatedPool(workers=1, timeout=5)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_results_and_exceptions(pool):
+    assert pool.submit(add, 1, y=2).result() == 3
+    with pytest.raises(KeyError) as info:
+        pool.submit(fail).result()
+    # the worker's traceback is kept
+    assert "in fail" in str(info.value.__cause__)
+    assert pool.submit(add, 2, 2).result() == 4
+    assert pool.recycled == 0
+
+
+def test_unpicklable_exception(pool):
+    futures = [pool.submit(fail_unpicklable), pool.submit(add, 1, 1)]
+    with pytest.raises(WorkerRemoteException) as info:
+        futures[0].result(timeout=5)
+    assert "in fail_unpicklable" in info.value.text
+    # the slot keeps serving
+    assert futures[1].result(timeout=5) == 2
+
+
+def test_timeout_kills_the_worker():
+    pool = IsolatedPool(workers=1, timeout=0.2)
+    try:
+        with pytest.raises(WorkerTimeoutException):
+            pool.submit(time.sleep, 10).result()
+        assert pool.submit(add, 1).result() == 1
+        assert pool.recycled == 1
+    finally:
+        pool.shutdown()
+
+
+def test_crash(pool):
+    with pytest.raises(WorkerDiedException):
+        pool.submit(crash).result()
+    assert pool.submit(add, 5).result() == 5
+
+
+def test_recycles_after_max_tasks():
+    pool = IsolatedPool(workers=1, max_tasks=2)
+    try:
+        pids = [pool.submit(os.getpid).result() for _ in range(6)]
+        assert len(set(pids)) == 3
+        assert os.getpid() not in pids
+    finally:
+        pool.shutdown()
+
+
+def test_recycles_after_max_rss():
+    pool = IsolatedPool(workers=1, max_rss_mb=200)
+    try:
+        pids = [pool.submit(leak, 64).result() for _ in range(6)]
+        # a worker is replaced once it has leaked past 200MB, i.e. after its third or fourth call
+        assert 2 <= len(set(pids)) <= 3
+        assert pool.recycled >= 1
+    finally:
+        pool.shutdown()
+
+
+def test_scheduler_runs_isolated_tasks_in_the_pool(tmpdir):
+    path = str(tmpdir.join("pids"))
+    scheduler = Scheduler(isolation=IsolatedPool(workers=1))
+    scheduler.add_task(Task(record_pid, after_x_seconds(0.01), call_args=(path,), just_x_times=2, isolated=True))
+    scheduler.add_task(Task(record_pid, after_x_seconds(0.01), call_args=(path,), just_x_times=1))
+    scheduler.foreground()
+    with open(path) as f:
+        pids = [int(line) for line in f]
+    assert sorted(pids).count(os.getpid()) == 1
+    assert len(pids) == 3
+    with pytest.raises(ValueError):
+        Scheduler().add_task(Task(add, after_x_seconds(1), isolated=True))
@@ -0,0 +1,88 @@
+import threading
+import pytest
+from occasionally.scheduler import Scheduler
+from occasionally.task import Task
+from occasionally.time_helpers import after_x_seconds
+from occasionally.workflow import Workflow, WorkflowException
+
+
+def add(*values):
+    return sum(values)
+
+
+def fail(*values):
+    raise ValueError("step failed")
+
+
+def diamond(fan_out_function=add):
+    workflow = Workflow()
+    # added out of order on purpose
+    workflow.add_step("total", add, depends_on=("left", "right"))
+    workflow.add_step("left", fan_out_function, depends_on=("source",), args=(10,))
+    workflow.add_step("right", add, depends_on=("source",), args=(100,))
+    workflow.add_step("source", lambda: 1)
+    workflow.add_step("after", add, depends_on=("total",))
+    return workflow
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_results_flow_along_edges(workers):
+    results = diamond().run(workers=workers)
+    assert results == {"source": 1, "left": 11, "right": 101, "total": 112, "after": 112}
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_failure_skips_downstream(workers):
+    with pytest.raises(WorkflowException) as raised:
+        diamond(fail).run(workers=workers)
+    assert list(raised.value.failures) == ["left"]
+    assert sorted(raised.value.skipped) == ["after", "total"]
+    assert raised.value.results == {"source": 1, "right": 101}
+
+
+def test_branches_run_in_parallel():
+    # each branch waits for the other, which only finishes if both run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    workflow = Workflow()
+    for name in ("a", "b"):
+        workflow.add_step(name, barrier.wait)
+    workflow.add_step("joined", lambda a, b: sorted((a, b)), depends_on=("a", "b"))
+    assert workflow.run(workers=2)["joined"] == [0, 1]
+
+
+def test_invalid_graphs():
+    workflow = Workflow()
+    workflow.add_step("a", add)
+    with pytest.raises(ValueError):
+        workflow.add_step("a", add)
+    workflow.add_step("b", add, depends_on=("missing",))
+    with pytest.raises(ValueError):
+        workflow.run()
+    workflow = Workflow()
+    workflow.add_step("a", add, depends_on=("c",))
+    workflow.add_step("b", add, depends_on=("a",))
+    workflow.add_step("c", add, depends_on=("b",))
+    workflow.add_step("d", add)
+    with pytest.raises(ValueError, match="a, b, c"):
+        workflow.run()
+
+
+def test_scheduled_workflow():
+    runs = list()
+    workflow = diamond()
+    workflow.add_step("record", runs.append, depends_on=("after",))
+    scheduler = Scheduler()
+    scheduler.add_task(workflow.as_task(after_x_seconds(0), workers=2, just_x_times=3))
+    scheduler.foreground()
+    assert runs == [112, 112, 112]
+
+
+def test_long_next_task_chain():
+    calls = list()
+    task = None
+    for i in range(20000):
+        task = Task(calls.append, None, call_args=(i,), next_task=task)
+    # would hit the recursion limit if next tasks were invoked recursively
+    task.invoke()
+    assert len(calls) == 20000
+    assert calls[0] == 19999